@@ -1,20 +1,63 @@
 # app.py
+import io
+import json
 import time
 import os
-import cv2
 import threading
+import zipfile
 import requests
-from flask import Flask, request, jsonify, render_template, Response, send_file
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from flask import Flask, request, jsonify, render_template, Response, send_file, g
 from requests.auth import HTTPDigestAuth
-from db import get_conn, init_db
+import db
+from db import init_db, PoolTimeout
+import capture_pool
+from passthrough import passthrough
+from health import HealthPoller
+from registry import CameraRegistry
+from events import bus
+from list_cache import VersionedList
+from snapshots import store
+from camera_http import sessions as camera_sessions
+from ptz_queue import PTZQueues
+from session_history import tracker as session_tracker
+import recorder
+import mosaic
 
 app = Flask(__name__)
 init_db()
+# capture threads, or worker processes with CAPTURE_PROCESSES=N
+hub = capture_pool.make_hub()
+
+
+def get_conn():
+    """Request-scoped pooled connection, returned to the pool on teardown"""
+    con = g.get("db_conn")
+    if con is None:
+        con = g.db_conn = db.get_conn()
+    return con
+
+
+@app.teardown_appcontext
+def release_conn(exc):
+    con = g.pop("db_conn", None)
+    if con is not None:
+        con.close()
+
+
+@app.errorhandler(PoolTimeout)
+def pool_exhausted(e):
+    return jsonify({"error": "database busy, try again"}), 503
+
 
 @app.after_request
 def add_no_cache_headers(resp):
     # Avoid caching API GETs in some environments
-    if request.path.startswith("/api/"):
+    if request.path.startswith("/api/") and resp.headers.get("ETag"):
+        # versioned lists: browsers may keep them but must revalidate (304)
+        resp.headers["Cache-Control"] = "no-cache"
+    elif request.path.startswith("/api/"):
         resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
         resp.headers["Pragma"] = "no-cache"
         resp.headers["Expires"] = "0"
@@ -26,10 +69,42 @@ USERNAME = "admin"
 PASSWORD = "admin123"
 
 
+# Every process runs a poller; the one holding the DB lease probes the
+# cameras, the others follow the statuses it writes (see health.py).
+poller = HealthPoller(HTTPDigestAuth(USERNAME, PASSWORD))
+poller.ensure_started()
+registry = CameraRegistry(USERNAME, PASSWORD)
+registry.reload()
+store.ensure_started()
+
+
 def rtsp_url(ip, user=USERNAME, pwd=PASSWORD, channel=1, subtype=0, port=554):
     return f"rtsp://{user}:{pwd}@{ip}:{port}/cam/realmonitor?channel={channel}&subtype={subtype}"
 
 
+# 24/7 recording runs in one process only (POLYCAB_RECORDER=1); every
+# worker can list and export what it catalogued.
+recordings = recorder.Recorder(rtsp_url)
+if recorder.ENABLED:
+    recordings.ensure_started()
+
+
+# Widest tile (px) still served from the camera's substream (subtype=1);
+# CP Plus substreams are D1/VGA, about 704 px wide.
+SUBSTREAM_MAX_WIDTH = 704
+# MJPEG viewers get change-gated streams unless they ask otherwise (?gate=).
+MJPEG_GATE_DEFAULT = os.environ.get("MJPEG_CHANGE_GATE") == "1"
+
+
+def pick_subtype(profile, width=None):
+    """0 = main stream, 1 = substream. "auto" picks by requested width."""
+    if profile == "main":
+        return 0
+    if profile == "sub":
+        return 1
+    return 1 if width and width <= SUBSTREAM_MAX_WIDTH else 0
+
+
 def http_base(ip):
     return f"http://{ip}"
 
@@ -39,37 +114,38 @@ def timestamp():
 
 
 def send_ptz(ip, action, code=None, speed=5):
-    base = http_base(ip)
     ptz_action = "start" if action == "start" else "stop"
-    url = f"{base}/cgi-bin/ptz.cgi?action={ptz_action}&channel=1"
+    path = f"/cgi-bin/ptz.cgi?action={ptz_action}&channel=1"
     if code:
-        url += f"&code={code}&arg1=0&arg2={speed}&arg3=0"
-    print("url: ", url)
-    r = requests.get(url, auth=HTTPDigestAuth(USERNAME, PASSWORD), timeout=4)
+        path += f"&code={code}&arg1=0&arg2={speed}&arg3=0"
+    print("url: ", http_base(ip) + path)
+    # kept-alive connection and cached digest nonce: no TCP connect and no
+    # 401 round trip per joystick move
+    try:
+        r = camera_sessions.get(ip, USERNAME, PASSWORD).get(path)
+    except requests.RequestException as e:
+        return False, f"PTZ request failed ({e})"
     if r.status_code == 200:
         return True, f"PTZ {ptz_action} {code or ''} ok"
     return False, f"PTZ failed ({r.status_code})"
 
 
-def mjpeg_generator(rtsp):
-    cap = cv2.VideoCapture(rtsp, cv2.CAP_FFMPEG)
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    if not cap.isOpened():
-        print(f"Error: cannot open stream: {rtsp}")
-        return
-    while True:
-        # grab/retrieve to skip buffered frames
-        cap.grab()
-        ok, frame = cap.retrieve()
-        if not ok or frame is None:
-            break
-        ok, buf = cv2.imencode(".jpg", frame)
-        if not ok:
-            continue
-        yield (
-            b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + buf.tobytes() + b"\r\n"
-        )
-    cap.release()
+# Per-camera ordered PTZ workers: handlers return once the command is queued
+ptz_queues = PTZQueues(send_ptz)
+
+
+def mjpeg_generator(cam_id, rtsp, width=None, quality=None, fps=None, client=None,
+                    lab_id=None, gated=False):
+    # frames come from the shared per-camera worker, so N viewers cost one
+    # RTSP session and one encode loop per output size
+    session = session_tracker.open("view", client, cam_id, lab_id)
+    try:
+        for jpeg in hub.frames(cam_id, rtsp, width, quality, fps, client, gated):
+            yield (
+                b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + jpeg + b"\r\n"
+            )
+    finally:
+        session_tracker.close(session)
 
 
 from flask import send_from_directory
@@ -95,27 +171,217 @@ def index():
 @app.route("/video_feed")
 def video_feed():
     """
-    GET /video_feed?cam_id=1
+    GET /video_feed?cam_id=1&width=640&quality=70&profile=auto|main|sub&fps=10
+    width: tile width in px; frames wider than this are downscaled
+    quality: JPEG quality 1..100
+    profile: "auto" uses the substream for tiles up to SUBSTREAM_MAX_WIDTH
+    fps: per-viewer frame rate cap; a slow client gets the newest frame,
+         never a backlog
+    gate: 1 = send only frames that changed (plus a keepalive once a
+          second), 0 = every frame; default from MJPEG_CHANGE_GATE
     """
     try:
         cam_id = int(request.args.get("cam_id", "0"))
     except ValueError:
         return "bad cam_id", 400
-
-    # fetch ip from DB (in case camera was added dynamically)
-    con = get_conn()
-    cur = con.cursor()
-    ip = cur.execute(
-        "SELECT Camera_IP FROM Camera_Setting WHERE Camera_ID = ?", (cam_id,)
-    ).fetchval()
-    if not ip:
+    try:
+        width = int(request.args.get("width", "0")) or None
+        quality = int(request.args.get("quality", "0")) or None
+        fps = float(request.args.get("fps", "0")) or None
+    except ValueError:
+        return "bad width/quality/fps", 400
+    profile = request.args.get("profile", "auto")
+    if profile not in ("auto", "main", "sub"):
+        return "bad profile", 400
+    if width is not None and width < 0:
+        return "bad width", 400
+    if quality is not None:
+        quality = max(1, min(quality, 100))
+    if fps is not None and fps < 0:
+        return "bad fps", 400
+    gate = request.args.get("gate")
+    if gate not in (None, "0", "1"):
+        return "bad gate", 400
+    gated = MJPEG_GATE_DEFAULT if gate is None else gate == "1"
+
+    # cached lookup: no DB round trip on the stream/PTZ hot path
+    cam = registry.get(cam_id)
+    if not cam:
         return "unknown camera", 404
-    rtsp = rtsp_url(ip)
+    rtsp = rtsp_url(cam["ip"], subtype=pick_subtype(profile, width))
     return Response(
-        mjpeg_generator(rtsp), mimetype="multipart/x-mixed-replace; boundary=frame"
+        mjpeg_generator(
+            cam_id, rtsp, width, quality, fps, request.remote_addr, cam["labId"], gated
+        ),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
     )
 
 
+def mosaic_generator(wall, cams, client=None):
+    # one view session per camera in the mosaic, as if each had its own tile
+    sessions = [session_tracker.open("view", client, cam["id"], cam["labId"]) for cam in cams]
+    try:
+        for jpeg in wall.frames():
+            yield (
+                b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + jpeg + b"\r\n"
+            )
+    finally:
+        for session in sessions:
+            session_tracker.close(session)
+
+
+@app.route("/video_feed/mosaic")
+def video_feed_mosaic():
+    """
+    GET /video_feed/mosaic?layout=2x2&cams=1,2,3,4&width=1280&height=720&fps=5&quality=70
+    One MJPEG stream with every camera composited into a grid, so a video
+    wall costs the browser one connection and the server one encode per
+    output frame instead of one per tile.
+    layout: COLSxROWS (default: the smallest square grid that fits cams)
+    cams: camera ids in reading order; an empty entry ("1,,3") leaves a
+          cell blank
+    width/height: output size in px; fps: output frame rate cap
+    quality: JPEG quality 1..100
+    Tiles of cameras that stop delivering show their last frame dimmed
+    with an "offline" label and reconnect in the background.
+    """
+    try:
+        ids = [int(c) if c.strip() else None for c in request.args.get("cams", "").split(",")]
+    except ValueError:
+        return "bad cams", 400
+    if not any(i is not None for i in ids):
+        return "cams required", 400
+    try:
+        layout = request.args.get("layout")
+        if layout is None:
+            side = 1
+            while side * side < len(ids):
+                side += 1
+            layout = f"{side}x{side}"
+        cols, rows = mosaic.parse_layout(layout)
+    except ValueError as e:
+        return str(e), 400
+    if len(ids) > cols * rows:
+        return f"{len(ids)} cams do not fit layout {cols}x{rows}", 400
+    try:
+        width = int(request.args.get("width", mosaic.DEFAULT_WIDTH))
+        height = int(request.args.get("height", mosaic.DEFAULT_HEIGHT))
+        fps = float(request.args.get("fps", mosaic.DEFAULT_FPS))
+        quality = int(request.args.get("quality", mosaic.DEFAULT_QUALITY))
+    except ValueError:
+        return "bad width/height/fps/quality", 400
+    if not (cols <= width <= mosaic.MAX_WIDTH and rows <= height <= mosaic.MAX_HEIGHT):
+        return f"width/height must be at most {mosaic.MAX_WIDTH}x{mosaic.MAX_HEIGHT}", 400
+    if not 0 < fps <= mosaic.MAX_FPS:
+        return f"fps must be in (0, {mosaic.MAX_FPS:g}]", 400
+    quality = max(1, min(quality, 100))
+
+    # cached lookups: no DB round trip on the stream hot path
+    cams = []
+    cells = []
+    subtype = pick_subtype("auto", width // cols)
+    for cam_id in ids:
+        if cam_id is None:
+            cells.append(None)
+            continue
+        cam = registry.get(cam_id)
+        if not cam:
+            return f"unknown camera {cam_id}", 404
+        cams.append(cam)
+        cells.append((cam_id, cam["name"] or f"Camera {cam_id}",
+                      rtsp_url(cam["ip"], subtype=subtype)))
+    wall = mosaic.Mosaic(hub, cells, (cols, rows), width, height, fps, quality)
+    return Response(
+        mosaic_generator(wall, cams, request.remote_addr),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+    )
+
+
+# GET /api/db/pool
+@app.route("/api/db/pool", methods=["GET"])
+def get_db_pool():
+    """Connection pool size, usage and wait-time counters."""
+    return jsonify(db.pool.stats())
+
+
+# GET /api/ptz/sessions
+@app.route("/api/ptz/sessions", methods=["GET"])
+def get_ptz_sessions():
+    """Per-camera keep-alive HTTP sessions: request/error counts and last round trip."""
+    return jsonify(camera_sessions.stats())
+
+
+# GET /api/ptz/queues
+@app.route("/api/ptz/queues", methods=["GET"])
+def get_ptz_queues():
+    """Per-camera PTZ workers: current motion, pending/coalesced commands, last error."""
+    return jsonify(ptz_queues.stats())
+
+
+# GET /api/streams
+@app.route("/api/streams", methods=["GET"])
+def get_streams():
+    """Live capture workers and per-viewer sent/dropped/skipped frame counts."""
+    return jsonify(hub.stats())
+
+
+# GET /api/streams/activity
+@app.route("/api/streams/activity", methods=["GET"])
+def get_stream_activity():
+    """Per live camera: changing now or idle, last change, frames seen vs let through the gate."""
+    return jsonify(hub.activity())
+
+
+@app.route("/video_feed/hls/<int:cam_id>/index.m3u8")
+def video_feed_hls(cam_id):
+    """
+    GET /video_feed/hls/1/index.m3u8?width=640&profile=auto|main|sub
+    Passthrough mode: the camera's H.264 remuxed to HLS without decoding.
+    width/profile pick main stream or substream as for /video_feed.
+    Clients fall back to /video_feed (MJPEG) when this returns an error.
+    """
+    try:
+        width = int(request.args.get("width", "0")) or None
+    except ValueError:
+        return "bad width", 400
+    profile = request.args.get("profile", "auto")
+    if profile not in ("auto", "main", "sub"):
+        return "bad profile", 400
+    # cached lookup: no DB round trip on the stream/PTZ hot path
+    cam = registry.get(cam_id)
+    if not cam:
+        return "unknown camera", 404
+
+    # one remuxer per camera: a running main-stream remux also serves tiles
+    # that would take the substream, so mixed tile sizes never make ffmpeg
+    # restart back and forth
+    rem = passthrough.touch(
+        cam_id,
+        rtsp_url(cam["ip"], subtype=pick_subtype(profile, width)),
+        also=(rtsp_url(cam["ip"]),),
+    )
+    # players re-poll the playlist every segment: each poll extends the session
+    session_tracker.touch("view", request.remote_addr, cam_id, cam["labId"])
+    if not rem.wait_playlist():
+        return "stream unavailable", 502
+    resp = send_from_directory(
+        rem.out_dir, "index.m3u8", mimetype="application/vnd.apple.mpegurl"
+    )
+    # live playlist changes every segment
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.route("/video_feed/hls/<int:cam_id>/<name>")
+def video_feed_hls_segment(cam_id, name):
+    """GET /video_feed/hls/1/seg_00042.m4s (segments and init.mp4)"""
+    rem = passthrough.get(cam_id)
+    if rem is None or not rem.out_dir:
+        return "stream not running", 404
+    mimetype = "video/mp4" if name.endswith((".mp4", ".m4s")) else None
+    return send_from_directory(rem.out_dir, name, mimetype=mimetype)
+
+
 @app.route("/ptz_control", methods=["POST"])
 def ptz_control():
     """
@@ -127,20 +393,20 @@ def ptz_control():
     direction = data.get("direction")
     speed = int(data.get("speed", 5))
 
-    con = get_conn()
-    cur = con.cursor()
-    ip = cur.execute(
-        "SELECT Camera_IP FROM Camera_Setting WHERE Camera_ID = ?", (cam_id,)
-    ).fetchval()
-    if not ip:
+    # cached lookup: no DB round trip on the stream/PTZ hot path
+    cam = registry.get(cam_id)
+    if not cam:
         return jsonify({"error": "unknown camera"}), 404
     if action not in ("start", "stop"):
         return jsonify({"error": "invalid action"}), 400
 
-    ok, msg = send_ptz(ip, action, direction, speed)
-    if ok:
-        return jsonify({"message": msg})
-    return jsonify({"error": msg}), 500
+    # queued per camera; results show up in /api/ptz/queues
+    ptz_queues.submit(cam_id, cam["ip"], action, direction, speed)
+    session_tracker.touch(
+        "control", request.remote_addr, cam_id, cam["labId"],
+        ptz=1 if action == "start" else 0,
+    )
+    return jsonify({"message": f"PTZ {action} {direction or ''} queued"}), 202
 
 
 @app.route("/zoom_control", methods=["POST"])
@@ -153,85 +419,550 @@ def zoom_control():
     action = data.get("action", "start")
     zoom_code = data.get("zoom")
 
-    # fetch the IP of this camera from database
-    con = get_conn()
-    cur = con.cursor()
-    ip = cur.execute(
-        "SELECT Camera_IP FROM Camera_Setting WHERE Camera_ID = ?", (cam_id,)
-    ).fetchval()
-
-    if not ip:
+    # cached lookup: no DB round trip on the stream/PTZ hot path
+    cam = registry.get(cam_id)
+    if not cam:
         return jsonify({"error": "unknown camera"}), 404
 
-    ok, msg = send_ptz(ip, action, zoom_code, speed=5)
-    if ok:
-        return jsonify({"message": msg})
-    return jsonify({"error": msg}), 500
-
-
-def take_snapshot(rtsp, out_dir="./static/capture"):
-    os.makedirs(out_dir, exist_ok=True)
-    cap = cv2.VideoCapture(rtsp, cv2.CAP_FFMPEG)
-    ok, frame = cap.read()
-    cap.release()
-    if not ok or frame is None:
-        return None
-    path = os.path.join(out_dir, f"snapshot_{timestamp()}.jpg")
-    cv2.imwrite(path, frame)
-    return path
-
-def take_snapshot(rtsp, out_dir="./static/capture", suffix=""):
-    os.makedirs(out_dir, exist_ok=True)
-    cap = cv2.VideoCapture(rtsp, cv2.CAP_FFMPEG)
-    ok, frame = cap.read()
-    cap.release()
-    if not ok or frame is None:
-        return None
-    base = f"snapshot_{timestamp()}{suffix}.jpg"
-    path = os.path.join(out_dir, base)
-    cv2.imwrite(path, frame)
-    return path
+    if action not in ("start", "stop"):
+        return jsonify({"error": "invalid action"}), 400
+
+    ptz_queues.submit(cam_id, cam["ip"], action, zoom_code, speed=5)
+    session_tracker.touch(
+        "control", request.remote_addr, cam_id, cam["labId"],
+        ptz=1 if action == "start" else 0,
+    )
+    return jsonify({"message": f"Zoom {action} {zoom_code or ''} queued"}), 202
+
+
+def take_snapshot(cam):
+    """
+    Grab the newest full-resolution frame from the camera's main-stream
+    capture session (a new RTSP connection, kept warm briefly, only if
+    none is live); saving and cataloguing happen off the request thread.
+    Returns (jpeg bytes, path, capture time) or (None, None, None).
+    """
+    jpeg, w, h, captured_at = hub.snapshot_jpeg(cam["id"], rtsp_url(cam["ip"]))
+    if jpeg is None:
+        return None, None, None
+    path = store.add(cam["id"], cam["labId"], jpeg, captured_at, w, h)
+    return jpeg, path, captured_at
+
+
+# Cameras captured at once by one batch snapshot request.
+BATCH_SNAPSHOT_PARALLEL = 16
+
+
+class ZipChunks:
+    """Write-only sink for ZipFile; the response generator drains it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def capture_one(cam):
+    started = time.monotonic()
+    jpeg, path, captured_at = take_snapshot(cam)
+    return jpeg, path, captured_at, round((time.monotonic() - started) * 1000)
+
+
+def batch_snapshot_zip(cams, missing):
+    """
+    Capture every camera in parallel and stream a ZIP: each JPEG is added
+    as soon as its camera answers, so a slow or offline camera only delays
+    itself. manifest.json (last entry) has per-camera latency, capture time
+    and skew from the earliest frame, or the error.
+    """
+    requested_at = time.time()
+    entries = [{"camId": cam_id, "error": "unknown camera"} for cam_id in missing]
+    sink = ZipChunks()
+    pool = ThreadPoolExecutor(
+        max_workers=min(len(cams), BATCH_SNAPSHOT_PARALLEL) or 1,
+        thread_name_prefix="batch-snapshot",
+    )
+    try:
+        futures = {pool.submit(capture_one, cam): cam for cam in cams}
+        # JPEGs are already compressed: store them as-is
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as zf:
+            for fut in as_completed(futures):
+                cam = futures[fut]
+                entry = {"camId": cam["id"], "name": cam["name"]}
+                try:
+                    jpeg, path, captured_at, latency = fut.result()
+                except Exception as e:
+                    jpeg, latency = None, None
+                    entry["error"] = str(e)
+                entry["latencyMs"] = latency
+                if jpeg:
+                    entry["file"] = os.path.basename(path)
+                    entry["capturedAt"] = captured_at
+                    zf.writestr(entry["file"], jpeg)
+                else:
+                    entry.setdefault("error", "capture failed")
+                entries.append(entry)
+                yield sink.drain()
+
+            stamps = [e["capturedAt"] for e in entries if "capturedAt" in e]
+            for e in entries:
+                if "capturedAt" in e:
+                    e["skewMs"] = round((e["capturedAt"] - min(stamps)) * 1000)
+            manifest = {
+                "requestedAt": requested_at,
+                "captured": len(stamps),
+                "failed": len(entries) - len(stamps),
+                "cameras": sorted(entries, key=lambda e: e["camId"]),
+            }
+            zf.writestr("manifest.json", json.dumps(manifest, indent=2))
+        yield sink.drain()
+    finally:
+        # client gone: let running captures finish, skip queued ones
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_snapshot(lab_id, cam_ids):
+    """
+    GET /snapshot?lab_id=3  or  /snapshot?cam_id=1,2,5
+    """
+    if lab_id is not None:
+        try:
+            cam_ids = registry.in_lab(int(lab_id))
+        except ValueError:
+            return "bad lab_id", 400
+    else:
+        try:
+            cam_ids = [int(c) for c in cam_ids.split(",") if c.strip()]
+        except ValueError:
+            return "bad cam_id", 400
+    cam_ids = list(dict.fromkeys(cam_ids))
+    if not cam_ids:
+        return jsonify({"error": "no cameras"}), 404
+
+    cams, missing = [], []
+    for cam_id in cam_ids:
+        cam = registry.get(cam_id)
+        if cam:
+            cams.append(cam)
+        else:
+            missing.append(cam_id)
+
+    name = f"lab{lab_id}" if lab_id is not None else "cams"
+    return Response(
+        batch_snapshot_zip(cams, missing),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="snapshots_{name}_{timestamp()}.zip"'
+        },
+    )
 
 
 @app.route("/snapshot")
 def snapshot():
     """
     GET /snapshot?cam_id=1
+    Several cameras at once (streamed ZIP + manifest.json):
+    GET /snapshot?cam_id=1,2,5  or  /snapshot?lab_id=3
     """
+    lab_id = request.args.get("lab_id")
+    raw = request.args.get("cam_id", "0")
+    if lab_id is not None or "," in raw:
+        return batch_snapshot(lab_id, raw)
+
     try:
-        cam_id = int(request.args.get("cam_id", "0"))
+        cam_id = int(raw)
     except (TypeError, ValueError):
         return "bad cam_id", 400
 
-    # fetch IP from DB (keep in sync with video_feed/ptz/zoom)
-    con = get_conn()
-    cur = con.cursor()
-    ip = cur.execute(
-        "SELECT Camera_IP FROM Camera_Setting WHERE Camera_ID = ?", (cam_id,)
-    ).fetchval()
-    if not ip:
+    # cached lookup: no DB round trip on the stream/PTZ hot path
+    cam = registry.get(cam_id)
+    if not cam:
         return "unknown camera", 404
 
-    rtsp = rtsp_url(ip)
-    path = take_snapshot(rtsp, out_dir="./static/capture", suffix=f"_cam{cam_id}")
-    if not path:
+    jpeg, path, _ = take_snapshot(cam)
+    if not jpeg:
         return jsonify({"error": "capture failed"}), 500
 
-    # give a nice filename that includes the camera id
-    filename = f"snapshot_cam{cam_id}_{os.path.basename(path)}"
-    return send_file(path, mimetype="image/jpeg", as_attachment=True, download_name=filename)
+    return send_file(
+        io.BytesIO(jpeg), mimetype="image/jpeg", as_attachment=True,
+        download_name=os.path.basename(path),
+    )
+
+
+# ---- Session history ----
+SESSION_PAGE = 50
+SESSION_PAGE_MAX = 500
+
+
+@app.route("/api/sessions", methods=["GET"])
+def list_sessions():
+    """
+    GET /api/sessions?lab_id=1&cam_id=2&user=10.0.0.5&from=2025-08-22T00:00&to=2025-08-23&limit=50
+    Finished sessions, most recently ended first; pass "next" back as
+    ?cursor= for the next page. The first page also lists sessions that
+    are still active (not yet in the table).
+    """
+    where, params = [], []
+    try:
+        for arg, column in (("cam_id", "s.Camera_ID"), ("lab_id", "s.Lab_ID")):
+            if request.args.get(arg):
+                where.append(f"{column} = ?")
+                params.append(int(request.args[arg]))
+        user = request.args.get("user")
+        if user:
+            where.append("s.[User] = ?")
+            params.append(user)
+        start = end = None
+        if request.args.get("from"):
+            start = datetime.fromisoformat(request.args["from"])
+            where.append("s.Start_Date_Time >= ?")
+            params.append(start)
+        if request.args.get("to"):
+            end = datetime.fromisoformat(request.args["to"])
+            where.append("s.Start_Date_Time < ?")
+            params.append(end)
+        cursor = request.args.get("cursor")
+        if cursor:
+            # keyset on the identity column: exact, and served by the indexes
+            where.append("s.Session_ID < ?")
+            params.append(int(cursor))
+        limit = max(1, min(int(request.args.get("limit", SESSION_PAGE)), SESSION_PAGE_MAX))
+    except ValueError:
+        return jsonify({"error": "bad query"}), 400
+
+    sql = """
+        s.Session_ID, s.[User], s.Camera_ID, s.Lab_ID,
+        s.Start_Date_Time, s.End_Date_Time, s.Session_Type, s.PTZ_Commands,
+        c.Camera_Name, l.Lab_name
+        FROM Session_History s
+        LEFT JOIN Camera_Setting c ON c.Camera_ID = s.Camera_ID
+        LEFT JOIN Lab_Setting l ON l.Lab_ID = s.Lab_ID
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY s.Session_ID DESC"
+    rows = get_conn().cursor().execute(db.dialect.select_top(limit, sql), params).fetchall()
+
+    items = [
+        {
+            "id": r.Session_ID,
+            "user": r.User,
+            "camId": r.Camera_ID,
+            "camera": r.Camera_Name,
+            "labId": r.Lab_ID,
+            "lab": r.Lab_name,
+            "type": r.Session_Type,
+            "start": r.Start_Date_Time.isoformat(timespec="seconds") if r.Start_Date_Time else None,
+            "end": r.End_Date_Time.isoformat(timespec="seconds") if r.End_Date_Time else None,
+            "ptzCommands": r.PTZ_Commands or 0,
+        }
+        for r in rows
+    ]
+    active = []
+    if not cursor:
+        for sess in session_tracker.snapshot():
+            started = datetime.fromisoformat(sess["start"])
+            if (
+                request.args.get("cam_id") and sess["camId"] != int(request.args["cam_id"])
+                or request.args.get("lab_id") and sess["labId"] != int(request.args["lab_id"])
+                or user and sess["user"] != user
+                or start and started < start
+                or end and started >= end
+            ):
+                continue
+            cam = registry.get(sess["camId"]) if sess["camId"] else None
+            sess["camera"] = cam["name"] if cam else None
+            active.append(sess)
+    return jsonify({
+        "items": items,
+        "active": active,
+        "next": str(rows[-1].Session_ID) if len(rows) == limit else None,
+    })
+
+
+# ---- Snapshot catalog ----
+SNAPSHOT_PAGE = 100
+SNAPSHOT_PAGE_MAX = 500
+
+
+def snapshot_row(row):
+    return {
+        "id": row.Snapshot_ID,
+        "camId": row.Camera_ID,
+        "labId": row.Lab_ID,
+        "takenAt": row.Taken_At.isoformat(timespec="milliseconds"),
+        "size": row.Size_Bytes,
+        "width": row.Width,
+        "height": row.Height,
+        "url": f"/snapshots/{row.Snapshot_ID}",
+        "thumbUrl": f"/snapshots/{row.Snapshot_ID}/thumb",
+    }
+
+
+@app.route("/api/snapshots", methods=["GET"])
+def list_snapshots():
+    """
+    GET /api/snapshots?cam_id=2&lab_id=1&from=2025-08-22T00:00&to=2025-08-23T00:00&limit=100
+    Newest first. Pass the returned "next" back as ?cursor= for the next page.
+    """
+    where, params = [], []
+    try:
+        for arg, column in (("cam_id", "Camera_ID"), ("lab_id", "Lab_ID")):
+            if request.args.get(arg):
+                where.append(f"{column} = ?")
+                params.append(int(request.args[arg]))
+        if request.args.get("from"):
+            where.append("Taken_At >= ?")
+            params.append(datetime.fromisoformat(request.args["from"]))
+        if request.args.get("to"):
+            where.append("Taken_At < ?")
+            params.append(datetime.fromisoformat(request.args["to"]))
+        if request.args.get("cursor"):
+            taken, _, snap_id = request.args["cursor"].rpartition("_")
+            # keyset: strictly after the last row of the previous page
+            where.append("(Taken_At < ? OR (Taken_At = ? AND Snapshot_ID < ?))")
+            taken = datetime.fromisoformat(taken)
+            params += [taken, taken, int(snap_id)]
+        limit = min(int(request.args.get("limit", SNAPSHOT_PAGE)), SNAPSHOT_PAGE_MAX)
+    except ValueError:
+        return jsonify({"error": "bad query"}), 400
+
+    limit = max(limit, 1)
+    sql = (
+        "Snapshot_ID, Camera_ID, Lab_ID, Taken_At, File_Name, "
+        "Size_Bytes, Width, Height FROM Snapshot_Catalog"
+    )
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY Taken_At DESC, Snapshot_ID DESC"
+    rows = get_conn().cursor().execute(db.dialect.select_top(limit, sql), params).fetchall()
+
+    items = [snapshot_row(r) for r in rows]
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = f"{last.Taken_At.isoformat(timespec='microseconds')}_{last.Snapshot_ID}"
+    return jsonify({"items": items, "next": next_cursor})
+
+
+@app.route("/snapshots/<int:snapshot_id>")
+def get_snapshot(snapshot_id):
+    row = store.get(snapshot_id)
+    if row is None:
+        return "Not found", 404
+    resp = send_from_directory(store.root, row.File_Name, mimetype="image/jpeg")
+    resp.headers["Cache-Control"] = "private, max-age=86400, immutable"
+    return resp
+
+
+@app.route("/snapshots/<int:snapshot_id>/thumb")
+def get_snapshot_thumb(snapshot_id):
+    """Small JPEG for gallery views, generated on first request and cached on disk"""
+    row = store.get(snapshot_id)
+    if row is None:
+        return "Not found", 404
+    thumb = store.thumbnail(row)
+    if thumb is None:
+        return "Not found", 404
+    resp = send_file(thumb, mimetype="image/jpeg")
+    resp.headers["Cache-Control"] = "private, max-age=86400, immutable"
+    return resp
+
+
+# ---- Recordings ----
+RECORDING_DEFAULT_RANGE = timedelta(hours=1)
+# an export is one ffmpeg process streaming for as long as the download takes
+RECORDING_EXPORT_MAX = timedelta(hours=6)
+
+
+def recording_range():
+    """(cam_id, start, end) from ?cam_id=&from=&to=; ValueError if malformed."""
+    cam_id = int(request.args["cam_id"]) if request.args.get("cam_id") else None
+    if cam_id is None:
+        raise ValueError("cam_id is required")
+    end = datetime.fromisoformat(request.args["to"]) if request.args.get("to") else datetime.now()
+    if request.args.get("from"):
+        start = datetime.fromisoformat(request.args["from"])
+    else:
+        start = end - RECORDING_DEFAULT_RANGE
+    if start >= end:
+        raise ValueError("from must be before to")
+    return cam_id, start, end
+
+
+@app.route("/api/recordings", methods=["GET"])
+def list_recordings():
+    """
+    GET /api/recordings?cam_id=2&from=2025-08-22T09:00&to=2025-08-22T10:00
+    Recorded segments overlapping the range (default: the last hour), oldest first.
+    """
+    try:
+        cam_id, start, end = recording_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = recorder.find_segments(cam_id, start, end)
+    return jsonify([
+        {
+            "id": row.Segment_ID,
+            "camId": row.Camera_ID,
+            "start": row.Start_At.isoformat(timespec="milliseconds"),
+            "end": row.End_At.isoformat(timespec="milliseconds"),
+            "sizeBytes": row.Size_Bytes,
+        }
+        for row in rows
+    ])
+
+
+@app.route("/api/recordings/export", methods=["GET"])
+def export_recording():
+    """
+    GET /api/recordings/export?cam_id=2&from=2025-08-22T09:15&to=2025-08-22T09:45
+    One MP4 covering the range, joined from the segments without re-encoding
+    (cuts land on the keyframe at or before each end).
+    """
+    try:
+        cam_id, start, end = recording_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if end - start > RECORDING_EXPORT_MAX:
+        return jsonify({"error": "range too long"}), 400
+    chunks = recorder.export(cam_id, start, end)
+    if chunks is None:
+        return jsonify({"error": "nothing recorded in that range"}), 404
+    name = f"cam{cam_id}_{start:%Y%m%d_%H%M%S}-{end:%H%M%S}.mp4"
+    return Response(
+        chunks,
+        mimetype="video/mp4",
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+@app.route("/api/recordings/status", methods=["GET"])
+def recording_status():
+    """Recorder of this process: running muxers, segment counts and disk usage."""
+    return jsonify(recordings.stats())
+
+
+@app.route("/api/cameras/<int:camera_id>/recording", methods=["PUT"])
+def set_camera_recording(camera_id):
+    """Body {"enabled": true|false}; the recording process picks it up within seconds."""
+    data = request.get_json(force=True)
+    enabled = 1 if data.get("enabled") else 0
+    con = get_conn()
+    cur = con.cursor()
+    cur.execute(
+        "UPDATE Camera_Setting SET Record_Enabled = ? WHERE Camera_ID = ?",
+        (enabled, camera_id),
+    )
+    if cur.rowcount == 0:
+        return jsonify({"error": "Camera not found"}), 404
+    con.commit()
+    return jsonify({"message": "Recording " + ("enabled" if enabled else "disabled")})
 
 
 # DB API's
 
 
+# ---- Versioned list caches ----
+# /api/cameras and /api/labs serve a cached body until a write (or a status
+# flip from the poller) bumps the version; every such change goes through
+# the event bus, so the caches just listen to it. Writes this process never
+# hears about are picked up by the caches' TTL rebuild (list_cache.TTL).
+cameras_list = VersionedList("cameras")
+labs_list = VersionedList("labs")
+
+
+def on_list_event(event_type, data):
+    if event_type == "camera_status":
+        cameras_list.touch(data["id"])
+    elif event_type == "lab_status":
+        labs_list.touch(data["id"])
+    elif event_type in ("camera_added", "camera_updated"):
+        cameras_list.touch(data["id"])
+        labs_list.touch_all()  # camera counts of the old and new lab
+    elif event_type == "camera_deleted":
+        cameras_list.remove(data["id"])
+        labs_list.touch_all()
+    elif event_type == "labs_changed":
+        if data["op"] == "deleted":
+            labs_list.remove(data["id"])
+        else:
+            labs_list.touch(data["id"])
+        if data["op"] != "added":
+            cameras_list.touch_all()  # lab names are embedded in camera rows
+
+
+bus.listen(on_list_event)
+
+
+def serve_list(cache, load_rows):
+    """
+    Cached list body with ETag (If-None-Match -> 304).
+    ?since=<version> returns only rows changed after that version:
+    { version, full, items, deleted }
+    """
+    version, body, rows = cache.get(load_rows)
+    since = request.args.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({"error": "bad since"}), 400
+        delta = cache.changes_since(since)
+        if delta is None:
+            return jsonify({"version": version, "full": True, "items": rows, "deleted": []})
+        changed, deleted = delta
+        return jsonify({
+            "version": version,
+            "full": False,
+            "items": [r for r in rows if r["id"] in changed],
+            "deleted": sorted(deleted),
+        })
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(f"{cache.name}-{version}")
+    resp.headers["X-List-Version"] = str(version)
+    return resp.make_conditional(request)
+
+
 # -------- GET labs (list) ----------
 @app.route("/api/labs", methods=["GET"])
 def get_labs():
+    return serve_list(labs_list, load_labs)
+
+
+def load_labs():
     con = get_conn()
     cur = con.cursor()
+    # counts are derived from Camera_Setting in one grouped pass over
+    # IX_Camera_Lab, so they can't drift from the actual assignments
     cur.execute(
-        "SELECT Lab_ID, Lab_name, Total_Cameras, Online_Cameras, Status, Description FROM Lab_Setting"
+        """
+    SELECT l.Lab_ID,
+           l.Lab_name,
+           COALESCE(x.Total, 0) AS Total_Cameras,
+           COALESCE(x.Online, 0) AS Online_Cameras,
+           l.Status,
+           l.Description
+    FROM Lab_Setting l
+    LEFT JOIN (
+        SELECT Lab_ID,
+               COUNT(*) AS Total,
+               SUM(CASE WHEN Status = 'online' THEN 1 ELSE 0 END) AS Online
+        FROM Camera_Setting
+        WHERE Lab_ID IS NOT NULL
+        GROUP BY Lab_ID
+    ) x ON x.Lab_ID = l.Lab_ID
+    """
     )
     rows = cur.fetchall()
     labs = []
@@ -244,11 +975,15 @@ def get_labs():
             "status": row.Status,
             "description": row.Description,
         })
-    return jsonify(labs)
+    return labs
 
 # GET /api/cameras
 @app.route("/api/cameras", methods=["GET"])
 def get_cameras():
+    return serve_list(cameras_list, load_cameras)
+
+
+def load_cameras():
     con = get_conn()
     cur = con.cursor()
     cur.execute(
@@ -276,7 +1011,7 @@ def get_cameras():
                 "ptzSupport": bool(row.PTZ_Support),
             }
         )
-    return jsonify(cameras)
+    return cameras
 
 
 # -------- ADD lab ----------
@@ -289,11 +1024,16 @@ def add_lab():
 
     con = get_conn()
     cur = con.cursor()
-    cur.execute(
-        "INSERT INTO Lab_Setting (Lab_name, Total_Cameras, Online_Cameras, Status, Description) VALUES (?, 0, 0, ?, ?)",
+    lab_id = cur.execute(
+        db.dialect.insert_returning(
+            "INSERT INTO Lab_Setting (Lab_name, Total_Cameras, Online_Cameras, Status, Description)",
+            "VALUES (?, 0, 0, ?, ?)",
+            "Lab_ID",
+        ),
         (name, status, description),
-    )
+    ).fetchval()
     con.commit()
+    bus.publish("labs_changed", {"id": lab_id, "op": "added"})
     return jsonify({"message": "Lab added"}), 201
 
 # -------- UPDATE lab ----------
@@ -311,6 +1051,7 @@ def update_lab(lab_id):
         (name, status, description, lab_id),
     )
     con.commit()
+    bus.publish("labs_changed", {"id": lab_id, "op": "updated"})
     return jsonify({"message": "Lab updated"})
 
 
@@ -319,8 +1060,12 @@ def update_lab(lab_id):
 def delete_lab(lab_id):
     con = get_conn()
     cur = con.cursor()
+    # FK_Camera_Lab (ON DELETE SET NULL) unassigns the lab's cameras
     cur.execute("DELETE FROM Lab_Setting WHERE Lab_ID = ?", (lab_id,))
     con.commit()
+    registry.invalidate()
+    poller.refresh()
+    bus.publish("labs_changed", {"id": lab_id, "op": "deleted"})
     return jsonify({"message": "Lab deleted"})
 
 
@@ -347,22 +1092,26 @@ def add_camera():
         lab_id = row.Lab_ID
 
     # Insert camera (default status offline)
-    cur.execute(
-        """
-        INSERT INTO Camera_Setting (Camera_Name, Camera_IP, Status, PTZ_Support, Lab_ID)
-        VALUES (?, ?, 'offline', ?, ?)
-        """,
+    camera_id = cur.execute(
+        db.dialect.insert_returning(
+            "INSERT INTO Camera_Setting (Camera_Name, Camera_IP, Status, PTZ_Support, Lab_ID)",
+            "VALUES (?, ?, 'offline', ?, ?)",
+            "Camera_ID",
+        ),
         (name, ip, ptz, lab_id),
-    )
-
-    # If assigned to a lab, bump that lab's Total_Cameras
-    if lab_id is not None:
-        cur.execute(
-            "UPDATE Lab_Setting SET Total_Cameras = Total_Cameras + 1 WHERE Lab_ID = ?",
-            (lab_id,),
-        )
+    ).fetchval()
 
     con.commit()
+    registry.put(camera_id, ip, name, ptz, lab_id)
+    poller.refresh()
+    bus.publish("camera_added", {
+        "id": camera_id,
+        "name": name,
+        "ipAddress": ip,
+        "lab": lab_name or None,
+        "status": "offline",
+        "ptzSupport": bool(ptz),
+    })
     return jsonify({"message": "Camera added"}), 201
 
 
@@ -386,16 +1135,30 @@ def update_camera(camera_id):
             "SELECT Lab_ID FROM Lab_Setting WHERE Lab_name = ?", (lab,)
         ).fetchval()
 
+    # Status_Changed_At moves only if the status really changes (NULL to a
+    # value counts), as in HealthPoller._flush
     cur.execute(
         """
         UPDATE Camera_Setting
-        SET Camera_Name = ?, Camera_IP = ?, Status = ?, PTZ_Support = ?, Lab_ID = ?
+        SET Camera_Name = ?, Camera_IP = ?, Status = ?, PTZ_Support = ?, Lab_ID = ?,
+            Status_Changed_At = CASE WHEN Status = ? OR (Status IS NULL AND ? IS NULL)
+                                     THEN Status_Changed_At ELSE ? END
         WHERE Camera_ID = ?
         """,
-        (name, ip, status, ptz_support, lab_id, camera_id),
+        (name, ip, status, ptz_support, lab_id, status, status, datetime.now(), camera_id),
     )
 
     con.commit()
+    registry.put(camera_id, ip, name, ptz_support, lab_id)
+    poller.refresh()
+    bus.publish("camera_updated", {
+        "id": camera_id,
+        "name": name,
+        "ipAddress": ip,
+        "lab": lab if lab_id else None,
+        "status": status,
+        "ptzSupport": bool(ptz_support),
+    })
     return jsonify({"message": "Camera updated"})
 
 
@@ -404,76 +1167,42 @@ def update_camera(camera_id):
 def delete_camera(camera_id):
     con = get_conn()
     cur = con.cursor()
-    # fetch lab_id for that camera
-    lab_id = cur.execute(
-        "SELECT Lab_ID FROM Camera_Setting WHERE Camera_ID = ?", (camera_id,)
-    ).fetchval()
-
-    # delete camera
+    # lab counts are derived, nothing else to adjust
     cur.execute("DELETE FROM Camera_Setting WHERE Camera_ID = ?", (camera_id,))
-
-    # decrement total if assigned
-    if lab_id:
-        cur.execute(
-            "UPDATE Lab_Setting SET Total_Cameras = Total_Cameras - 1 WHERE Lab_ID = ?",
-            (lab_id,),
-        )
     con.commit()
+    registry.remove(camera_id)
+    poller.refresh()
+    bus.publish("camera_deleted", {"id": camera_id})
     return jsonify({"message": "Camera deleted"})
 
 
+# GET /api/events
+@app.route("/api/events", methods=["GET"])
+def events():
+    """
+    Server-Sent Events: camera_status, lab_status, camera_added/updated/deleted,
+    labs_changed. Browsers resume with Last-Event-ID; "resync" means reload.
+    """
+    poller.ensure_started()
+    try:
+        last_id = int(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        last_id = None
+    resp = Response(bus.stream(last_id), mimetype="text/event-stream")
+    resp.headers["X-Accel-Buffering"] = "no"  # don't let a proxy batch events
+    return resp
+
+
 # GET /api/cameras/ping
 @app.route("/api/cameras/ping", methods=["GET"])
 def ping_cameras():
-    con = get_conn()
-    cur = con.cursor()
-
-    # fetch all cameras
-    rows = cur.execute(
-        """
-    SELECT Camera_ID, Camera_IP, Lab_ID
-    FROM Camera_Setting
     """
-    ).fetchall()
-
-    online_count_per_lab = {}
-
-    for row in rows:
-        cam_id = row.Camera_ID
-        ip = row.Camera_IP
-        lab_id = row.Lab_ID
-
-        try:
-            # make a request to /magicBox
-            r = requests.get(
-                f"http://{ip}/cgi-bin/magicBox.cgi?action=getSystemInfo",
-                auth=HTTPDigestAuth(USERNAME, PASSWORD),
-                timeout=2,
-            )
-            status = "online" if r.status_code == 200 else "offline"
-        except Exception:
-            status = "offline"
-
-        # update Camera_Setting
-        cur.execute(
-            "UPDATE Camera_Setting SET Status=? WHERE Camera_ID=?", (status, cam_id)
-        )
-
-        # keep track of online per lab
-        if lab_id:
-            if lab_id not in online_count_per_lab:
-                online_count_per_lab[lab_id] = 0
-            if status == "online":
-                online_count_per_lab[lab_id] += 1
-
-    # update Online_Cameras in Lab_Setting
-    for lab_id, count in online_count_per_lab.items():
-        cur.execute(
-            "UPDATE Lab_Setting SET Online_Cameras=? WHERE Lab_ID=?", (count, lab_id)
-        )
-
-    con.commit()
-    return jsonify({"message": "Statuses updated"})
+    Cached camera health. The sweep itself runs in the background poller
+    (health.py) of the process holding the poller lease; other processes
+    serve the statuses it stored. Either way this never waits on a camera.
+    """
+    poller.ensure_started()
+    return jsonify({"message": "Statuses updated", "cameras": poller.snapshot()})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+# bench_startup.py
+"""Startup-time benchmark: how long a fresh worker takes to serve /api/labs.
+
+Each run starts a new interpreter, imports app (schema check, registry load,
+background threads) and answers one GET /api/labs through the Flask test
+client. The first run creates the schema and is reported separately.
+
+    python bench_startup.py                  # embedded SQLite in a temp dir
+    POLYCAB_DB_BACKEND=mssql python bench_startup.py --runs 10
+    python bench_startup.py --budget-ms 800  # CI: fail on regressions
+
+Exits non-zero if the median exceeds the budget or if OpenCV was imported
+during startup (it must stay deferred to the first stream or snapshot).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+resp = app.app.test_client().get("/api/labs")
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "first_request_ms": (t2 - t1) * 1000,
+    "status": resp.status_code,
+    "cv2_loaded": "cv2" in sys.modules,
+}))
+"""
+
+
+def run_once(env, workdir):
+    # run from a scratch dir: static/capture is relative to the cwd, and the
+    # snapshot sweeper must not touch real captures on behalf of a benchmark
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE, HERE],
+        cwd=workdir, env=env, capture_output=True, text=True, timeout=120,
+    )
+    if out.returncode != 0:
+        sys.stderr.write(out.stderr)
+        raise SystemExit(f"startup probe failed (exit {out.returncode})")
+    # the app prints its own log lines; the result is the last line
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["total_ms"] = result["import_ms"] + result["first_request_ms"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1000.0,
+                        help="fail if the median warm startup is slower")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as workdir:
+        if env.setdefault("POLYCAB_DB_BACKEND", "sqlite") == "sqlite":
+            env.setdefault("POLYCAB_SQLITE_PATH", os.path.join(workdir, "bench.db"))
+        first = run_once(env, workdir)
+        print(f"first run (schema setup): {first['total_ms']:.0f} ms")
+        runs = [run_once(env, workdir) for _ in range(args.runs)]
+
+    failed = False
+    for key in ("import_ms", "first_request_ms", "total_ms"):
+        values = [r[key] for r in runs]
+        print(f"{key:>17}: median {statistics.median(values):7.1f}  max {max(values):7.1f}")
+    median = statistics.median(r["total_ms"] for r in runs)
+    if median > args.budget_ms:
+        print(f"FAIL: median startup {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if any(r["status"] != 200 for r in runs):
+        print("FAIL: /api/labs did not answer 200")
+        failed = True
+    if any(r["cv2_loaded"] for r in [first] + runs):
+        print("FAIL: cv2 was imported during startup")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
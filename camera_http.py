@@ -0,0 +1,100 @@
+# camera_http.py
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+from urllib3.util.retry import Retry
+
+# (connect, read) seconds for one camera CGI call.
+TIMEOUT = (1.5, 3.0)
+# Retry connection failures only, e.g. a keep-alive socket the camera
+# already closed; a command that reached the camera is not re-sent.
+RETRIES = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.05)
+
+
+class SharedDigestAuth(HTTPDigestAuth):
+    """Digest auth whose nonce is shared by all threads.
+
+    requests keeps the nonce per thread, so every Flask worker thread would
+    pay the 401 challenge again. Calls through one CameraSession are
+    serialized, which makes the shared state safe.
+    """
+
+    def __init__(self, username, password):
+        super().__init__(username, password)
+        self._thread_local = _State()
+        self.init_per_thread_state()
+
+
+class _State:
+    pass
+
+
+class CameraSession:
+    """Keep-alive HTTP connection to one camera, with a cached digest nonce."""
+
+    def __init__(self, ip, username, password, timeout=TIMEOUT, retries=RETRIES):
+        self.ip = ip
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.auth = SharedDigestAuth(username, password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retries)
+        self.session.mount("http://", adapter)
+        self.requests = 0
+        self.errors = 0
+        self.last_ms = None
+
+    def get(self, path, timeout=None):
+        """GET http://<ip><path>; raises requests.RequestException on failure."""
+        with self.lock:
+            start = time.monotonic()
+            self.requests += 1
+            try:
+                return self.session.get(
+                    f"http://{self.ip}{path}", timeout=timeout or self.timeout
+                )
+            except requests.RequestException:
+                self.errors += 1
+                raise
+            finally:
+                self.last_ms = round((time.monotonic() - start) * 1000, 1)
+
+    def close(self):
+        self.session.close()
+
+    def as_dict(self):
+        return {
+            "ip": self.ip,
+            "requests": self.requests,
+            "errors": self.errors,
+            "lastMs": self.last_ms,
+        }
+
+
+class CameraSessions:
+    """One CameraSession per (ip, username, password), created on first use."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def get(self, ip, username, password):
+        key = (ip, username, password)
+        with self.lock:
+            sess = self.sessions.get(key)
+            if sess is None:
+                # credentials or IP changed: drop the old connection
+                for old_key in [k for k in self.sessions if k[0] == ip]:
+                    self.sessions.pop(old_key).close()
+                sess = self.sessions[key] = CameraSession(ip, username, password)
+            return sess
+
+    def stats(self):
+        with self.lock:
+            return [s.as_dict() for s in self.sessions.values()]
+
+
+sessions = CameraSessions()
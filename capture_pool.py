@@ -0,0 +1,541 @@
+# capture_pool.py
+import atexit
+import itertools
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+
+import stream_hub
+from events import bus
+from stream_hub import (
+    FRAME_WAIT,
+    IDLE_GRACE,
+    MAX_FRAME_AGE,
+    SNAPSHOT_WAIT,
+    SNAPSHOT_WARM,
+    CaptureWorker,
+    StreamHub,
+    WIDTH_STEPS,
+    Variant,
+)
+
+# Capture and encode in worker processes instead of threads of the web
+# process, so decoding N cameras is not capped by one GIL. Each stream (one
+# RTSP URL) lives in the least busy of CAPTURE_PROCESSES workers, which runs
+# the usual CaptureWorker loop: decode once, gate, encode once per variant.
+# Every variant's JPEGs (or raw frames) go into a FrameRing in shared memory; the pipe to a
+# worker only carries commands and small "variant v has frame seq" notices.
+# CAPTURE_PROCESSES=0 (default) keeps the in-process thread hub.
+# Run as a script, this file is the worker process.
+PROCESSES = int(os.environ.get("CAPTURE_PROCESSES", "0"))
+RING_SLOTS = 4
+# Largest JPEG a ring slot holds; bigger frames are dropped and counted.
+SLOT_BYTES = int(os.environ.get("CAPTURE_SLOT_BYTES", 2 * 1024 * 1024))
+HEADER = struct.Struct("<QIdHH")  # seq, length, monotonic capture time, raw width, height
+REAP_INTERVAL = 1.0
+STATUS_INTERVAL = 1.0
+SNAPSHOT_TIMEOUT = SNAPSHOT_WAIT + 2.0
+
+
+class FrameRing:
+    """Single-writer ring of JPEG (or raw BGR frame) slots in shared memory.
+
+    The web process creates (and finally unlinks) the ring; a worker
+    process attaches by name and writes frame ``seq`` into slot
+    ``seq % RING_SLOTS``. The slot's seq is cleared before the copy and set
+    after it, so a reader that sees the same seq before and after its own
+    copy has a whole frame (a seqlock); otherwise it was lapped and asks
+    for the newest frame again.
+    """
+
+    def __init__(self, name=None, slots=RING_SLOTS, slot_bytes=SLOT_BYTES):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+        if self.owner:
+            size = slots * (HEADER.size + slot_bytes)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # the creator owns cleanup; without this the worker's own
+            # resource tracker would unlink the ring when the worker exits
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+
+    def _offset(self, seq):
+        return (seq % self.slots) * (HEADER.size + self.slot_bytes)
+
+    def write(self, seq, data, stamp, size=(0, 0)):
+        """Store frame ``seq``; ``size`` is (width, height) of a raw frame."""
+        data = memoryview(data).cast("B")
+        if len(data) > self.slot_bytes:
+            return False
+        off = self._offset(seq)
+        start = off + HEADER.size
+        HEADER.pack_into(self.buf, off, 0, 0, 0.0, 0, 0)
+        self.buf[start:start + len(data)] = data
+        HEADER.pack_into(self.buf, off, seq, len(data), stamp, *size)
+        return True
+
+    def read(self, seq):
+        """(bytes, (width, height)) of frame ``seq``, or (None, None) if its slot was reused."""
+        off = self._offset(seq)
+        found, length, _, width, height = HEADER.unpack_from(self.buf, off)
+        if found != seq:
+            return None, None
+        start = off + HEADER.size
+        data = bytes(self.buf[start:start + length])
+        if HEADER.unpack_from(self.buf, off)[0] != seq:
+            return None, None
+        return data, (width, height)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# ---- web process ----
+
+
+class RingVariant:
+    """Web-process side of one output encoding: its ring and newest frame seq."""
+
+    def __init__(self, vid, width, quality, gated, raw=False):
+        self.vid = vid
+        self.width = width
+        self.quality = quality
+        self.gated = gated
+        self.raw = raw
+        self.viewers = 0  # guarded by hub.lock
+        self.seq = 0  # guarded by stream.cond
+        self.stamp = 0.0
+        if raw:
+            # room for a BGR frame as tall as it is wide
+            side = width or WIDTH_STEPS[-1]
+            self.ring = FrameRing(slot_bytes=side * side * 3)
+        else:
+            self.ring = FrameRing()
+
+    @property
+    def key(self):
+        return (self.width, self.quality, self.gated, self.raw)
+
+
+class RingStream:
+    """Web-process side of a stream decoded in a worker process.
+
+    Offers what StreamHub.frames() and stats() use of a CaptureWorker
+    (viewers, variants, running, wait_frame), so the viewer loop is shared.
+    """
+
+    def __init__(self, proc, sid, cam_id, rtsp):
+        self.proc = proc
+        self.sid = sid
+        self.cam_id = cam_id
+        self.rtsp = rtsp
+        self.viewers = 0  # guarded by hub.lock
+        self.variants = {}  # RingVariant.key -> RingVariant, guarded by hub.lock
+        self.by_vid = {}
+        self.idle_since = time.monotonic()
+        self.warm_until = 0.0
+        self.running = True
+        self.activity = None  # latest ChangeGate state from the worker
+        self.cond = threading.Condition()
+
+    def wait_frame(self, variant, last_seq, timeout=FRAME_WAIT):
+        """Block until ``variant`` has a fresh frame newer than ``last_seq``; returns (jpeg, seq)."""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: (
+                    variant.seq != last_seq
+                    and time.monotonic() - variant.stamp <= MAX_FRAME_AGE
+                )
+                or not self.running,
+                timeout,
+            )
+            seq, stamp = variant.seq, variant.stamp
+        if seq == last_seq or time.monotonic() - stamp > MAX_FRAME_AGE:
+            return None, last_seq
+        # copied outside the lock; if the writer lapped us the caller just
+        # comes back for the newest frame
+        data, (width, height) = variant.ring.read(seq)
+        if data is None:
+            return None, last_seq
+        if variant.raw:
+            import numpy as np
+
+            data = np.frombuffer(data, np.uint8).reshape(height, width, 3)
+        return data, seq
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+
+class CaptureProcess:
+    """One worker process, its command pipe and the thread reading its notices."""
+
+    def __init__(self, hub, index):
+        self.hub = hub
+        self.index = index
+        parent, child = socket.socketpair()
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(child.fileno())],
+            pass_fds=(child.fileno(),),
+            stdin=subprocess.DEVNULL,
+        )
+        child.close()
+        self.conn = Connection(parent.detach())
+        self.send_lock = threading.Lock()
+        self.alive = True
+        self.streams = {}  # sid -> RingStream, guarded by hub.lock
+        self.snapshots = {}  # request id -> [threading.Event, result]
+        self.requests = itertools.count(1)
+        threading.Thread(
+            target=self._receive, name=f"capture-proc-{index}", daemon=True
+        ).start()
+
+    def send(self, *msg):
+        with self.send_lock:
+            try:
+                self.conn.send(msg)
+            except OSError:
+                pass  # the receiver thread notices the process is gone
+
+    def snapshot(self, sid):
+        """(jpeg, width, height, wall time) of the stream's newest frame, encoded in the worker."""
+        req = next(self.requests)
+        pending = self.snapshots[req] = [threading.Event(), None]
+        self.send("snapshot", sid, req)
+        pending[0].wait(SNAPSHOT_TIMEOUT)
+        self.snapshots.pop(req, None)
+        return pending[1] or (None, None, None, None)
+
+    def _frames(self, sid, notices):
+        stream = self.streams.get(sid)
+        if stream is None:
+            return
+        with stream.cond:
+            for vid, seq, stamp in notices:
+                variant = stream.by_vid.get(vid)
+                if variant is not None:
+                    variant.seq = seq
+                    variant.stamp = stamp
+            stream.cond.notify_all()
+
+    def _ended(self, sid):
+        with self.hub.lock:
+            stream = self.streams.pop(sid, None)
+            if stream is not None and self.hub.workers.get(stream.rtsp) is stream:
+                del self.hub.workers[stream.rtsp]
+        if stream is not None:
+            stream.stop()
+
+    def _receive(self):
+        try:
+            while True:
+                msg = self.conn.recv()
+                op = msg[0]
+                if op == "frames":
+                    self._frames(msg[1], msg[2])
+                elif op == "ended":
+                    self._ended(msg[1])
+                elif op == "snapshot":
+                    pending = self.snapshots.get(msg[1])
+                    if pending is not None:
+                        pending[1] = msg[2:] if msg[2] is not None else None
+                        pending[0].set()
+                elif op == "event":
+                    bus.publish(msg[1], msg[2])
+                elif op == "status":
+                    for sid, activity in msg[1].items():
+                        stream = self.streams.get(sid)
+                        if stream is not None:
+                            stream.activity = activity
+        except (EOFError, OSError):
+            pass
+        print(f"[capture] worker process {self.index} exited")
+        self.alive = False
+        for sid in list(self.streams):
+            self._ended(sid)
+        for pending in list(self.snapshots.values()):
+            pending[0].set()
+
+    def close(self):
+        # the receiver thread sees EOF and winds the streams down
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+class ProcessHub(StreamHub):
+    """StreamHub whose capture workers run in worker processes (see above).
+
+    Same interface as StreamHub; viewers, variants and the idle/warm
+    bookkeeping stay in the web process, which tells workers what to open,
+    encode and close.
+    """
+
+    def __init__(self, processes):
+        super().__init__()
+        self.procs = [None] * processes  # started on first use
+        self.sids = itertools.count(1)
+        self.vids = itertools.count(1)
+        self._reaper = None
+        atexit.register(self.close)
+
+    def _process(self):
+        """Least busy live worker process, (re)starting dead ones. Caller holds self.lock."""
+        for i, proc in enumerate(self.procs):
+            if proc is None or not proc.alive:
+                self.procs[i] = CaptureProcess(self, i)
+        return min(self.procs, key=lambda p: len(p.streams))
+
+    def _worker(self, cam_id, rtsp):
+        """Live stream for ``rtsp``, opened in a worker if needed. Caller holds self.lock."""
+        stream = self.workers.get(rtsp)
+        if stream is None:
+            proc = self._process()
+            stream = RingStream(proc, next(self.sids), cam_id, rtsp)
+            self.workers[rtsp] = stream
+            proc.streams[stream.sid] = stream
+            proc.send("open", stream.sid, cam_id, rtsp)
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap, name="capture-reaper", daemon=True
+                )
+                self._reaper.start()
+        return stream
+
+    def acquire(self, cam_id, rtsp, width=None, quality=None, gated=False, raw=False):
+        key = (width, quality, gated, raw)
+        with self.lock:
+            stream = self._worker(cam_id, rtsp)
+            variant = stream.variants.get(key)
+            if variant is None:
+                variant = stream.variants[key] = RingVariant(
+                    next(self.vids), width, quality, gated, raw
+                )
+                stream.by_vid[variant.vid] = variant
+                stream.proc.send(
+                    "variant", stream.sid, variant.vid, width, quality, gated, raw,
+                    variant.ring.name, variant.ring.slot_bytes,
+                )
+            variant.viewers += 1
+            stream.viewers += 1
+        return stream, variant
+
+    def release(self, stream, variant):
+        closing = None
+        with self.lock:
+            variant.viewers -= 1
+            stream.viewers -= 1
+            if variant.viewers == 0 and stream.variants.get(variant.key) is variant:
+                del stream.variants[variant.key]
+                stream.by_vid.pop(variant.vid, None)
+                stream.proc.send("unvariant", stream.sid, variant.vid)
+                closing = variant
+            if stream.viewers == 0:
+                stream.idle_since = time.monotonic()
+        if closing is not None:
+            # unlinked now; the worker drops its mapping on "unvariant"
+            closing.ring.close()
+
+    def _reap(self):
+        while True:
+            time.sleep(REAP_INTERVAL)
+            now = time.monotonic()
+            with self.lock:
+                idle = [
+                    s for s in self.workers.values()
+                    if s.viewers == 0 and now - s.idle_since > IDLE_GRACE and now > s.warm_until
+                ]
+                for stream in idle:
+                    del self.workers[stream.rtsp]
+                    stream.proc.streams.pop(stream.sid, None)
+            for stream in idle:
+                stream.proc.send("close", stream.sid)
+                stream.stop()
+
+    def snapshot_jpeg(self, cam_id, rtsp):
+        with self.lock:
+            stream = self._worker(cam_id, rtsp)
+            stream.warm_until = time.monotonic() + SNAPSHOT_WARM
+        return stream.proc.snapshot(stream.sid)
+
+    def snapshot_at(self, cam_id, rtsp):
+        import cv2
+        import numpy as np
+
+        jpeg, _, _, captured_at = self.snapshot_jpeg(cam_id, rtsp)
+        if jpeg is None:
+            return None, None
+        return cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR), captured_at
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats["processes"] = [
+                {"index": p.index, "pid": p.proc.pid, "alive": p.alive, "streams": len(p.streams)}
+                for p in self.procs
+                if p is not None
+            ]
+        return stats
+
+    def activity(self):
+        with self.lock:
+            return [s.activity for s in self.workers.values() if s.activity]
+
+    def close(self):
+        with self.lock:
+            streams, self.workers = list(self.workers.values()), {}
+            procs = [p for p in self.procs if p is not None]
+        for stream in streams:
+            for variant in stream.variants.values():
+                variant.ring.close()
+        for proc in procs:
+            proc.close()
+
+
+def make_hub():
+    """The web process's stream hub: worker processes if CAPTURE_PROCESSES > 0, else threads."""
+    if PROCESSES > 0:
+        return ProcessHub(PROCESSES)
+    return stream_hub.hub
+
+
+# ---- worker process ----
+
+
+class RingWorker(CaptureWorker):
+    """CaptureWorker of a worker process: its variants publish into FrameRings."""
+
+    def __init__(self, hub, sid, cam_id, rtsp, notify):
+        super().__init__(hub, sid, cam_id, rtsp)
+        self.viewers = 1  # held open by the web process until "close"
+        self.notify = notify
+        self.ring_lock = threading.Lock()  # ring writes vs "unvariant"
+        self.oversize = 0
+
+    def publish(self, frame, encoded):
+        super().publish(frame, encoded)
+        notices = []
+        with self.ring_lock:
+            for variant, data in encoded:
+                if data is None or variant.ring is None:
+                    continue
+                size = data.shape[1::-1] if variant.raw else (0, 0)
+                if variant.ring.write(variant.seq, data, variant.stamp, size):
+                    notices.append((variant.vid, variant.seq, variant.stamp))
+                else:
+                    self.oversize += 1
+                    if self.oversize == 1:
+                        print(f"[capture] cam {self.cam_id}: frame of "
+                              f"{memoryview(data).nbytes} bytes exceeds its ring slot "
+                              f"(CAPTURE_SLOT_BYTES), dropping such frames")
+        if notices:
+            self.notify("frames", self.key, notices)
+
+    def _run(self):
+        try:
+            super()._run()
+        finally:
+            self.notify("ended", self.key)
+
+
+def _snapshot(worker, req, notify):
+    import cv2
+
+    frame, stamp = worker.latest_frame()
+    if frame is not None:
+        ok, buf = cv2.imencode(".jpg", frame)
+        if ok:
+            h, w = frame.shape[:2]
+            captured_at = time.time() - (time.monotonic() - stamp)
+            notify("snapshot", req, buf.tobytes(), w, h, captured_at)
+            return
+    notify("snapshot", req, None)
+
+
+def worker_main(fd):
+    conn = Connection(fd)
+    send_lock = threading.Lock()
+
+    def notify(*msg):
+        with send_lock:
+            try:
+                conn.send(msg)
+            except OSError:
+                pass
+
+    local = StreamHub()  # lock and sid -> RingWorker registry
+    # change-gate events happen here; the web process republishes them
+    bus.listen(lambda event_type, data: notify("event", event_type, data))
+
+    def report():
+        while True:
+            time.sleep(STATUS_INTERVAL)
+            with local.lock:
+                status = {sid: w.gate.as_dict() for sid, w in local.workers.items()}
+            if status:
+                notify("status", status)
+
+    threading.Thread(target=report, name="capture-status", daemon=True).start()
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return  # web process gone
+        op, sid = msg[0], msg[1]
+        with local.lock:
+            worker = local.workers.get(sid)
+        if op == "open":
+            worker = RingWorker(local, sid, msg[2], msg[3], notify)
+            with local.lock:
+                local.workers[sid] = worker
+            worker.thread.start()
+        elif worker is None:
+            # stream already ended on its own
+            if op == "snapshot":
+                notify("snapshot", msg[2], None)
+        elif op == "close":
+            with local.lock:
+                worker.viewers = 0
+                worker.idle_since = float("-inf")
+                worker.warm_until = 0.0
+        elif op == "variant":
+            _, _, vid, width, quality, gated, raw, ring_name, slot_bytes = msg
+            variant = Variant(width, quality, gated, raw)
+            variant.vid = vid
+            variant.viewers = 1
+            variant.ring = FrameRing(ring_name, slot_bytes=slot_bytes)
+            with local.lock:
+                worker.variants[vid] = variant
+        elif op == "unvariant":
+            with local.lock:
+                variant = worker.variants.pop(msg[2], None)
+            if variant is not None:
+                with worker.ring_lock:
+                    variant.ring.close()
+                    variant.ring = None
+        elif op == "snapshot":
+            threading.Thread(
+                target=_snapshot, args=(worker, msg[2], notify), daemon=True
+            ).start()
+
+
+if __name__ == "__main__":
+    worker_main(int(sys.argv[1]))
@@ -0,0 +1,116 @@
+# change_gate.py
+import time
+
+from events import bus
+
+# numpy is imported where used, like cv2 in stream_hub.py: frames only
+# exist once OpenCV (which loads numpy anyway) is running.
+
+# Frames are compared as a grayscale sample about this many columns wide,
+# taken by striding over the decoded frame (no resize, no copy of the rest).
+SAMPLE_WIDTH = 64
+# Grey levels a sample point must move to count as changed; sensor noise
+# on a static scene stays well below this.
+PIXEL_DELTA = 12
+# Share of changed sample points that makes the frame "changed".
+CHANGE_FRACTION = 0.01
+# After a change, keep sending every frame this long so motion stays smooth.
+HOLD = 1.0
+# An unchanged scene still gets one frame this often (keeps the stream
+# alive and shows slow drift such as daylight).
+KEEPALIVE = 1.0
+# The camera is reported idle after this long without a change.
+IDLE_AFTER = 5.0
+
+
+class ChangeGate:
+    """Decides per decoded frame whether a gated stream needs a new JPEG.
+
+    Each frame is reduced to a small grayscale sample and compared with the
+    sample of the last frame that was let through for a change or a
+    keepalive, so slow changes add up instead of slipping under the
+    threshold frame by frame. Active/idle transitions are published as
+    ``camera_activity`` events.
+    """
+
+    def __init__(self, cam_id):
+        self.cam_id = cam_id
+        self.ref = None
+        self.last_change = 0.0
+        self.last_pass = 0.0
+        self.active = False
+        self.score = 0.0  # changed share of the last frame
+        self.frames = 0
+        self.passed = 0
+        self.changes = 0  # idle -> active transitions
+        self.changed_at = None  # wall clock of the last change
+
+    def _sample(self, frame):
+        import numpy as np
+
+        step = max(1, frame.shape[1] // SAMPLE_WIDTH)
+        small = frame[::step, ::step]
+        if small.ndim == 3:
+            # integer BT.601 luma from BGR, no float conversion
+            small = (
+                small[..., 0].astype(np.uint16) * 29
+                + small[..., 1].astype(np.uint16) * 150
+                + small[..., 2].astype(np.uint16) * 77
+            ) >> 8
+        return small.astype(np.int16)
+
+    def check(self, frame, now=None):
+        """Score ``frame``; True if a gated stream should encode and send it."""
+        import numpy as np
+
+        now = time.monotonic() if now is None else now
+        sample = self._sample(frame)
+        self.frames += 1
+        if self.ref is None or self.ref.shape != sample.shape:
+            # first frame (or the stream changed size): the new reference
+            self.ref = sample
+            self.last_pass = now
+            self.passed += 1
+            return True
+        diff = np.abs(sample - self.ref)
+        self.score = float(np.count_nonzero(diff > PIXEL_DELTA)) / diff.size
+        changed = self.score >= CHANGE_FRACTION
+
+        if changed:
+            self.last_change = now
+            self.changed_at = time.time()
+            if not self.active:
+                self.active = True
+                self.changes += 1
+                self._publish()
+        elif self.active and now - self.last_change > IDLE_AFTER:
+            self.active = False
+            self._publish()
+
+        keepalive = now - self.last_pass >= KEEPALIVE
+        if changed or keepalive:
+            self.ref = sample
+        if changed or keepalive or now - self.last_change <= HOLD:
+            self.last_pass = now
+            self.passed += 1
+            return True
+        return False
+
+    def _publish(self):
+        bus.publish("camera_activity", {
+            "id": self.cam_id,
+            "active": self.active,
+            "score": round(self.score, 4),
+            "at": time.time(),
+        })
+
+    def as_dict(self):
+        return {
+            "camId": self.cam_id,
+            "active": self.active,
+            "score": round(self.score, 4),
+            "changes": self.changes,
+            "lastChange": self.changed_at,
+            "frames": self.frames,
+            "passed": self.passed,
+        }
@@ -0,0 +1,134 @@
+# control_locks.py
+import threading
+import time
+
+# A control lock lapses this long after its owner's last activity.
+LEASE_TTL = 60.0
+
+
+class Lease:
+    def __init__(self, cam_id, owner, user, ttl):
+        self.cam_id = cam_id
+        self.owner = owner
+        self.user = user
+        self.granted_at = time.time()
+        self.expires = time.monotonic() + ttl
+
+    def as_dict(self):
+        return {
+            "camId": self.cam_id,
+            "user": self.user,
+            "grantedAt": self.granted_at,
+            "expiresIn": max(0.0, round(self.expires - time.monotonic(), 1)),
+        }
+
+
+class CameraLocks:
+    """Exclusive, lease-based camera control locks.
+
+    ``owner`` is any hashable identifying a client (e.g. its connection).
+    Leases are renewed by the owner's activity and indexed per owner, so a
+    disconnect releases exactly that client's cameras without a scan.
+    ``journal(cam_id, user, granted)`` is called on every grant/release.
+    """
+
+    def __init__(self, ttl=LEASE_TTL, journal=None):
+        self.ttl = ttl
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.leases = {}  # cam_id -> Lease
+        self.by_owner = {}  # owner -> {cam_id}
+
+    def _drop(self, lease):
+        """Remove ``lease``; caller holds self.lock."""
+        del self.leases[lease.cam_id]
+        held = self.by_owner.get(lease.owner)
+        if held is not None:
+            held.discard(lease.cam_id)
+            if not held:
+                del self.by_owner[lease.owner]
+
+    def _live(self, cam_id, now, released):
+        """Current lease of ``cam_id``, dropping it if it lapsed. Caller holds self.lock."""
+        lease = self.leases.get(cam_id)
+        if lease is not None and lease.expires <= now:
+            self._drop(lease)
+            released.append(lease)
+            return None
+        return lease
+
+    def _record(self, leases, granted):
+        if self.journal is None:
+            return
+        for lease in leases:
+            self.journal(lease.cam_id, lease.user, granted)
+
+    def acquire(self, cam_id, owner, user=None):
+        """Grant (or renew) ``cam_id`` to ``owner``; returns (granted, holder user)."""
+        now = time.monotonic()
+        released = []
+        with self.lock:
+            lease = self._live(cam_id, now, released)
+            if lease is not None and lease.owner is not owner:
+                holder = lease.user
+                granted = None
+            elif lease is not None:
+                lease.expires = now + self.ttl
+                holder, granted = lease.user, None
+            else:
+                lease = self.leases[cam_id] = Lease(cam_id, owner, user, self.ttl)
+                self.by_owner.setdefault(owner, set()).add(cam_id)
+                holder, granted = user, lease
+        self._record(released, False)
+        if granted is not None:
+            self._record([granted], True)
+        return lease.owner is owner, holder
+
+    def holds(self, cam_id, owner):
+        """True if ``owner`` holds a live lease on ``cam_id``."""
+        now = time.monotonic()
+        released = []
+        with self.lock:
+            lease = self._live(cam_id, now, released)
+        self._record(released, False)
+        return lease is not None and lease.owner is owner
+
+    def renew(self, owner):
+        """Extend every lease ``owner`` holds (call on any client activity)."""
+        now = time.monotonic()
+        with self.lock:
+            for cam_id in self.by_owner.get(owner, ()):
+                lease = self.leases[cam_id]
+                if lease.expires > now:
+                    lease.expires = now + self.ttl
+
+    def release(self, cam_id, owner):
+        with self.lock:
+            lease = self.leases.get(cam_id)
+            if lease is None or lease.owner is not owner:
+                return False
+            self._drop(lease)
+        self._record([lease], False)
+        return True
+
+    def release_all(self, owner):
+        """Release everything ``owner`` holds (on disconnect); returns the cam ids."""
+        with self.lock:
+            cam_ids = self.by_owner.pop(owner, set())
+            leases = [self.leases.pop(cam_id) for cam_id in cam_ids]
+        self._record(leases, False)
+        return sorted(cam_ids)
+
+    def expire(self):
+        """Drop lapsed leases so their release is recorded promptly."""
+        now = time.monotonic()
+        with self.lock:
+            lapsed = [lease for lease in self.leases.values() if lease.expires <= now]
+            for lease in lapsed:
+                self._drop(lease)
+        self._record(lapsed, False)
+        return lapsed
+
+    def snapshot(self):
+        with self.lock:
+            return [lease.as_dict() for lease in self.leases.values()]
@@ -1,5 +1,21 @@
 # db.py
-import pyodbc
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import pyodbc
+except ImportError:  # only needed for the SQL Server backend
+    pyodbc = None
+
+# Storage backend: "mssql" (SQL Server over ODBC) or "sqlite" (embedded,
+# for single-lab edge boxes and local testing; see db_sqlite.py)
+DB_BACKEND = os.environ.get("POLYCAB_DB_BACKEND", "mssql")
+# "fast" (default): startup trusts Schema_Version and skips the DDL checks
+# when it is current; "full" re-runs CREATE DATABASE / CREATE TABLE checks
+SCHEMA_CHECK = os.environ.get("POLYCAB_SCHEMA_CHECK", "fast")
 
 DB_NAME = "PolycabDB"
 
@@ -17,6 +33,21 @@ BASE_CONN_STR = (
 )
 
 
+# Connection pool
+POOL_SIZE = 10
+POOL_TIMEOUT = 5.0        # seconds to wait for a free connection
+POOL_MAX_AGE = 30 * 60    # recycle connections older than this
+POOL_PING_AFTER = 10.0    # health-check connections idle longer than this
+
+# Buffered (batched) inserts
+WRITE_INTERVAL = 1.0      # seconds between background flushes
+WRITE_BATCH = 500         # rows per INSERT batch
+WRITE_MAX_PENDING = 10000  # oldest rows are dropped beyond this (DB down)
+
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within POOL_TIMEOUT."""
+
 
 def get_master_conn():
     """Connect to the SQL Server master DB (SQL Auth)"""
@@ -26,78 +57,533 @@ def get_master_conn():
     )
 
 
-def get_conn():
-    """Connect to the application DB (SQL Auth)"""
+def _connect():
+    """Open a new connection to the application DB (SQL Auth)"""
     return pyodbc.connect(
         BASE_CONN_STR + f"DATABASE={DB_NAME};UID={USERNAME};PWD={PASSWORD};"
     )
 
 
-def init_db():
-    """Create DB and tables (if not exist)"""
-    # 1) Create the database
-    with get_master_conn() as con:
-        cur = con.cursor()
-        cur.execute(f"IF DB_ID('{DB_NAME}') IS NULL CREATE DATABASE {DB_NAME}")
-        cur.commit()
+class PooledConnection:
+    """DB connection whose close() hands it back to the pool."""
 
-    # 2) Create tables
-    with get_conn() as con:
-        cur = con.cursor()
-        # Camera settings
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._pool.release(self)
+
+
+class ConnectionPool:
+    """Bounded pool: checkout waits up to ``timeout``, stale conns are pinged."""
+
+    def __init__(self, factory, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 max_age=POOL_MAX_AGE, ping_after=POOL_PING_AFTER):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ping_after = ping_after
+        self.cond = threading.Condition()
+        self.idle = []  # raw connections with their timestamps, LIFO
+        self.open = 0   # idle + checked out
+        self.waiting = 0
+        self.counters = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "broken": 0,
+            "timeouts": 0,
+            "waitSeconds": 0.0,
+        }
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self.cond:
+            while not self.idle and self.open >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeout(f"no DB connection free after {self.timeout}s")
+                self.waiting += 1
+                try:
+                    self.cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            entry = self.idle.pop() if self.idle else None
+            if entry is None:
+                self.open += 1  # reserve the slot before connecting
+            self.counters["checkouts"] += 1
+            self.counters["waitSeconds"] += time.monotonic() - start
+
+        if entry is not None:
+            raw, created, last_used = entry
+            if self._usable(raw, created, last_used):
+                conn = PooledConnection(self, raw)
+                conn.created = created
+                return conn
+        try:
+            raw = self.factory()
+        except Exception:
+            with self.cond:
+                self.open -= 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.counters["created"] += 1
+        return PooledConnection(self, raw)
+
+    def _usable(self, raw, created, last_used):
+        """Drop connections past max age, ping ones that sat idle a while."""
+        now = time.monotonic()
+        reason = None
+        if now - created > self.max_age:
+            reason = "recycled"
+        elif now - last_used > self.ping_after:
+            try:
+                raw.cursor().execute("SELECT 1").fetchall()
+            except dialect.errors:
+                reason = "broken"
+        if reason is None:
+            return True
+        self._discard(raw)
+        with self.cond:
+            self.counters[reason] += 1
+        return False
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except dialect.errors:
+            pass
+
+    def release(self, conn):
+        raw = conn._raw
+        keep = time.monotonic() - conn.created <= self.max_age
+        if keep:
+            try:
+                raw.rollback()  # never hand out an open transaction
+            except dialect.errors:
+                keep = False
+        if not keep:
+            self._discard(raw)
+        with self.cond:
+            if keep:
+                self.idle.append((raw, conn.created, time.monotonic()))
+            else:
+                self.open -= 1
+                self.counters["recycled"] += 1
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "size": self.size,
+                "open": self.open,
+                "inUse": self.open - len(self.idle),
+                "idle": len(self.idle),
+                "waiting": self.waiting,
+                **self.counters,
+            }
+
+
+class MSSQLDialect:
+    """SQL Server specifics; the SQLite twin lives in db_sqlite.py.
+
+    Queries that differ between backends are built through these helpers
+    (``db.dialect.select_top(...)`` etc.), everything else is shared SQL.
+    """
+
+    name = "mssql"
+
+    @property
+    def errors(self):
+        return (pyodbc.Error,)
+
+    def connect(self):
+        return _connect()
+
+    def create_database(self):
+        with get_master_conn() as con:
+            cur = con.cursor()
+            cur.execute(f"IF DB_ID('{DB_NAME}') IS NULL CREATE DATABASE {DB_NAME}")
+            cur.commit()
+
+    def begin_migration(self, cur):
+        # app.py and server.py may start together: serialize on an app lock
         cur.execute(
-            """
-        IF OBJECT_ID('Camera_Setting') IS NULL
-        CREATE TABLE Camera_Setting (
-            Camera_ID INT IDENTITY(1,1) PRIMARY KEY,
-            Camera_IP NVARCHAR(50),
-            Camera_Name NVARCHAR(100),
-            Status NVARCHAR(50),
-            PTZ_Support BIT,
-            Lab_ID INT NULL  -- <--- NEW
+            "EXEC sp_getapplock @Resource = 'schema_migrations', @LockMode = 'Exclusive'"
         )
+
+    def select_top(self, n, rest):
+        return f"SELECT TOP {int(n)} {rest}"
+
+    def insert_returning(self, insert, values, column):
+        return f"{insert} OUTPUT INSERTED.{column} {values}"
+
+    @property
+    def base_schema(self):
+        return BASE_SCHEMA
+
+    @property
+    def migrations(self):
+        return MIGRATIONS
+
+
+def _make_dialect():
+    if DB_BACKEND == "sqlite":
+        from db_sqlite import SQLiteDialect
+
+        return SQLiteDialect()
+    if DB_BACKEND != "mssql":
+        raise ValueError(f"unknown POLYCAB_DB_BACKEND {DB_BACKEND!r}")
+    if pyodbc is None:
+        raise ImportError("pyodbc is required for the SQL Server backend")
+    return MSSQLDialect()
+
+
+dialect = _make_dialect()
+pool = ConnectionPool(dialect.connect)
+
+
+def get_conn():
+    """Check out a pooled connection to the application DB; close() returns it"""
+    return pool.acquire()
+
+
+class BufferedWriter:
+    """Collect rows in memory and INSERT them in batches from a background thread.
+
+    add() never touches the DB, so callers on latency-sensitive paths don't
+    wait for SQL Server. Rows from a failed batch are retried on the next
+    flush; if the DB stays down the oldest rows are dropped.
+    """
+
+    def __init__(self, name, sql, interval=WRITE_INTERVAL, batch=WRITE_BATCH,
+                 max_pending=WRITE_MAX_PENDING):
+        self.name = name
+        self.sql = sql
+        self.interval = interval
+        self.batch = batch
+        self.max_pending = max_pending
+        self.cond = threading.Condition()
+        self.rows = deque()
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self._thread = None
+        atexit.register(self.flush)
+
+    def add(self, row):
+        with self.cond:
+            if len(self.rows) >= self.max_pending:
+                self.rows.popleft()
+                self.dropped += 1
+            self.rows.append(row)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"writer-{self.name}", daemon=True
+                )
+                self._thread.start()
+            if len(self.rows) >= self.batch:
+                self.cond.notify()
+
+    def _take(self):
+        with self.cond:
+            n = min(len(self.rows), self.batch)
+            return [self.rows.popleft() for _ in range(n)]
+
+    def _write(self, rows):
+        con = get_conn()
+        try:
+            cur = con.cursor()
+            cur.fast_executemany = True
+            cur.executemany(self.sql, rows)
+            con.commit()
+        finally:
+            con.close()
+
+    def flush(self):
+        """Write everything queued so far; returns False if a batch failed."""
+        while True:
+            rows = self._take()
+            if not rows:
+                return True
+            try:
+                self._write(rows)
+            except Exception as e:
+                print(f"[{self.name}] batch of {len(rows)} rows failed: {e}")
+                with self.cond:
+                    self.failures += 1
+                    # back to the front, keeping order; overflow drops oldest
+                    room = self.max_pending - len(self.rows)
+                    keep = rows[-room:] if room > 0 else []
+                    self.dropped += len(rows) - len(keep)
+                    self.rows.extendleft(reversed(keep))
+                return False
+            with self.cond:
+                self.written += len(rows)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait(self.interval)
+            self.flush()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "pending": len(self.rows),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failures": self.failures,
+            }
+
+
+# Base tables (SQL Server); every later change is a migration below
+BASE_SCHEMA = [
+    # Camera settings
+    """
+    IF OBJECT_ID('Camera_Setting') IS NULL
+    CREATE TABLE Camera_Setting (
+        Camera_ID INT IDENTITY(1,1) PRIMARY KEY,
+        Camera_IP NVARCHAR(50),
+        Camera_Name NVARCHAR(100),
+        Status NVARCHAR(50),
+        PTZ_Support BIT,
+        Lab_ID INT NULL  -- <--- NEW
+    )
+    """,
+    # Lab settings
+    """
+    IF OBJECT_ID('Lab_Setting') IS NULL
+    CREATE TABLE Lab_Setting (
+        Lab_ID INT IDENTITY(1,1) PRIMARY KEY,
+        Lab_name NVARCHAR(100),
+        Total_Cameras INT,
+        Online_Cameras INT,
+        Status NVARCHAR(50),
+        Description NVARCHAR(255)
+    )
+    """,
+    # Work_Camera_Lab_Detail
+    """
+    IF OBJECT_ID('Work_Camera_Lab_Detail') IS NULL
+    CREATE TABLE Work_Camera_Lab_Detail (
+        [User] NVARCHAR(100),
+        Camera_ID INT,
+        Lab_ID INT,
+        Date_Time_Stamp DATETIME,
+        Screen_View_Indicator CHAR(1),
+        Screen_edit_indicator CHAR(1)
+    )
+    """,
+    # Session History
+    """
+    IF OBJECT_ID('Session_History') IS NULL
+    CREATE TABLE Session_History (
+        Session_ID INT IDENTITY(1,1) PRIMARY KEY,
+        [User] NVARCHAR(100),
+        Camera_ID INT,
+        Lab_ID INT,
+        Start_Date_Time DATETIME,
+        End_Date_Time DATETIME
+    )
+    """,
+    # Applied migrations
+    """
+    IF OBJECT_ID('Schema_Version') IS NULL
+    CREATE TABLE Schema_Version (
+        Version INT PRIMARY KEY,
+        Name NVARCHAR(100),
+        Applied_At DATETIME DEFAULT GETDATE()
+    )
+    """,
+]
+
+
+# Versioned schema changes, applied in order on top of the base tables
+# created by init_db. Each entry is (version, name, [SQL batches]); the
+# applied version is kept in Schema_Version. Never edit a released entry,
+# append a new one instead. Early entries are guarded because some
+# databases already got those changes before versioning existed.
+MIGRATIONS = [
+    (1, "camera status changed at", [
         """
-        )
-        # Lab settings
-        cur.execute(
-            """
-            IF OBJECT_ID('Lab_Setting') IS NULL
-            CREATE TABLE Lab_Setting (
-                Lab_ID INT IDENTITY(1,1) PRIMARY KEY,
-                Lab_name NVARCHAR(100),
-                Total_Cameras INT,
-                Online_Cameras INT,
-                Status NVARCHAR(50),
-                Description NVARCHAR(255)
-            )
-            """
-        )
-        # Work_Camera_Lab_Detail
-        cur.execute(
-            """
-        IF OBJECT_ID('Work_Camera_Lab_Detail') IS NULL
-        CREATE TABLE Work_Camera_Lab_Detail (
-            [User] NVARCHAR(100),
-            Camera_ID INT,
-            Lab_ID INT,
-            Date_Time_Stamp DATETIME,
-            Screen_View_Indicator CHAR(1),
-            Screen_edit_indicator CHAR(1)
-        )
+        IF COL_LENGTH('Camera_Setting', 'Status_Changed_At') IS NULL
+        ALTER TABLE Camera_Setting ADD Status_Changed_At DATETIME NULL
+        """,
+    ]),
+    (2, "snapshot catalog", [
         """
+        IF OBJECT_ID('Snapshot_Catalog') IS NULL
+        BEGIN
+            CREATE TABLE Snapshot_Catalog (
+                Snapshot_ID INT IDENTITY(1,1) PRIMARY KEY,
+                Camera_ID INT NULL,
+                Lab_ID INT NULL,
+                Taken_At DATETIME2(3) NOT NULL,
+                File_Name NVARCHAR(255) NOT NULL,
+                Size_Bytes INT NOT NULL,
+                Width INT NULL,
+                Height INT NULL
+            );
+            CREATE INDEX IX_Snapshot_Camera_Time ON Snapshot_Catalog (Camera_ID, Taken_At);
+            CREATE INDEX IX_Snapshot_Lab_Time ON Snapshot_Catalog (Lab_ID, Taken_At);
+            CREATE INDEX IX_Snapshot_Time ON Snapshot_Catalog (Taken_At);
+        END
+        """,
+    ]),
+    (3, "session history type and indexes", [
+        """
+        IF COL_LENGTH('Session_History', 'Session_Type') IS NULL
+        ALTER TABLE Session_History ADD Session_Type NVARCHAR(20) NULL,
+                                        PTZ_Commands INT NULL
+        """,
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Session_Camera')
+        BEGIN
+            CREATE INDEX IX_Session_Camera ON Session_History (Camera_ID, Session_ID);
+            CREATE INDEX IX_Session_Lab ON Session_History (Lab_ID, Session_ID);
+            CREATE INDEX IX_Session_User ON Session_History ([User], Session_ID);
+            CREATE INDEX IX_Session_Start ON Session_History (Start_Date_Time);
+        END
+        """,
+    ]),
+    (4, "lookup indexes", [
+        # lab filters and per-lab counts; Status is included so the count
+        # aggregate is answered from the index alone
+        "CREATE INDEX IX_Camera_Lab ON Camera_Setting (Lab_ID) INCLUDE (Status)",
+        # add/update camera resolve the lab by name
+        "CREATE INDEX IX_Lab_Name ON Lab_Setting (Lab_name)",
+        "CREATE INDEX IX_Detail_Camera_Time ON Work_Camera_Lab_Detail (Camera_ID, Date_Time_Stamp)",
+        "CREATE INDEX IX_Detail_Lab_Time ON Work_Camera_Lab_Detail (Lab_ID, Date_Time_Stamp)",
+        "CREATE INDEX IX_Detail_User_Time ON Work_Camera_Lab_Detail ([User], Date_Time_Stamp)",
+    ]),
+    (5, "camera lab foreign key", [
+        # cameras of labs deleted before the key existed become unassigned
+        """
+        UPDATE Camera_Setting SET Lab_ID = NULL
+        WHERE Lab_ID IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM Lab_Setting l WHERE l.Lab_ID = Camera_Setting.Lab_ID)
+        """,
+        """
+        ALTER TABLE Camera_Setting ADD CONSTRAINT FK_Camera_Lab
+        FOREIGN KEY (Lab_ID) REFERENCES Lab_Setting (Lab_ID) ON DELETE SET NULL
+        """,
+    ]),
+    (6, "recording segments", [
+        """
+        ALTER TABLE Camera_Setting ADD Record_Enabled BIT NOT NULL
+        CONSTRAINT DF_Camera_Record_Enabled DEFAULT 0
+        """,
+        """
+        CREATE TABLE Recording_Segment (
+            Segment_ID INT IDENTITY(1,1) PRIMARY KEY,
+            Camera_ID INT NOT NULL,
+            Start_At DATETIME2(3) NOT NULL,
+            End_At DATETIME2(3) NOT NULL,
+            File_Name NVARCHAR(255) NOT NULL,
+            Size_Bytes BIGINT NOT NULL
         )
-        # Session History
-        cur.execute(
-            """
-        IF OBJECT_ID('Session_History') IS NULL
-        CREATE TABLE Session_History (
-            Session_ID INT IDENTITY(1,1) PRIMARY KEY,
-            [User] NVARCHAR(100),
-            Camera_ID INT,
-            Lab_ID INT,
-            Start_Date_Time DATETIME,
-            End_Date_Time DATETIME
-        )
+        """,
+        # time-range lookups per camera, and oldest-first eviction
+        "CREATE INDEX IX_Segment_Camera_Time ON Recording_Segment (Camera_ID, Start_At)",
+        "CREATE INDEX IX_Segment_Time ON Recording_Segment (Start_At)",
+    ]),
+    (7, "service leases", [
+        # one row per job that exactly one process may run (health.py)
         """
+        CREATE TABLE Service_Lease (
+            Name NVARCHAR(50) PRIMARY KEY,
+            Owner NVARCHAR(100) NULL,
+            Expires_At DATETIME2(3) NULL
         )
+        """,
+        "INSERT INTO Service_Lease (Name) VALUES ('health_poller')",
+    ]),
+]
+
+
+def migrate(con):
+    """Apply the backend's pending migrations, one transaction each; returns the schema version."""
+    cur = con.cursor()
+    version = cur.execute("SELECT COALESCE(MAX(Version), 0) FROM Schema_Version").fetchval()
+    for number, name, statements in dialect.migrations:
+        if number <= version:
+            continue
+        try:
+            # another process may be migrating too: lock, then re-check
+            dialect.begin_migration(cur)
+            done = cur.execute(
+                "SELECT 1 FROM Schema_Version WHERE Version = ?", (number,)
+            ).fetchone()
+            if not done:
+                for sql in statements:
+                    cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO Schema_Version (Version, Name) VALUES (?, ?)", (number, name)
+                )
+                print(f"[db] applied migration {number}: {name}")
+            con.commit()
+        except dialect.errors:
+            con.rollback()
+            raise
+        version = number
+    return version
+
+
+def schema_version():
+    """Applied schema version from Schema_Version, or None if it can't be read
+    (no database or no marker table yet)."""
+    try:
+        con = get_conn()
+    except dialect.errors:
+        return None
+    try:
+        return con.cursor().execute("SELECT MAX(Version) FROM Schema_Version").fetchval() or 0
+    except dialect.errors:
+        return None
+    finally:
+        con.close()
+
+
+def init_db(full=SCHEMA_CHECK == "full"):
+    """Make sure the schema is current; returns its version.
+
+    Normally one query against Schema_Version decides: if the newest
+    migration is already applied there is nothing to create, and the
+    pooled connection it used serves the first request. Otherwise (or
+    with full=True) create DB and tables (if not exist), then apply
+    pending migrations.
+    """
+    latest = dialect.migrations[-1][0]
+    if not full:
+        version = schema_version()
+        if version is not None and version >= latest:
+            return version
+
+    # 1) Create the database
+    dialect.create_database()
+
+    # 2) Create tables
+    con = dialect.connect()
+    try:
+        cur = con.cursor()
+        for sql in dialect.base_schema:
+            cur.execute(sql)
         con.commit()
+        # 3) Bring the schema up to date
+        return migrate(con)
+    finally:
+        con.close()
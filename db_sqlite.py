@@ -0,0 +1,210 @@
+# db_sqlite.py
+"""Embedded SQLite backend (WAL mode) for small edge sites and local testing.
+
+Selected with POLYCAB_DB_BACKEND=sqlite; see db.py. Connections behave like
+the pyodbc ones the rest of the app expects: ``?`` parameters, rows with
+attribute access, ``cursor.fetchval()`` and explicit commit().
+"""
+import os
+import sqlite3
+from datetime import datetime
+
+SQLITE_PATH = os.environ.get("POLYCAB_SQLITE_PATH", "polycab.db")
+BUSY_TIMEOUT = 5.0  # seconds a writer waits for another writer's lock
+
+# DATETIME columns come back as datetime objects, like with pyodbc
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+for _type in ("DATETIME", "DATETIME2"):
+    sqlite3.register_converter(_type, lambda b: datetime.fromisoformat(b.decode()))
+
+
+class Row(tuple):
+    """Result row addressable by index or by column name (row.Camera_ID)."""
+
+    def __new__(cls, cursor, values):
+        row = super().__new__(cls, values)
+        row._names = cursor.description
+        return row
+
+    def __getattr__(self, name):
+        for i, column in enumerate(self._names):
+            if column[0] == name:
+                return self[i]
+        raise AttributeError(name)
+
+
+class Cursor(sqlite3.Cursor):
+    """sqlite3 cursor with the pyodbc extras used by the app."""
+
+    fast_executemany = False  # accepted and ignored: executemany is already in-process
+
+    def fetchval(self):
+        row = self.fetchone()
+        return None if row is None else row[0]
+
+
+class Connection(sqlite3.Connection):
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+
+class SQLiteDialect:
+    name = "sqlite"
+    errors = (sqlite3.Error,)
+
+    def connect(self):
+        con = sqlite3.connect(
+            SQLITE_PATH,
+            timeout=BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,  # pooled connections move between threads
+            factory=Connection,
+        )
+        con.row_factory = Row
+        con.execute("PRAGMA journal_mode=WAL")  # readers never block the writer
+        con.execute("PRAGMA synchronous=NORMAL")  # durable enough with WAL, far fewer fsyncs
+        con.execute("PRAGMA foreign_keys=ON")
+        return con
+
+    def create_database(self):
+        directory = os.path.dirname(os.path.abspath(SQLITE_PATH))
+        os.makedirs(directory, exist_ok=True)
+
+    def begin_migration(self, cur):
+        # takes the write lock up front: a second process waits here
+        cur.execute("BEGIN IMMEDIATE")
+
+    def select_top(self, n, rest):
+        return f"SELECT {rest} LIMIT {int(n)}"
+
+    def insert_returning(self, insert, values, column):
+        return f"{insert} {values} RETURNING {column}"
+
+    base_schema = [
+        """
+        CREATE TABLE IF NOT EXISTS Camera_Setting (
+            Camera_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Camera_IP NVARCHAR(50),
+            Camera_Name NVARCHAR(100),
+            Status NVARCHAR(50),
+            PTZ_Support BIT,
+            Lab_ID INT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Lab_Setting (
+            Lab_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Lab_name NVARCHAR(100),
+            Total_Cameras INT,
+            Online_Cameras INT,
+            Status NVARCHAR(50),
+            Description NVARCHAR(255)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Work_Camera_Lab_Detail (
+            [User] NVARCHAR(100),
+            Camera_ID INT,
+            Lab_ID INT,
+            Date_Time_Stamp DATETIME,
+            Screen_View_Indicator CHAR(1),
+            Screen_edit_indicator CHAR(1)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Session_History (
+            Session_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            [User] NVARCHAR(100),
+            Camera_ID INT,
+            Lab_ID INT,
+            Start_Date_Time DATETIME,
+            End_Date_Time DATETIME
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Schema_Version (
+            Version INT PRIMARY KEY,
+            Name NVARCHAR(100),
+            Applied_At DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+        """,
+    ]
+
+    # Same versions as the SQL Server MIGRATIONS in db.py, in SQLite DDL
+    migrations = [
+        (1, "camera status changed at", [
+            "ALTER TABLE Camera_Setting ADD COLUMN Status_Changed_At DATETIME NULL",
+        ]),
+        (2, "snapshot catalog", [
+            """
+            CREATE TABLE Snapshot_Catalog (
+                Snapshot_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                Camera_ID INT NULL,
+                Lab_ID INT NULL,
+                Taken_At DATETIME2(3) NOT NULL,
+                File_Name NVARCHAR(255) NOT NULL,
+                Size_Bytes INT NOT NULL,
+                Width INT NULL,
+                Height INT NULL
+            )
+            """,
+            "CREATE INDEX IX_Snapshot_Camera_Time ON Snapshot_Catalog (Camera_ID, Taken_At)",
+            "CREATE INDEX IX_Snapshot_Lab_Time ON Snapshot_Catalog (Lab_ID, Taken_At)",
+            "CREATE INDEX IX_Snapshot_Time ON Snapshot_Catalog (Taken_At)",
+        ]),
+        (3, "session history type and indexes", [
+            "ALTER TABLE Session_History ADD COLUMN Session_Type NVARCHAR(20) NULL",
+            "ALTER TABLE Session_History ADD COLUMN PTZ_Commands INT NULL",
+            "CREATE INDEX IX_Session_Camera ON Session_History (Camera_ID, Session_ID)",
+            "CREATE INDEX IX_Session_Lab ON Session_History (Lab_ID, Session_ID)",
+            "CREATE INDEX IX_Session_User ON Session_History ([User], Session_ID)",
+            "CREATE INDEX IX_Session_Start ON Session_History (Start_Date_Time)",
+        ]),
+        (4, "lookup indexes", [
+            "CREATE INDEX IX_Camera_Lab ON Camera_Setting (Lab_ID, Status)",
+            "CREATE INDEX IX_Lab_Name ON Lab_Setting (Lab_name)",
+            "CREATE INDEX IX_Detail_Camera_Time ON Work_Camera_Lab_Detail (Camera_ID, Date_Time_Stamp)",
+            "CREATE INDEX IX_Detail_Lab_Time ON Work_Camera_Lab_Detail (Lab_ID, Date_Time_Stamp)",
+            "CREATE INDEX IX_Detail_User_Time ON Work_Camera_Lab_Detail ([User], Date_Time_Stamp)",
+        ]),
+        (5, "camera lab foreign key", [
+            """
+            UPDATE Camera_Setting SET Lab_ID = NULL
+            WHERE Lab_ID IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM Lab_Setting l WHERE l.Lab_ID = Camera_Setting.Lab_ID)
+            """,
+            # SQLite can't add a foreign key to an existing table; a trigger
+            # gives the same ON DELETE SET NULL behaviour
+            """
+            CREATE TRIGGER FK_Camera_Lab AFTER DELETE ON Lab_Setting
+            BEGIN
+                UPDATE Camera_Setting SET Lab_ID = NULL WHERE Lab_ID = OLD.Lab_ID;
+            END
+            """,
+        ]),
+        (6, "recording segments", [
+            "ALTER TABLE Camera_Setting ADD COLUMN Record_Enabled BIT NOT NULL DEFAULT 0",
+            """
+            CREATE TABLE Recording_Segment (
+                Segment_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                Camera_ID INT NOT NULL,
+                Start_At DATETIME2(3) NOT NULL,
+                End_At DATETIME2(3) NOT NULL,
+                File_Name NVARCHAR(255) NOT NULL,
+                Size_Bytes BIGINT NOT NULL
+            )
+            """,
+            "CREATE INDEX IX_Segment_Camera_Time ON Recording_Segment (Camera_ID, Start_At)",
+            "CREATE INDEX IX_Segment_Time ON Recording_Segment (Start_At)",
+        ]),
+        (7, "service leases", [
+            """
+            CREATE TABLE Service_Lease (
+                Name NVARCHAR(50) PRIMARY KEY,
+                Owner NVARCHAR(100) NULL,
+                Expires_At DATETIME2(3) NULL
+            )
+            """,
+            "INSERT INTO Service_Lease (Name) VALUES ('health_poller')",
+        ]),
+    ]
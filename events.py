@@ -0,0 +1,100 @@
+# events.py
+import json
+import queue
+import threading
+from collections import deque
+
+# Events kept for clients that reconnect with Last-Event-ID.
+HISTORY = 500
+# A subscriber that falls this far behind is disconnected; its browser
+# reconnects and replays from history.
+SUBSCRIBER_QUEUE = 200
+KEEPALIVE = 15.0
+# High-rate hints that are only worth seeing live. They are neither kept
+# in the replay history (where they would push out status deltas) nor
+# numbered, so a client's Last-Event-ID always names a replayable event.
+LIVE_ONLY = {"camera_activity"}
+
+
+class EventBus:
+    """In-process fan-out of status/CRUD deltas to Server-Sent Events clients."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.history = deque(maxlen=HISTORY)
+        self.subscribers = set()
+        self.listeners = []
+
+    def listen(self, callback):
+        """Call ``callback(event_type, data)`` synchronously on every publish."""
+        self.listeners.append(callback)
+
+    def publish(self, event_type, data):
+        for callback in self.listeners:
+            callback(event_type, data)
+        with self.lock:
+            if event_type in LIVE_ONLY:
+                event = (None, event_type, json.dumps(data))
+            else:
+                self.last_id += 1
+                event = (self.last_id, event_type, json.dumps(data))
+                self.history.append(event)
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                self._drop(q)
+
+    def _drop(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+        # wake the stream so it notices and ends
+        try:
+            q.get_nowait()
+            q.put_nowait(None)
+        except (queue.Empty, queue.Full):
+            pass
+
+    def stream(self, last_event_id=None):
+        """Yield SSE-formatted events; replays history after ``last_event_id``."""
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        resync = False
+        with self.lock:
+            if last_event_id is not None:
+                missed = [e for e in self.history if e[0] > last_event_id]
+                gap = self.history and self.history[0][0] > last_event_id + 1
+                # an id from before a server restart can't be replayed either
+                restarted = last_event_id > self.last_id
+                if gap or restarted or len(missed) >= SUBSCRIBER_QUEUE:
+                    # too far behind to replay: the client reloads its lists
+                    resync = True
+                else:
+                    for event in missed:
+                        q.put_nowait(event)
+            self.subscribers.add(q)
+        try:
+            yield "retry: 3000\n\n"
+            if resync:
+                yield "event: resync\ndata: {}\n\n"
+            while True:
+                try:
+                    event = q.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                event_id, event_type, data = event
+                if event_id is None:
+                    # no id: the browser's Last-Event-ID stays on the last replayable event
+                    yield f"event: {event_type}\ndata: {data}\n\n"
+                else:
+                    yield f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+        finally:
+            with self.lock:
+                self.subscribers.discard(q)
+
+
+bus = EventBus()
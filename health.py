@@ -0,0 +1,336 @@
+# health.py
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+import db
+from db import get_conn
+from events import bus
+
+# How many cameras are probed at the same time.
+MAX_PARALLEL = 16
+CHECK_TIMEOUT = 2
+# Online cameras are re-checked every BASE_INTERVAL seconds; each failed
+# check doubles the interval for that camera, up to MAX_INTERVAL.
+BASE_INTERVAL = 5.0
+MAX_INTERVAL = 60.0
+# Pick up cameras added/edited by other processes.
+RELOAD_INTERVAL = 30.0
+TICK = 0.5
+# Only one process probes the cameras: the holder of the "health_poller"
+# row in Service_Lease. It renews the lease every LEASE_RENEW seconds; if
+# it dies, another process takes over once LEASE_TTL has passed. Every
+# other process follows the statuses the holder writes to Camera_Setting,
+# re-reading them every FOLLOW_INTERVAL. POLYCAB_HEALTH_POLLER=0 keeps a
+# process out of the election (it only follows).
+ENABLED = os.environ.get("POLYCAB_HEALTH_POLLER") != "0"
+LEASE_NAME = "health_poller"
+LEASE_TTL = 30.0
+LEASE_RENEW = 10.0
+FOLLOW_INTERVAL = BASE_INTERVAL
+
+
+class CameraHealth:
+    def __init__(self, cam_id, ip, lab_id, status):
+        self.cam_id = cam_id
+        self.ip = ip
+        self.lab_id = lab_id
+        self.status = status or "offline"
+        self.db_status = status  # last value known to be in Camera_Setting
+        self.fails = 0
+        self.next_check = 0.0
+        self.checked_at = None  # wall clock, for the API
+        self.in_flight = False
+
+    def as_dict(self):
+        return {
+            "id": self.cam_id,
+            "status": self.status,
+            "checkedAt": self.checked_at,
+            "nextCheckIn": max(0.0, round(self.next_check - time.monotonic(), 1)),
+        }
+
+
+class HealthPoller:
+    """Background camera pinger: bounded parallelism, per-camera backoff.
+
+    Only while this process holds the Service_Lease row (``probe``) are
+    cameras pinged; otherwise the camera list is re-read every
+    FOLLOW_INTERVAL and status flips found there are published like the
+    probing process's own. ``elect=False`` never takes the lease.
+    """
+
+    def __init__(self, auth, elect=ENABLED):
+        self.auth = auth
+        self.elect = elect
+        self.probe = False
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease_until = 0.0  # monotonic; probe only while the lease is surely ours
+        self._next_elect = 0.0
+        self.lock = threading.Lock()
+        self.cameras = {}  # cam_id -> CameraHealth
+        self.pending = {}  # cam_id -> status not yet written to the DB
+        self._next_reload = 0.0
+        self._thread = None
+        self._pool = None
+
+    def ensure_started(self):
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self.elect:
+                atexit.register(self._resign)
+            self._thread = threading.Thread(
+                target=self._run, name="health-poller", daemon=True
+            )
+            self._thread.start()
+
+    def refresh(self):
+        """Reload the camera list on the next tick (after add/edit/delete)."""
+        self._next_reload = 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return [c.as_dict() for c in self.cameras.values()]
+
+    def _run(self):
+        while True:
+            try:
+                if self.elect and time.monotonic() >= self._next_elect:
+                    self._claim()
+                if self.probe and time.monotonic() > self._lease_until:
+                    # renewals failed (DB down?): someone else may hold it by now
+                    self._set_probe(False)
+                if time.monotonic() >= self._next_reload:
+                    self._reload()
+                if self.probe:
+                    self._dispatch()
+                    self._flush()
+                else:
+                    self._follow()
+            except Exception as e:
+                print(f"[health] {e}")
+            time.sleep(TICK)
+
+    def _claim(self):
+        """Take or renew the lease; free or expired leases go to whoever asks first."""
+        self._next_elect = time.monotonic() + LEASE_RENEW
+        started = time.monotonic()
+        now = datetime.now()
+        con = get_conn()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                """
+            UPDATE Service_Lease SET Owner = ?, Expires_At = ?
+            WHERE Name = ? AND (Owner = ? OR Owner IS NULL OR Expires_At < ?)
+            """,
+                (self.owner, now + timedelta(seconds=LEASE_TTL), LEASE_NAME, self.owner, now),
+            )
+            held = cur.rowcount == 1
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            con.close()
+        if held:
+            self._lease_until = started + LEASE_TTL
+        self._set_probe(held)
+
+    def _set_probe(self, probe):
+        if probe == self.probe:
+            return
+        print(f"[health] {'probing cameras' if probe else 'following the DB'} ({self.owner})")
+        with self.lock:
+            self.probe = probe
+            if probe and self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=MAX_PARALLEL, thread_name_prefix="cam-ping"
+                )
+            if not probe:
+                # the new holder writes its own results
+                self.pending.clear()
+        self._next_reload = 0.0
+
+    def _resign(self):
+        """Hand the lease over at shutdown instead of waiting for LEASE_TTL."""
+        if not self.probe:
+            return
+        con = get_conn()
+        try:
+            con.cursor().execute(
+                "UPDATE Service_Lease SET Owner = NULL, Expires_At = NULL WHERE Name = ? AND Owner = ?",
+                (LEASE_NAME, self.owner),
+            )
+            con.commit()
+        except Exception as e:
+            print(f"[health] could not release the lease: {e}")
+        finally:
+            con.close()
+
+    def _reload(self):
+        con = get_conn()
+        try:
+            rows = con.cursor().execute(
+                "SELECT Camera_ID, Camera_IP, Lab_ID, Status FROM Camera_Setting"
+            ).fetchall()
+        finally:
+            con.close()
+        with self.lock:
+            fresh = {}
+            for row in rows:
+                cam = self.cameras.get(row.Camera_ID)
+                if cam is None or cam.ip != row.Camera_IP:
+                    cam = CameraHealth(row.Camera_ID, row.Camera_IP, row.Lab_ID, row.Status)
+                cam.lab_id = row.Lab_ID
+                cam.db_status = row.Status
+                fresh[row.Camera_ID] = cam
+            self.cameras = fresh
+        interval = RELOAD_INTERVAL if self.probe else FOLLOW_INTERVAL
+        self._next_reload = time.monotonic() + interval
+
+    def _dispatch(self):
+        now = time.monotonic()
+        with self.lock:
+            due = [
+                c for c in self.cameras.values()
+                if not c.in_flight and c.next_check <= now
+            ]
+            for cam in due:
+                cam.in_flight = True
+        for cam in due:
+            self._pool.submit(self._check, cam)
+
+    def _check(self, cam):
+        try:
+            # make a request to /magicBox
+            r = requests.get(
+                f"http://{cam.ip}/cgi-bin/magicBox.cgi?action=getSystemInfo",
+                auth=self.auth,
+                timeout=CHECK_TIMEOUT,
+            )
+            status = "online" if r.status_code == 200 else "offline"
+        except Exception:
+            status = "offline"
+
+        with self.lock:
+            cam.in_flight = False
+            cam.checked_at = time.time()
+            if status == "online":
+                cam.fails = 0
+                interval = BASE_INTERVAL
+            else:
+                cam.fails += 1
+                interval = min(BASE_INTERVAL * 2 ** (cam.fails - 1), MAX_INTERVAL)
+            cam.next_check = time.monotonic() + interval
+            cam.status = status
+            # only flips are written; an unchanged status costs no DB work
+            if self.cameras.get(cam.cam_id) is cam and status != cam.db_status:
+                self.pending[cam.cam_id] = status
+            else:
+                self.pending.pop(cam.cam_id, None)
+
+    def _flush(self):
+        """Apply status flips in one set-based transaction.
+
+        On SQL Server changed rows go into a temp table with fast_executemany,
+        then a single UPDATE ... JOIN touches only rows whose Status really
+        differs and stamps Status_Changed_At; other backends run the same
+        guarded UPDATE per row. Lab online counts are derived from
+        Camera_Setting when /api/labs is read, so nothing else is written.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            results, self.pending = self.pending, {}
+
+        con = get_conn()
+        try:
+            cur = con.cursor()
+            if db.dialect.name == "mssql":
+                cur.execute(
+                    """
+                IF OBJECT_ID('tempdb..#Cam_Status') IS NOT NULL DROP TABLE #Cam_Status;
+                CREATE TABLE #Cam_Status (Camera_ID INT PRIMARY KEY, Status NVARCHAR(50));
+                """
+                )
+                cur.fast_executemany = True
+                cur.executemany(
+                    "INSERT INTO #Cam_Status (Camera_ID, Status) VALUES (?, ?)",
+                    list(results.items()),
+                )
+                cur.execute(
+                    """
+                UPDATE c
+                SET c.Status = s.Status, c.Status_Changed_At = GETDATE()
+                FROM Camera_Setting c
+                JOIN #Cam_Status s ON s.Camera_ID = c.Camera_ID
+                WHERE c.Status IS NULL OR c.Status <> s.Status
+                """
+                )
+                cur.execute("DROP TABLE #Cam_Status")
+            else:
+                # embedded backends are in-process: a plain executemany is as cheap
+                now = datetime.now()
+                cur.executemany(
+                    """
+                UPDATE Camera_Setting SET Status = ?, Status_Changed_At = ?
+                WHERE Camera_ID = ? AND (Status IS NULL OR Status <> ?)
+                """,
+                    [(status, now, cam_id, status) for cam_id, status in results.items()],
+                )
+            con.commit()
+        except Exception:
+            con.rollback()
+            # retry on the next tick unless a newer result came in
+            with self.lock:
+                for cam_id, status in results.items():
+                    self.pending.setdefault(cam_id, status)
+            raise
+        finally:
+            con.close()
+
+        # announce only once the DB agrees, so list caches rebuilt on the
+        # event read the new status
+        self._announce(results)
+
+    def _follow(self):
+        """Publish status flips the probing process wrote since the last reload."""
+        with self.lock:
+            results = {
+                c.cam_id: c.db_status for c in self.cameras.values()
+                if c.db_status and c.status != c.db_status
+            }
+            for cam_id, status in results.items():
+                self.cameras[cam_id].status = status
+        if results:
+            self._announce(results)
+
+    def _announce(self, results):
+        labs = set()
+        with self.lock:
+            for cam_id, status in results.items():
+                cam = self.cameras.get(cam_id)
+                if cam is not None:
+                    cam.db_status = status
+                    if cam.lab_id:
+                        labs.add(cam.lab_id)
+            lab_online = {
+                lab_id: sum(
+                    1 for c in self.cameras.values()
+                    if c.lab_id == lab_id and c.status == "online"
+                )
+                for lab_id in labs
+            }
+        for cam_id, status in results.items():
+            bus.publish("camera_status", {"id": cam_id, "status": status})
+        for lab_id, count in lab_online.items():
+            bus.publish("lab_status", {"id": lab_id, "onlineCameras": count})
@@ -0,0 +1,106 @@
+# list_cache.py
+import json
+import threading
+import time
+from collections import deque
+
+# Row-level changes remembered for ?since=<version> queries.
+CHANGE_LOG = 1000
+# Rebuild a cached body at least this often (like registry.TTL), so writes
+# that never reach this process's event bus (another worker, server.py,
+# manual SQL) show up without a restart.
+TTL = 15.0
+
+
+class VersionedList:
+    """Cached JSON body of a list endpoint, keyed by a monotonically increasing version.
+
+    Write paths call touch()/remove()/touch_all(); readers get the cached
+    body (and an ETag) until the version moves or the body is TTL seconds
+    old. A TTL rebuild that finds different rows logs the changed and
+    removed ids itself, so ETags and ?since deltas cover writes made
+    elsewhere too; unchanged rows keep the version (and the ETag).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        # seeded from the clock so versions keep increasing across restarts
+        self.version = int(time.time() * 1000)
+        self.reset_version = self.version  # ?since older than this: full list
+        self.changes = deque()  # (version, id, deleted)
+        self.rows = None
+        self.body = None
+        self.body_version = None
+        self.built_at = 0.0
+
+    def _log(self, item_id, deleted):
+        self.version += 1
+        self.changes.append((self.version, item_id, deleted))
+        if len(self.changes) > CHANGE_LOG:
+            self.reset_version = self.changes.popleft()[0]
+
+    def touch(self, item_id):
+        with self.lock:
+            self._log(item_id, False)
+
+    def remove(self, item_id):
+        with self.lock:
+            self._log(item_id, True)
+
+    def touch_all(self):
+        """Many rows changed: clients asking ?since get the full list."""
+        with self.lock:
+            self.version += 1
+            self.reset_version = self.version
+            self.changes.clear()
+
+    def _diff(self, old_rows, new_rows):
+        """Log rows that differ between two builds. Caller holds self.lock."""
+        before = self.version
+        old = {r["id"]: r for r in old_rows}
+        new = {r["id"]: r for r in new_rows}
+        for item_id, row in new.items():
+            if old.get(item_id) != row:
+                self._log(item_id, False)
+        for item_id in old.keys() - new.keys():
+            self._log(item_id, True)
+        if self.version == before:
+            self.version += 1  # same rows, new order: still a new body
+
+    def get(self, build_rows):
+        """Return (version, body bytes, rows), rebuilding after a write or TTL."""
+        with self.lock:
+            version = self.version
+            if self.body_version == version and time.monotonic() - self.built_at < TTL:
+                return version, self.body, self.rows
+        rows = build_rows()
+        body = json.dumps(rows).encode()
+        with self.lock:
+            if self.version != version:
+                # a write raced the rebuild; the next reader rebuilds again
+                return version, body, rows
+            if self.body_version == version and body != self.body:
+                # changed behind the bus's back
+                self._diff(self.rows, rows)
+                version = self.version
+            self.rows, self.body, self.body_version = rows, body, version
+            self.built_at = time.monotonic()
+        return version, body, rows
+
+    def changes_since(self, since):
+        """(changed ids, deleted ids) after ``since``, or None if too old to tell."""
+        with self.lock:
+            if since < self.reset_version or since > self.version:
+                return None
+            changed, deleted = set(), set()
+            for version, item_id, is_deleted in self.changes:
+                if version <= since:
+                    continue
+                if is_deleted:
+                    deleted.add(item_id)
+                    changed.discard(item_id)
+                else:
+                    changed.add(item_id)
+                    deleted.discard(item_id)
+            return changed, deleted
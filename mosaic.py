@@ -0,0 +1,208 @@
+# mosaic.py
+import re
+import threading
+import time
+
+from stream_hub import FRAME_WAIT, WIDTH_STEPS, width_step
+
+# cv2 and numpy are imported where used (see stream_hub.py).
+
+DEFAULT_WIDTH = 1280
+DEFAULT_HEIGHT = 720
+DEFAULT_FPS = 5.0
+DEFAULT_QUALITY = 70
+MAX_WIDTH = 3840
+MAX_HEIGHT = 2160
+MAX_FPS = 25.0
+MAX_CELLS = 16
+# A tile with no new frame for this long is drawn as offline (its last
+# frame dimmed, or a placeholder if it never had one).
+STALE_AFTER = 3.0
+# Wait this long before reopening a camera whose capture worker stopped.
+RETRY_DELAY = 5.0
+# Unchanged canvases are still re-sent this often, so the client's
+# connection and "last frame" never look dead.
+KEEPALIVE = 1.0
+BACKGROUND = 24  # grey level of empty cells and placeholders
+
+_LAYOUT = re.compile(r"^([1-9]\d?)x([1-9]\d?)$")
+
+
+def parse_layout(text):
+    """'3x2' -> (3 columns, 2 rows); ValueError if malformed or too many cells."""
+    m = _LAYOUT.match(text or "")
+    if not m:
+        raise ValueError(f"bad layout {text!r}")
+    cols, rows = int(m.group(1)), int(m.group(2))
+    if cols * rows > MAX_CELLS:
+        raise ValueError(f"layout {text!r} has more than {MAX_CELLS} cells")
+    return cols, rows
+
+
+class Tile:
+    """One cell of the mosaic and the thread that keeps it current."""
+
+    def __init__(self, cam_id, label, rtsp, x, y, width, height):
+        self.cam_id = cam_id
+        self.label = label
+        self.rtsp = rtsp
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.state = "connecting"  # -> "online" <-> "offline"
+        self.fit = None  # (x, y, w, h) of the picture inside the cell; None: repaint bars
+        self.updated = 0.0  # monotonic time of the last redraw
+        self.has_frame = False
+        self.frames = 0
+
+
+class Mosaic:
+    """Composites the newest frame of several cameras into one MJPEG stream.
+
+    Each tile reads a raw, change-gated variant from the hub: the capture
+    worker (shared with ordinary viewers) hands over its decoded frame
+    shrunk to about tile width, with no JPEG on the way, and only when the
+    scene changed. Tiles resize that straight into one NumPy canvas, which
+    is the only thing JPEG-encoded, once per output frame and only when
+    some tile changed. Cameras that
+    stop delivering are drawn dimmed with an "offline" label and retried
+    in the background; the stream itself keeps going.
+    """
+
+    def __init__(self, hub, cameras, layout, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT,
+                 fps=DEFAULT_FPS, quality=DEFAULT_QUALITY):
+        """``cameras``: one (cam_id, label, rtsp) per cell in reading order, None for empty cells."""
+        import numpy as np
+
+        cols, rows = layout
+        self.hub = hub
+        self.fps = fps
+        self.quality = quality
+        self.tile_width = width // cols
+        self.tile_height = height // rows
+        self.canvas = np.full((height, width, 3), BACKGROUND, np.uint8)
+        self.lock = threading.Lock()  # canvas and version
+        self.version = 0  # bumped on every tile redraw
+        self.stopped = threading.Event()
+        self.tiles = []
+        for i, cam in enumerate(cameras[: cols * rows]):
+            if cam is None:
+                continue
+            cam_id, label, rtsp = cam
+            x = (i % cols) * self.tile_width
+            y = (i // cols) * self.tile_height
+            self.tiles.append(
+                Tile(cam_id, label, rtsp, x, y, self.tile_width, self.tile_height)
+            )
+
+    def _cell(self, tile):
+        return self.canvas[tile.y:tile.y + tile.height, tile.x:tile.x + tile.width]
+
+    def _caption(self, img, text):
+        import cv2
+
+        scale = max(0.4, img.shape[0] / 360)
+        thickness = max(1, round(scale * 1.5))
+        (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        org = ((img.shape[1] - tw) // 2, (img.shape[0] + th) // 2)
+        cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, scale, (200, 200, 200),
+                    thickness, cv2.LINE_AA)
+
+    def _draw(self, tile, frame):
+        """Letterbox a decoded frame into the tile's cell."""
+        import cv2
+
+        h, w = frame.shape[:2]
+        scale = min(tile.width / w, tile.height / h)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        if size != (w, h):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        fit = ((tile.width - size[0]) // 2, (tile.height - size[1]) // 2) + size
+        x, y = fit[:2]
+        with self.lock:
+            cell = self._cell(tile)
+            if tile.fit != fit:
+                cell[:] = BACKGROUND  # bars around a new picture size
+                tile.fit = fit
+            cell[y:y + size[1], x:x + size[0]] = frame
+            self.version += 1
+
+    def _mark_offline(self, tile):
+        """Dim the last frame (or draw a placeholder) and label the tile offline."""
+        if tile.state == "offline":
+            return
+        tile.state = "offline"
+        tile.updated = time.monotonic()
+        tile.fit = None
+        with self.lock:
+            cell = self._cell(tile)
+            if tile.has_frame:
+                cell //= 3
+            else:
+                cell[:] = BACKGROUND
+            self._caption(cell, f"{tile.label} offline")
+            self.version += 1
+
+    def _follow(self, tile):
+        """Tile thread: draw new frames of the camera until the mosaic stops."""
+        interval = 1.0 / self.fps
+        while not self.stopped.is_set():
+            # raw variants are never wider than the largest step
+            width = width_step(tile.width) or WIDTH_STEPS[-1]
+            worker, variant = self.hub.acquire(
+                tile.cam_id, tile.rtsp, width, None, gated=True, raw=True
+            )
+            try:
+                seq = 0
+                while not self.stopped.is_set():
+                    frame, new_seq = worker.wait_frame(variant, seq, min(FRAME_WAIT, STALE_AFTER))
+                    if frame is None:
+                        if not worker.running:
+                            break
+                        if time.monotonic() - tile.updated > STALE_AFTER:
+                            self._mark_offline(tile)
+                        continue
+                    seq = new_seq
+                    self._draw(tile, frame)
+                    tile.state = "online"
+                    tile.has_frame = True
+                    tile.updated = time.monotonic()
+                    tile.frames += 1
+                    # no point resizing faster than the mosaic is sent
+                    self.stopped.wait(interval)
+            finally:
+                self.hub.release(worker, variant)
+            if not self.stopped.is_set():
+                self._mark_offline(tile)
+                self.stopped.wait(RETRY_DELAY)
+
+    def frames(self):
+        """Yield JPEG bytes of the composited canvas at up to ``fps``."""
+        import cv2
+
+        for tile in self.tiles:
+            tile.updated = time.monotonic()
+            self._caption(self._cell(tile), tile.label)
+            threading.Thread(
+                target=self._follow, args=(tile,), name=f"mosaic-{tile.cam_id}", daemon=True
+            ).start()
+        interval = 1.0 / self.fps
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        sent_version = -1
+        sent_at = 0.0
+        try:
+            while True:
+                started = time.monotonic()
+                if self.version != sent_version or started - sent_at >= KEEPALIVE:
+                    with self.lock:
+                        sent_version = self.version
+                        ok, buf = cv2.imencode(".jpg", self.canvas, params)
+                    if ok:
+                        sent_at = started
+                        yield buf.tobytes()
+                delay = interval - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            self.stopped.set()
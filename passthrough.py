@@ -0,0 +1,146 @@
+# passthrough.py
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Remux the camera's own H.264 into HLS (fMP4 segments) with ffmpeg's
+# stream copy: no decode, no re-encode, one process per camera no matter
+# how many viewers fetch the playlist.
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+HLS_ROOT = os.path.join(tempfile.gettempdir(), "polycab_hls")
+HLS_SEGMENT_SECONDS = 1
+HLS_LIST_SIZE = 4
+PLAYLIST = "index.m3u8"
+# Stop a remuxer when no playlist/segment was fetched for this long.
+IDLE_GRACE = 20.0
+PLAYLIST_WAIT = 10.0
+
+
+class Remuxer:
+    def __init__(self, cam_id, rtsp):
+        self.cam_id = cam_id
+        self.rtsp = rtsp
+        self.out_dir = None
+        self.last_access = time.monotonic()
+        self.proc = None
+
+    def start(self):
+        # fresh directory per run, so a reaped remuxer's cleanup can't
+        # delete the files of its replacement
+        os.makedirs(HLS_ROOT, exist_ok=True)
+        self.out_dir = tempfile.mkdtemp(prefix=f"cam{self.cam_id}_", dir=HLS_ROOT)
+        cmd = [
+            FFMPEG_BIN, "-nostdin", "-loglevel", "error",
+            "-rtsp_transport", "tcp", "-i", self.rtsp,
+            # camera audio is usually G.711, which fMP4 can't carry
+            "-an", "-c:v", "copy",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SECONDS),
+            "-hls_list_size", str(HLS_LIST_SIZE),
+            "-hls_flags", "delete_segments+independent_segments+omit_endlist",
+            "-hls_segment_type", "fmp4",
+            "-hls_fmp4_init_filename", "init.mp4",
+            "-hls_segment_filename", os.path.join(self.out_dir, "seg_%05d.m4s"),
+            os.path.join(self.out_dir, PLAYLIST),
+        ]
+        try:
+            self.proc = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL
+            )
+        except OSError as e:
+            print(f"Error: cannot start ffmpeg for cam {self.cam_id}: {e}")
+            self.proc = None
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.proc = None
+        if self.out_dir:
+            shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def wait_playlist(self, timeout=PLAYLIST_WAIT):
+        """The playlist appears once the first segment is complete."""
+        path = os.path.join(self.out_dir, PLAYLIST)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(path):
+                return True
+            if not self.alive():
+                return False
+            time.sleep(0.2)
+        return False
+
+
+class PassthroughHub:
+    """Per-camera ffmpeg remuxers, started on demand and reaped when idle."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remuxers = {}
+        self._reaper = None
+
+    def touch(self, cam_id, rtsp, also=()):
+        """Return a running remuxer for ``cam_id``, starting one if needed.
+
+        A running remuxer of ``rtsp`` or of any URL in ``also`` is reused.
+        """
+        with self.lock:
+            rem = self.remuxers.get(cam_id)
+            if rem is not None and (rem.rtsp not in (rtsp, *also) or not rem.alive()):
+                # camera IP was edited, or ffmpeg died: start over
+                rem.stop()
+                rem = None
+            if rem is None:
+                rem = Remuxer(cam_id, rtsp)
+                rem.start()
+                self.remuxers[cam_id] = rem
+                self._ensure_reaper()
+            rem.last_access = time.monotonic()
+            return rem
+
+    def get(self, cam_id):
+        """Running remuxer for ``cam_id`` (segment fetches), or None."""
+        with self.lock:
+            rem = self.remuxers.get(cam_id)
+            if rem is not None:
+                rem.last_access = time.monotonic()
+            return rem
+
+    def _ensure_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(
+                target=self._reap, name="hls-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(IDLE_GRACE / 4)
+            now = time.monotonic()
+            with self.lock:
+                idle = [
+                    cam_id
+                    for cam_id, rem in self.remuxers.items()
+                    if now - rem.last_access > IDLE_GRACE
+                ]
+                stopping = [self.remuxers.pop(cam_id) for cam_id in idle]
+                done = not self.remuxers
+                if done:
+                    self._reaper = None
+            for rem in stopping:
+                rem.stop()
+            if done:
+                return
+
+
+passthrough = PassthroughHub()
@@ -0,0 +1,178 @@
+# ptz_queue.py
+import threading
+import time
+
+# A failed stop is re-sent this many times (a camera left moving is worse
+# than a lost start).
+STOP_RETRIES = 2
+RETRY_DELAY = 0.3
+
+
+def group_of(code):
+    """Commands in one group replace each other; groups move independently."""
+    if code.startswith("Zoom"):
+        return "zoom"
+    if code.startswith("Focus"):
+        return "focus"
+    return "move"
+
+
+class Axis:
+    """Latest requested vs. last applied motion of one group."""
+
+    def __init__(self):
+        self.desired = None  # (code, speed) or None = stopped
+        self.applied = None  # what the camera was last told
+        self.force_stop = None  # code to stop even though we never started it
+
+
+class CameraPTZ:
+    """Ordered PTZ worker for one camera.
+
+    Handlers only record the latest intent per group; the worker thread
+    sends whatever is needed to reach it. A start/stop pair that arrives
+    while the camera is busy collapses to nothing, a direction change
+    becomes stop old + start new, and commands can never overtake each
+    other. Each camera has its own thread, so a stuck one only delays
+    itself.
+    """
+
+    def __init__(self, cam_id, send):
+        self.cam_id = cam_id
+        self.send = send
+        self.ip = None
+        self.cond = threading.Condition()
+        self.axes = {"move": Axis(), "zoom": Axis(), "focus": Axis()}
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.last_error = None
+        self.busy_since = None
+        self.thread = threading.Thread(target=self._run, name=f"ptz-{cam_id}", daemon=True)
+        self.thread.start()
+
+    def submit(self, ip, action, code, speed):
+        with self.cond:
+            self.ip = ip
+            groups = [group_of(code)] if code else list(self.axes)
+            for group in groups:
+                axis = self.axes[group]
+                # ``coalesced`` counts intents merged into a pending one of
+                # the same kind; a stop cancelling an unsent start is not
+                if action == "start":
+                    if axis.desired is not None and axis.desired != axis.applied:
+                        self.coalesced += 1  # an unsent start is replaced
+                    axis.desired = (code, speed)
+                else:
+                    if axis.force_stop or (axis.desired is None and axis.applied is not None):
+                        self.coalesced += 1  # a stop is already pending
+                    elif axis.desired is None and axis.applied is None and code:
+                        # not started by us (e.g. before a restart): stop anyway
+                        axis.force_stop = code
+                    # an unsent start is simply dropped with its stop
+                    axis.desired = None
+            self.cond.notify()
+
+    def _next(self):
+        """Pick the next command to send, or None. Caller holds self.cond."""
+        for axis in self.axes.values():
+            if axis.force_stop:
+                code, axis.force_stop = axis.force_stop, None
+                return axis, "stop", code, None
+            if axis.desired == axis.applied:
+                continue
+            if axis.applied is not None and (
+                axis.desired is None or axis.desired[0] != axis.applied[0]
+            ):
+                return axis, "stop", axis.applied[0], None
+            code, speed = axis.desired
+            return axis, "start", code, speed
+        return None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                cmd = self._next()
+                while cmd is None:
+                    self.cond.wait()
+                    cmd = self._next()
+                ip = self.ip
+                self.busy_since = time.monotonic()
+                axis, action, code, speed = cmd
+                # count an in-flight command as applied, so a stop arriving
+                # meanwhile isn't mistaken for a never-sent start
+                prev = axis.applied
+                if action == "start":
+                    axis.applied = (code, speed)
+                elif prev and prev[0] == code:
+                    axis.applied = None
+            attempts = 1 + (STOP_RETRIES if action == "stop" else 0)
+            for attempt in range(attempts):
+                try:
+                    ok, msg = self.send(ip, action, code, speed or 5)
+                except Exception as e:
+                    ok, msg = False, str(e)
+                if ok:
+                    break
+                if attempt + 1 < attempts:
+                    time.sleep(RETRY_DELAY)
+            with self.cond:
+                self.busy_since = None
+                if ok:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                    self.last_error = msg
+                    print(f"[ptz] cam {self.cam_id} {action} {code} failed: {msg}")
+                    if action == "start":
+                        axis.applied = prev
+                        if axis.desired == (code, speed):
+                            # don't hammer a camera that refused; wait for a new intent
+                            axis.desired = prev
+                    # a failed stop is assumed stopped rather than looping
+                    # forever; a later stop from the client is still sent
+                    # via force_stop
+
+    def as_dict(self):
+        with self.cond:
+            return {
+                "camId": self.cam_id,
+                "moving": {
+                    group: axis.applied[0]
+                    for group, axis in self.axes.items()
+                    if axis.applied
+                },
+                "pending": sum(
+                    1 for axis in self.axes.values()
+                    if axis.force_stop or axis.desired != axis.applied
+                ),
+                "busyFor": (
+                    round(time.monotonic() - self.busy_since, 1)
+                    if self.busy_since is not None else None
+                ),
+                "sent": self.sent,
+                "failed": self.failed,
+                "coalesced": self.coalesced,
+                "lastError": self.last_error,
+            }
+
+
+class PTZQueues:
+    """One CameraPTZ worker per camera, created on first command."""
+
+    def __init__(self, send):
+        self.send = send
+        self.lock = threading.Lock()
+        self.cameras = {}
+
+    def submit(self, cam_id, ip, action, code=None, speed=5):
+        with self.lock:
+            cam = self.cameras.get(cam_id)
+            if cam is None:
+                cam = self.cameras[cam_id] = CameraPTZ(cam_id, self.send)
+        cam.submit(ip, action, code, speed)
+
+    def stats(self):
+        with self.lock:
+            cameras = list(self.cameras.values())
+        return [c.as_dict() for c in cameras]
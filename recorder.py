@@ -0,0 +1,421 @@
+# recorder.py
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import db
+from passthrough import FFMPEG_BIN
+
+# Continuous recording: ffmpeg's segment muxer stream-copies each enabled
+# camera's H.264 into rolling MP4 files (no decode, no re-encode). Segments
+# are fragmented MP4, so the file being written when a process dies is
+# still playable, and exports join them with the concat demuxer, again
+# without transcoding.
+RECORD_ROOT = os.environ.get("RECORD_DIR", "./recordings")
+SEGMENT_SECONDS = 60
+# Oldest segments are evicted once a camera, or all cameras together,
+# hold more than this.
+CAMERA_MAX_BYTES = int(os.environ.get("RECORD_CAMERA_MAX_BYTES", 20 * 1024 ** 3))
+MAX_BYTES = int(os.environ.get("RECORD_MAX_BYTES", 200 * 1024 ** 3))
+# Only one process may record: enable it there with POLYCAB_RECORDER=1.
+ENABLED = os.environ.get("POLYCAB_RECORDER") == "1"
+# Seconds between re-reads of which cameras have Record_Enabled set.
+SYNC_INTERVAL = 10.0
+RESTART_BACKOFF_MAX = 60.0
+EVICT_BATCH = 100
+# A segment this small is only the MP4 header: ffmpeg exited before a frame.
+EMPTY_SEGMENT_BYTES = 1024
+EXPORT_CHUNK = 64 * 1024
+
+# cam3/20250822_145000.mp4: local wall time the segment was opened
+NAME_FORMAT = "%Y%m%d_%H%M%S"
+FRAGMENTED = "movflags=+frag_keyframe+empty_moov+default_base_moof"
+
+
+class CameraRecording:
+    """One ffmpeg segment muxer for one camera, restarted with backoff if it dies."""
+
+    def __init__(self, cam_id, rtsp, on_segment):
+        self.cam_id = cam_id
+        self.rtsp = rtsp
+        self.on_segment = on_segment
+        self.out_dir = os.path.join(RECORD_ROOT, f"cam{cam_id}")
+        self.proc = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.segments = 0
+        self.last_segment = None
+        self.reader = None
+
+    def start(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        # before Popen: ffmpeg's first file can't be named earlier than this
+        started = datetime.now().strftime(NAME_FORMAT)
+        cmd = [
+            FFMPEG_BIN, "-nostdin", "-loglevel", "error",
+            "-rtsp_transport", "tcp", "-i", self.rtsp,
+            # camera audio is usually G.711, which MP4 can't carry
+            "-an", "-c:v", "copy",
+            "-f", "segment",
+            "-segment_time", str(SEGMENT_SECONDS),
+            "-segment_atclocktime", "1",
+            "-reset_timestamps", "1",
+            "-strftime", "1",
+            "-segment_format", "mp4",
+            "-segment_format_options", FRAGMENTED,
+            # one "name,start,end" line per finished segment
+            "-segment_list", "pipe:1",
+            "-segment_list_type", "csv",
+            os.path.join(self.out_dir, f"{NAME_FORMAT}.mp4"),
+        ]
+        try:
+            self.proc = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True
+            )
+        except OSError as e:
+            print(f"Error: cannot start recorder ffmpeg for cam {self.cam_id}: {e}")
+            self.proc = None
+            return
+        self.reader = threading.Thread(
+            target=self._read, args=(self.proc, started), name=f"record-{self.cam_id}", daemon=True
+        )
+        self.reader.start()
+
+    def _read(self, proc, started):
+        listed = set()
+        for line in proc.stdout:
+            name, start, end = line.strip().rsplit(",", 2)
+            name = os.path.basename(name)
+            listed.add(name)
+            self.segments += 1
+            self.last_segment = name
+            self.failures = 0
+            self.on_segment(self.cam_id, name, float(end) - float(start))
+        # ffmpeg has exited (stopped, or the camera dropped): the segment it
+        # had open is never listed. It is the first file after the last one
+        # listed (or the first since start-up); any later file belongs to a
+        # replacement muxer, which alive() holds back until this is done.
+        after = max(listed) if listed else None
+        names = sorted(
+            name for name in os.listdir(self.out_dir)
+            if name.endswith(".mp4") and (name > after if after else name >= started)
+        )
+        if names:
+            self.on_segment(self.cam_id, names[0], None)
+
+    def alive(self):
+        """ffmpeg is running, or its last segment is still being catalogued."""
+        if self.reader is not None and self.reader.is_alive():
+            return True
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            # SIGTERM lets ffmpeg close (and list) the current segment
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.reader is not None:
+            # a replacement may write to the same directory once this returns
+            self.reader.join(timeout=5)
+        self.proc = None
+
+    def as_dict(self):
+        return {
+            "camId": self.cam_id,
+            "running": self.alive(),
+            "segments": self.segments,
+            "lastSegment": self.last_segment,
+            "failures": self.failures,
+        }
+
+
+class Recorder:
+    """Records every camera with Record_Enabled set, indexed in Recording_Segment.
+
+    A supervisor thread re-reads the enabled set every SYNC_INTERVAL and
+    starts, stops or restarts muxers to match. Finished segments are
+    catalogued and quotas enforced on one writer thread, so eviction never
+    races a concurrent insert.
+    """
+
+    def __init__(self, rtsp_url, root=RECORD_ROOT):
+        self.rtsp_url = rtsp_url  # camera IP -> RTSP URL
+        self.root = root
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="record-index")
+        self.lock = threading.Lock()
+        self.recordings = {}  # cam_id -> CameraRecording
+        self.usage = {}  # cam_id -> catalogued bytes, guarded by the writer thread
+        self._thread = None
+
+    def ensure_started(self):
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="recorder", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.writer.submit(self._reconcile).result()
+        except Exception as e:
+            print(f"[recorder] reconcile failed: {e}")
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[recorder] sync failed: {e}")
+            time.sleep(SYNC_INTERVAL)
+
+    def sync(self):
+        con = db.get_conn()
+        try:
+            rows = con.cursor().execute(
+                "SELECT Camera_ID, Camera_IP FROM Camera_Setting WHERE Record_Enabled = 1"
+            ).fetchall()
+        finally:
+            con.close()
+        wanted = {row.Camera_ID: self.rtsp_url(row.Camera_IP) for row in rows}
+
+        now = time.monotonic()
+        with self.lock:
+            # disabled, deleted, or the camera IP was edited
+            stopping = [
+                self.recordings.pop(cam_id)
+                for cam_id, rec in list(self.recordings.items())
+                if wanted.get(cam_id) != rec.rtsp
+            ]
+            restarting = {rec.cam_id for rec in stopping}
+            for cam_id, rtsp in wanted.items():
+                rec = self.recordings.get(cam_id)
+                if cam_id in restarting:
+                    # IP edited: the old muxer shares out_dir, so the new one
+                    # starts on the next pass, after stop() below
+                    continue
+                if rec is None:
+                    rec = self.recordings[cam_id] = CameraRecording(cam_id, rtsp, self._segment_done)
+                elif rec.alive() or now < rec.retry_at:
+                    continue
+                elif rec.proc is not None:
+                    # died (camera offline, network): back off before retrying
+                    rec.failures += 1
+                    rec.retry_at = now + min(RESTART_BACKOFF_MAX, 5.0 * 2 ** (rec.failures - 1))
+                    print(f"[recorder] cam {cam_id} ffmpeg exited, retry in {rec.retry_at - now:.0f}s")
+                    rec.proc = None
+                    continue
+                rec.start()
+        for rec in stopping:
+            rec.stop()
+
+    def stop_all(self):
+        with self.lock:
+            stopping, self.recordings = list(self.recordings.values()), {}
+        for rec in stopping:
+            rec.stop()
+
+    # ---- index and quotas (writer thread) ----
+
+    def _segment_done(self, cam_id, name, duration):
+        self.writer.submit(self._index, cam_id, name, duration)
+
+    def _index(self, cam_id, name, duration=None):
+        path = os.path.join(self.root, f"cam{cam_id}", name)
+        try:
+            start = datetime.strptime(os.path.splitext(name)[0], NAME_FORMAT)
+            size = os.path.getsize(path)
+        except (ValueError, OSError) as e:
+            print(f"[recorder] skipping segment {path}: {e}")
+            return
+        if size < EMPTY_SEGMENT_BYTES:
+            os.remove(path)
+            return
+        if duration is None:
+            # found on disk after a restart: it ended when it was last written
+            end = datetime.fromtimestamp(os.path.getmtime(path))
+        else:
+            end = start + timedelta(seconds=duration)
+        con = db.get_conn()
+        try:
+            con.cursor().execute(
+                """
+                INSERT INTO Recording_Segment (Camera_ID, Start_At, End_At, File_Name, Size_Bytes)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (cam_id, start, max(end, start), f"cam{cam_id}/{name}", size),
+            )
+            con.commit()
+        except Exception as e:
+            print(f"[recorder] index insert failed for {path}: {e}")
+            return
+        finally:
+            con.close()
+        self.usage[cam_id] = self.usage.get(cam_id, 0) + size
+        self._enforce(cam_id)
+
+    def _reconcile(self):
+        """Load per-camera usage and catalogue segments a crash left unlisted."""
+        con = db.get_conn()
+        try:
+            cur = con.cursor()
+            self.usage = {
+                row[0]: row[1] or 0
+                for row in cur.execute(
+                    "SELECT Camera_ID, SUM(Size_Bytes) FROM Recording_Segment GROUP BY Camera_ID"
+                ).fetchall()
+            }
+            known = {row[0] for row in cur.execute("SELECT File_Name FROM Recording_Segment").fetchall()}
+        finally:
+            con.close()
+        if not os.path.isdir(self.root):
+            return
+        for entry in sorted(os.listdir(self.root)):
+            if not entry.startswith("cam") or not entry[3:].isdigit():
+                continue
+            cam_id = int(entry[3:])
+            for name in sorted(os.listdir(os.path.join(self.root, entry))):
+                if name.endswith(".mp4") and f"{entry}/{name}" not in known:
+                    self._index(cam_id, name)
+
+    def _enforce(self, cam_id):
+        excess = self.usage.get(cam_id, 0) - CAMERA_MAX_BYTES
+        if excess > 0:
+            self._evict(excess, cam_id)
+        excess = sum(self.usage.values()) - MAX_BYTES
+        if excess > 0:
+            self._evict(excess)
+
+    def _evict(self, excess, cam_id=None):
+        """Delete oldest segments (of ``cam_id``, or of any camera) until ``excess`` bytes are freed."""
+        where, params = "", ()
+        if cam_id is not None:
+            where, params = " WHERE Camera_ID = ?", (cam_id,)
+        con = db.get_conn()
+        try:
+            cur = con.cursor()
+            while excess > 0:
+                rows = cur.execute(
+                    db.dialect.select_top(
+                        EVICT_BATCH,
+                        "Segment_ID, Camera_ID, File_Name, Size_Bytes FROM Recording_Segment"
+                        f"{where} ORDER BY Start_At, Segment_ID",
+                    ),
+                    params,
+                ).fetchall()
+                if not rows:
+                    break
+                victims = []
+                for row in rows:
+                    if excess <= 0:
+                        break
+                    victims.append(row)
+                    excess -= row.Size_Bytes
+                cur.executemany(
+                    "DELETE FROM Recording_Segment WHERE Segment_ID = ?",
+                    [(row.Segment_ID,) for row in victims],
+                )
+                con.commit()
+                for row in victims:
+                    try:
+                        os.remove(os.path.join(self.root, row.File_Name))
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"[recorder] cannot delete {row.File_Name}: {e}")
+                    self.usage[row.Camera_ID] = self.usage.get(row.Camera_ID, 0) - row.Size_Bytes
+                print(f"[recorder] evicted {len(victims)} segments")
+        finally:
+            con.close()
+
+    def stats(self):
+        with self.lock:
+            cameras = [rec.as_dict() for rec in self.recordings.values()]
+        usage = dict(self.usage)
+        for cam in cameras:
+            cam["bytes"] = usage.get(cam["camId"], 0)
+        return {
+            "enabled": self._thread is not None,
+            "cameras": cameras,
+            "totalBytes": sum(usage.values()),
+            "cameraMaxBytes": CAMERA_MAX_BYTES,
+            "maxBytes": MAX_BYTES,
+        }
+
+
+# ---- lookups and export (any process) ----
+
+
+def find_segments(cam_id, start, end):
+    """Catalogued segments of ``cam_id`` overlapping [start, end), oldest first."""
+    con = db.get_conn()
+    try:
+        return con.cursor().execute(
+            """
+            SELECT Segment_ID, Camera_ID, Start_At, End_At, File_Name, Size_Bytes
+            FROM Recording_Segment
+            WHERE Camera_ID = ? AND Start_At < ? AND End_At > ?
+            ORDER BY Start_At, Segment_ID
+            """,
+            (cam_id, end, start),
+        ).fetchall()
+    finally:
+        con.close()
+
+
+def export(cam_id, start, end, root=RECORD_ROOT):
+    """Stream [start, end) of a camera's recording as one fragmented MP4.
+
+    Segments are joined with ffmpeg's concat demuxer and stream copy; the
+    cut points snap to the nearest earlier keyframe. Returns an iterator of
+    byte chunks, or None if nothing was recorded in the range.
+    """
+    rows = find_segments(cam_id, start, end)
+    if not rows:
+        return None
+    lines = []
+    for i, row in enumerate(rows):
+        path = os.path.abspath(os.path.join(root, row.File_Name)).replace("'", r"'\''")
+        lines.append(f"file '{path}'")
+        if i == 0 and start > row.Start_At:
+            lines.append(f"inpoint {(start - row.Start_At).total_seconds():.3f}")
+        if i == len(rows) - 1 and end < row.End_At:
+            lines.append(f"outpoint {(end - row.Start_At).total_seconds():.3f}")
+    fd, list_path = tempfile.mkstemp(prefix=f"export_cam{cam_id}_", suffix=".txt")
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    cmd = [
+        FFMPEG_BIN, "-nostdin", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-c", "copy",
+        # fragmented output needs no seeking, so it can go straight to the client
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4", "pipe:1",
+    ]
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    except OSError:
+        os.remove(list_path)
+        raise
+
+    def stream():
+        try:
+            while True:
+                chunk = proc.stdout.read(EXPORT_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            # client gone or done: don't leave ffmpeg behind
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            os.remove(list_path)
+
+    return stream()
@@ -0,0 +1,118 @@
+# registry.py
+import threading
+import time
+
+import db
+
+# Refresh the whole table in the background once the cache is this old,
+# so edits made by other processes show up without a restart.
+TTL = 15.0
+
+
+class CameraRegistry:
+    """In-memory Camera_ID -> camera info map for the stream/PTZ hot paths."""
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.lock = threading.Lock()
+        self.cameras = {}
+        self.loaded_at = None
+        self._refreshing = False
+
+    def _make(self, cam_id, ip, name, ptz, lab_id):
+        return {
+            "id": cam_id,
+            "ip": ip,
+            "name": name,
+            "ptz": bool(ptz),
+            "labId": lab_id,
+            # same credentials for every camera for now
+            "username": self.username,
+            "password": self.password,
+        }
+
+    def _info(self, row):
+        return self._make(
+            row.Camera_ID, row.Camera_IP, row.Camera_Name, row.PTZ_Support, row.Lab_ID
+        )
+
+    def reload(self):
+        con = db.get_conn()
+        try:
+            rows = con.cursor().execute(
+                "SELECT Camera_ID, Camera_IP, Camera_Name, PTZ_Support, Lab_ID FROM Camera_Setting"
+            ).fetchall()
+        finally:
+            con.close()
+        cameras = {row.Camera_ID: self._info(row) for row in rows}
+        with self.lock:
+            self.cameras = cameras
+            self.loaded_at = time.monotonic()
+
+    def _reload_async(self):
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"[registry] reload failed: {e}")
+        finally:
+            with self.lock:
+                self._refreshing = False
+
+    def _maybe_refresh(self):
+        with self.lock:
+            stale = self.loaded_at is None or time.monotonic() - self.loaded_at > TTL
+            if not stale or self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._reload_async, daemon=True).start()
+
+    def get(self, cam_id):
+        """Camera info dict, or None. Only a cache miss touches the DB."""
+        if self.loaded_at is None:
+            self.reload()
+        self._maybe_refresh()
+        with self.lock:
+            cam = self.cameras.get(cam_id)
+        if cam is not None:
+            return cam
+        # maybe added by another process since the last refresh
+        con = db.get_conn()
+        try:
+            row = con.cursor().execute(
+                "SELECT Camera_ID, Camera_IP, Camera_Name, PTZ_Support, Lab_ID FROM Camera_Setting WHERE Camera_ID = ?",
+                (cam_id,),
+            ).fetchone()
+        finally:
+            con.close()
+        if row is None:
+            return None
+        cam = self._info(row)
+        with self.lock:
+            self.cameras[cam_id] = cam
+        return cam
+
+    def in_lab(self, lab_id):
+        """Ids of the cameras assigned to ``lab_id``."""
+        if self.loaded_at is None:
+            self.reload()
+        self._maybe_refresh()
+        with self.lock:
+            return sorted(
+                cam_id for cam_id, cam in self.cameras.items() if cam["labId"] == lab_id
+            )
+
+    def put(self, cam_id, ip, name, ptz, lab_id):
+        cam = self._make(cam_id, ip, name, ptz, lab_id)
+        with self.lock:
+            self.cameras[cam_id] = cam
+
+    def remove(self, cam_id):
+        with self.lock:
+            self.cameras.pop(cam_id, None)
+
+    def invalidate(self):
+        """Force a background reload on the next lookup."""
+        with self.lock:
+            if self.loaded_at is not None:
+                self.loaded_at = float("-inf")
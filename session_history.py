@@ -0,0 +1,135 @@
+# session_history.py
+import atexit
+import threading
+import time
+from datetime import datetime
+
+from db import BufferedWriter
+
+# A session with no open stream and no activity for this long is over.
+IDLE_CLOSE = 30.0
+SWEEP_INTERVAL = 5.0
+
+INSERT_SQL = (
+    "INSERT INTO Session_History "
+    "([User], Camera_ID, Lab_ID, Start_Date_Time, End_Date_Time, Session_Type, PTZ_Commands) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class Session:
+    def __init__(self, kind, user, cam_id, lab_id):
+        self.kind = kind  # "view" or "control"
+        self.user = user
+        self.cam_id = cam_id
+        self.lab_id = lab_id
+        self.started = datetime.now()
+        self.last_seen = time.monotonic()
+        self.ended = None  # wall clock of the last activity
+        self.refs = 0  # open streams / held locks
+        self.ptz = 0
+
+    def as_dict(self):
+        return {
+            "user": self.user,
+            "camId": self.cam_id,
+            "labId": self.lab_id,
+            "type": self.kind,
+            "start": self.started.isoformat(timespec="seconds"),
+            "end": None,
+            "ptzCommands": self.ptz,
+        }
+
+
+class SessionTracker:
+    """Viewing/control sessions kept in memory, written to Session_History when they end.
+
+    open()/close() wrap long-lived things (an MJPEG response, a control
+    lock); touch() marks activity for request-per-call traffic (HLS
+    playlist polls, PTZ commands). Sessions are keyed by (type, user,
+    camera), so reloads and extra tabs extend one session. Every call is a
+    dict update under a lock; rows reach SQL Server through a
+    BufferedWriter.
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer or BufferedWriter("session-history", INSERT_SQL)
+        self.lock = threading.Lock()
+        self.active = {}
+        self._thread = None
+        atexit.register(self.close_all)
+
+    def _session(self, kind, user, cam_id, lab_id):
+        """Live session for the key, created if needed. Caller holds self.lock."""
+        key = (kind, user, cam_id)
+        sess = self.active.get(key)
+        if sess is None:
+            sess = self.active[key] = Session(kind, user, cam_id, lab_id)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="session-sweeper", daemon=True
+                )
+                self._thread.start()
+        sess.last_seen = time.monotonic()
+        sess.ended = datetime.now()
+        return key, sess
+
+    def open(self, kind, user, cam_id, lab_id=None):
+        with self.lock:
+            key, sess = self._session(kind, user, cam_id, lab_id)
+            sess.refs += 1
+        return key
+
+    def close(self, key):
+        with self.lock:
+            sess = self.active.get(key)
+            if sess is not None and sess.refs:
+                sess.refs -= 1
+                sess.last_seen = time.monotonic()
+                sess.ended = datetime.now()
+
+    def touch(self, kind, user, cam_id, lab_id=None, ptz=0):
+        with self.lock:
+            _, sess = self._session(kind, user, cam_id, lab_id)
+            sess.ptz += ptz
+
+    def _write(self, sess):
+        self.writer.add((
+            sess.user, sess.cam_id, sess.lab_id, sess.started, sess.ended,
+            sess.kind, sess.ptz,
+        ))
+
+    def sweep(self):
+        now = time.monotonic()
+        with self.lock:
+            done = [
+                key for key, sess in self.active.items()
+                if sess.refs == 0 and now - sess.last_seen > IDLE_CLOSE
+            ]
+            ended = [self.active.pop(key) for key in done]
+        for sess in ended:
+            self._write(sess)
+
+    def _run(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[sessions] sweep failed: {e}")
+
+    def close_all(self):
+        """End every session now (process exit), then flush the writer."""
+        with self.lock:
+            ended, self.active = list(self.active.values()), {}
+        for sess in ended:
+            sess.ended = datetime.now()
+            self._write(sess)
+        self.writer.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return [sess.as_dict() for sess in self.active.values()]
+
+
+tracker = SessionTracker()
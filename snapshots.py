@@ -0,0 +1,278 @@
+# snapshots.py
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import db
+
+CAPTURE_DIR = "./static/capture"
+THUMB_WIDTH = 240
+THUMB_QUALITY = 70
+
+# Retention tiers, newest first: (age limit in seconds, keep at most one
+# snapshot per camera per this many seconds; 0 = keep all). Anything older
+# than the last tier is deleted.
+RETENTION_TIERS = (
+    (24 * 3600, 0),
+    (7 * 24 * 3600, 3600),
+    (30 * 24 * 3600, 24 * 3600),
+)
+# Oldest snapshots are evicted once the catalog holds more than this.
+MAX_BYTES = int(os.environ.get("SNAPSHOT_MAX_BYTES", 2 * 1024 ** 3))
+RETENTION_INTERVAL = 600.0
+DELETE_BATCH = 500
+
+# snapshot_2025-08-22_14-50-45_cam2.jpg (older files have no _camN)
+FILE_RE = re.compile(r"snapshot_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:-\d{3})?(?:_cam(\d+))?\.jpg$")
+
+
+class SnapshotStore:
+    """Snapshot files on disk, indexed in Snapshot_Catalog.
+
+    Files are written and catalogued off the request thread; a background
+    sweep thins and evicts old snapshots per RETENTION_TIERS / MAX_BYTES.
+    """
+
+    def __init__(self, root=CAPTURE_DIR):
+        self.root = root
+        self.thumb_dir = os.path.join(root, "thumbs")
+        # one writer keeps inserts in capture order
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-writer")
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="snapshot-retention", daemon=True
+            )
+            self._thread.start()
+
+    def add(self, cam_id, lab_id, jpeg, captured_at, width=None, height=None):
+        """Queue a JPEG for saving and cataloguing; returns its path."""
+        taken = datetime.fromtimestamp(captured_at)
+        # milliseconds keep two snapshots within one second apart
+        name = f"snapshot_{taken:%Y-%m-%d_%H-%M-%S}-{taken.microsecond // 1000:03d}_cam{cam_id}.jpg"
+        path = os.path.join(self.root, name)
+        self.writer.submit(self._save, path, name, cam_id, lab_id, jpeg, taken, width, height)
+        return path
+
+    def _save(self, path, name, cam_id, lab_id, jpeg, taken, width, height):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(jpeg)
+        except OSError as e:
+            print(f"Error: cannot save snapshot {path}: {e}")
+            return
+        con = db.get_conn()
+        try:
+            con.cursor().execute(
+                """
+                INSERT INTO Snapshot_Catalog
+                    (Camera_ID, Lab_ID, Taken_At, File_Name, Size_Bytes, Width, Height)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (cam_id, lab_id, taken, name, len(jpeg), width, height),
+            )
+            con.commit()
+        except Exception as e:
+            print(f"[snapshots] catalog insert failed for {name}: {e}")
+        finally:
+            con.close()
+
+    # ---- lookups ----
+
+    def get(self, snapshot_id):
+        con = db.get_conn()
+        try:
+            return con.cursor().execute(
+                "SELECT Snapshot_ID, Camera_ID, Lab_ID, Taken_At, File_Name, Size_Bytes, Width, Height "
+                "FROM Snapshot_Catalog WHERE Snapshot_ID = ?",
+                (snapshot_id,),
+            ).fetchone()
+        finally:
+            con.close()
+
+    def path(self, row):
+        return os.path.join(self.root, row.File_Name)
+
+    def thumbnail(self, row):
+        """Path of the row's thumbnail, generated on first request."""
+        import cv2  # deferred, see stream_hub.py
+
+        thumb = os.path.join(self.thumb_dir, row.File_Name)
+        if os.path.exists(thumb):
+            return thumb
+        src = self.path(row)
+        # decode at 1/2, 1/4 or 1/8 scale: far cheaper than a full decode
+        flag = cv2.IMREAD_COLOR
+        if row.Width:
+            for scale, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                   (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                   (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if row.Width // scale >= THUMB_WIDTH:
+                    flag = reduced
+                    break
+        img = cv2.imread(src, flag)
+        if img is None:
+            return None
+        h, w = img.shape[:2]
+        if w > THUMB_WIDTH:
+            img = cv2.resize(
+                img, (THUMB_WIDTH, round(h * THUMB_WIDTH / w)), interpolation=cv2.INTER_AREA
+            )
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY])
+        if not ok:
+            return None
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        # write then rename, so a concurrent request never sees half a file
+        tmp = f"{thumb}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp, thumb)
+        return thumb
+
+    # ---- retention ----
+
+    def _run(self):
+        try:
+            self.backfill()
+        except Exception as e:
+            print(f"[snapshots] backfill failed: {e}")
+        while True:
+            try:
+                self.apply_retention()
+            except Exception as e:
+                print(f"[snapshots] retention sweep failed: {e}")
+            time.sleep(RETENTION_INTERVAL)
+
+    def backfill(self):
+        """Catalogue loose files saved before the catalog existed."""
+        con = db.get_conn()
+        try:
+            cur = con.cursor()
+            if cur.execute(db.dialect.select_top(1, "1 FROM Snapshot_Catalog")).fetchone():
+                return
+            rows = []
+            for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+                m = FILE_RE.match(name)
+                if not m:
+                    continue
+                taken = datetime.strptime(m.group(1), "%Y-%m-%d_%H-%M-%S")
+                cam_id = int(m.group(2)) if m.group(2) else None
+                size = os.path.getsize(os.path.join(self.root, name))
+                rows.append((cam_id, taken, name, size))
+            if not rows:
+                return
+            cur.fast_executemany = True
+            cur.executemany(
+                """
+                INSERT INTO Snapshot_Catalog (Camera_ID, Taken_At, File_Name, Size_Bytes)
+                VALUES (?, ?, ?, ?)
+                """,
+                rows,
+            )
+            # lab from the camera's current assignment
+            cur.execute(
+                """
+                UPDATE Snapshot_Catalog
+                SET Lab_ID = (
+                    SELECT c.Lab_ID FROM Camera_Setting c
+                    WHERE c.Camera_ID = Snapshot_Catalog.Camera_ID
+                )
+                WHERE Lab_ID IS NULL
+                """
+            )
+            con.commit()
+            print(f"[snapshots] catalogued {len(rows)} existing files")
+        finally:
+            con.close()
+
+    def apply_retention(self):
+        now = datetime.now()
+        newest_limit = RETENTION_TIERS[0][0]
+        con = db.get_conn()
+        try:
+            cur = con.cursor()
+            rows = cur.execute(
+                """
+                SELECT Snapshot_ID, Camera_ID, Taken_At, File_Name
+                FROM Snapshot_Catalog
+                WHERE Taken_At < ?
+                ORDER BY Camera_ID, Taken_At
+                """,
+                (now - timedelta(seconds=newest_limit),),
+            ).fetchall()
+            doomed = []
+            kept_buckets = set()
+            for row in rows:
+                age = (now - row.Taken_At).total_seconds()
+                bucket = None
+                for limit, every in RETENTION_TIERS:
+                    if age < limit:
+                        bucket = every
+                        break
+                if bucket is None:
+                    doomed.append(row)  # older than the last tier
+                elif bucket:
+                    key = (row.Camera_ID, bucket, int(row.Taken_At.timestamp() // bucket))
+                    if key in kept_buckets:
+                        doomed.append(row)
+                    else:
+                        kept_buckets.add(key)
+            self._delete(con, doomed)
+
+            # size cap: evict oldest first
+            total = cur.execute(
+                "SELECT COALESCE(SUM(CAST(Size_Bytes AS BIGINT)), 0) FROM Snapshot_Catalog"
+            ).fetchone()[0]
+            while total > MAX_BYTES:
+                oldest = cur.execute(
+                    db.dialect.select_top(
+                        DELETE_BATCH,
+                        "Snapshot_ID, Camera_ID, Taken_At, File_Name, Size_Bytes "
+                        "FROM Snapshot_Catalog ORDER BY Taken_At, Snapshot_ID",
+                    )
+                ).fetchall()
+                if not oldest:
+                    break
+                batch = []
+                for row in oldest:
+                    batch.append(row)
+                    total -= row.Size_Bytes or 0
+                    if total <= MAX_BYTES:
+                        break
+                self._delete(con, batch)
+        finally:
+            con.close()
+
+    def _delete(self, con, rows):
+        cur = con.cursor()
+        for i in range(0, len(rows), DELETE_BATCH):
+            batch = rows[i:i + DELETE_BATCH]
+            ids = [row.Snapshot_ID for row in batch]
+            cur.execute(
+                f"DELETE FROM Snapshot_Catalog WHERE Snapshot_ID IN ({','.join('?' * len(ids))})",
+                ids,
+            )
+            con.commit()
+            # rows go first: a crash leaves orphan files, never dangling rows
+            for row in batch:
+                for path in (self.path(row), os.path.join(self.thumb_dir, row.File_Name)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"[snapshots] cannot delete {path}: {e}")
+        if rows:
+            print(f"[snapshots] retention removed {len(rows)} snapshots")
+
+
+store = SnapshotStore()
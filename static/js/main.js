@@ -132,17 +132,16 @@ async function buildCameraList() {
         </div>
       `;
 
-      if (isOnline) {
-        // allow drag
-        row.addEventListener("dragstart", (e) =>
-          e.dataTransfer.setData("id", row.dataset.id)
-        );
-      } else {
+      // listeners check row.draggable, which live status updates toggle
+      row.addEventListener("dragstart", (e) =>
+        e.dataTransfer.setData("id", row.dataset.id)
+      );
+      row.addEventListener("mousedown", () => {
         // show alert if user tries to drag offline camera
-        row.addEventListener("mousedown", () => {
+        if (!row.draggable) {
           alert(`Camera "${c.name}" is offline and cannot be dragged.`);
-        });
-      }
+        }
+      });
 
       content.appendChild(row);
     });
@@ -273,7 +272,47 @@ async function ensureModuleLoaded(viewId) {
   } catch (_) { }
 }
 
-// Ping cameras every ~20 seconds
+// ---------- Live updates (Server-Sent Events) ----------
+function applyCameraStatus({ id, status }) {
+  const row = document.querySelector(`#camera-list .camera-row[data-id="${id}"]`);
+  if (!row) return;
+  row.querySelector(".status-dot").className = `status-dot ${statusClass(status)}`;
+  row.querySelector(".status-text").textContent = status || "unknown";
+  row.draggable = (status || "").toLowerCase() === "online";
+}
+
+let rebuildTimer = null;
+function scheduleCameraListRebuild() {
+  clearTimeout(rebuildTimer);
+  rebuildTimer = setTimeout(buildCameraList, 200);
+}
+
+const SERVER_EVENTS = [
+  "camera_status",
+  "lab_status",
+  "camera_added",
+  "camera_updated",
+  "camera_deleted",
+  "labs_changed",
+  "resync",
+];
+
+// Views listen for "server:event" instead of polling the API
+function connectServerEvents() {
+  const es = new EventSource("/api/events");
+  SERVER_EVENTS.forEach((type) => {
+    es.addEventListener(type, (e) => {
+      const data = JSON.parse(e.data || "{}");
+      if (type === "camera_status") applyCameraStatus(data);
+      else if (type !== "lab_status") scheduleCameraListRebuild();
+      window.dispatchEvent(
+        new CustomEvent("server:event", { detail: { type, data } })
+      );
+    });
+  });
+}
+
+// Fallback for browsers without EventSource: ping cameras every ~20 seconds
 async function checkStatuses() {
   try {
     await fetch("/api/cameras/ping");
@@ -284,8 +323,12 @@ async function checkStatuses() {
   }
 }
 
-checkStatuses();
-setInterval(checkStatuses, 20000);
+if (window.EventSource) {
+  connectServerEvents();
+} else {
+  checkStatuses();
+  setInterval(checkStatuses, 20000);
+}
 
 // ---------- Init ----------
 window.addEventListener("load", () => {
@@ -83,6 +83,26 @@ export async function pingAndRefresh() {
   window.buildCameraList();
 }
 
+function onServerEvent({ detail: { type, data } }) {
+  if (type === "camera_status") {
+    const cam = cameras.find((c) => c.id === data.id);
+    if (cam) cam.status = data.status;
+  } else if (type === "camera_added" || type === "camera_updated") {
+    // this tab may already have refetched after its own write
+    const idx = cameras.findIndex((c) => c.id === data.id);
+    if (idx !== -1) cameras[idx] = data;
+    else cameras.push(data);
+  } else if (type === "camera_deleted") {
+    cameras = cameras.filter((c) => c.id !== data.id);
+  } else if (type === "resync") {
+    fetchCameras();
+    return;
+  } else {
+    return;
+  }
+  renderCamerasTable();
+}
+
 export function init() {
   const addCameraBtn = document.getElementById("add-camera-btn");
   const addCameraModal = document.getElementById("add-camera-modal");
@@ -97,7 +117,8 @@ export function init() {
 
   fetchLabs(); // <--- load labs dropdown
   fetchCameras();
-  setInterval(pingAndRefresh, 5000);
+  // status and add/edit/delete deltas are pushed by main.js (SSE)
+  window.addEventListener("server:event", onServerEvent);
 
   if (addCameraBtn) {
     addCameraBtn.addEventListener("click", async () => {
@@ -1,4 +1,23 @@
-import { getPTZSpeed as getSettingsPTZSpeed } from "./settings.js";
+import {
+  getPTZSpeed as getSettingsPTZSpeed,
+  getStreamMode,
+} from "./settings.js";
+
+// Served from this app, never a CDN: lab networks are often offline. Pinned
+// build, see static/js/vendor/README.md; if it is missing, feeds fall back
+// to MJPEG.
+const HLS_JS_URL = "/static/js/vendor/hls.min.js";
+let hlsJsLoader = null;
+let hlsJsMissing = false;
+
+// An MJPEG grid is one server-composited stream (/video_feed/mosaic): one
+// connection and one encode per output frame instead of one per tile. Each
+// tile's canvas copies its cell out of the hidden mosaic image.
+const MOSAIC_FPS = 10;
+const MOSAIC_MAX_WIDTH = 3840;
+const MOSAIC_MAX_HEIGHT = 2160;
+let mosaic = null; // { url, img, timer, cols, cellWidth, cellHeight }
+let mosaicFailed = false;
 
 let dash;
 let streams = [];
@@ -30,6 +49,7 @@ export function init() {
 
   document.addEventListener("mouseup", ptzSafety);
   document.addEventListener("pointerup", ptzSafety);
+  document.addEventListener("fullscreenchange", onFullscreenChange);
 
   renderStreams();
   updateCameraName();
@@ -37,15 +57,206 @@ export function init() {
 }
 
 // Helpers
-function videoFeedUrl(camId) {
-  return `/video_feed?cam_id=${camId}`;
+// Small tiles ask for a width so the server picks the camera substream and
+// downscales; a single or fullscreen tile gets the main stream.
+function videoFeedUrl(camId, { width, profile = "auto" } = {}) {
+  const params = new URLSearchParams({ cam_id: camId, profile });
+  if (width) params.set("width", Math.round(width));
+  return `/video_feed?${params}`;
+}
+
+// Same width/profile as the MJPEG feed, so small tiles remux the substream
+function hlsFeedUrl(camId, { width, profile = "auto" } = {}) {
+  const params = new URLSearchParams({ profile });
+  if (width) params.set("width", Math.round(width));
+  return `/video_feed/hls/${camId}/index.m3u8?${params}`;
+}
+
+function loadHlsJs() {
+  if (window.Hls) return Promise.resolve(window.Hls);
+  if (!hlsJsLoader) {
+    hlsJsLoader = new Promise((resolve, reject) => {
+      const s = document.createElement("script");
+      s.src = HLS_JS_URL;
+      s.onload = () => resolve(window.Hls);
+      s.onerror = (e) => {
+        hlsJsMissing = true;
+        reject(e);
+      };
+      document.head.appendChild(s);
+    });
+  }
+  return hlsJsLoader;
+}
+
+function createMjpegFeed(camId, feedOpts) {
+  const img = document.createElement("img");
+  img.dataset.gridSrc = videoFeedUrl(camId, feedOpts);
+  img.src = img.dataset.gridSrc;
+  img.dataset.camId = camId;
+  img.className = "video-feed";
+  img.draggable = false;
+  return img;
+}
+
+function mosaicFeedUrl(ids, cols, rows, width, height) {
+  const params = new URLSearchParams({
+    cams: ids.join(","),
+    layout: `${cols}x${rows}`,
+    width,
+    height,
+    fps: MOSAIC_FPS,
+  });
+  return `/video_feed/mosaic?${params}`;
+}
+
+// Start (or keep, if unchanged) the mosaic stream for the current grid
+function ensureMosaic(ids, cols) {
+  const rows = Math.ceil(ids.length / cols);
+  const dpr = window.devicePixelRatio || 1;
+  const width = Math.min(Math.round(dash.clientWidth * dpr), MOSAIC_MAX_WIDTH);
+  // 16:9 cells
+  const height = Math.min(Math.round(((width / cols) * 9) / 16) * rows, MOSAIC_MAX_HEIGHT);
+  const url = mosaicFeedUrl(ids, cols, rows, Math.max(width, cols), Math.max(height, rows));
+  if (mosaic && mosaic.url === url) return mosaic;
+  stopMosaic();
+
+  const img = document.createElement("img");
+  img.alt = "";
+  img.style.cssText =
+    "position:absolute;width:1px;height:1px;opacity:0;pointer-events:none;";
+  img.onerror = () => {
+    // server can't composite (e.g. older build): one MJPEG stream per tile
+    mosaicFailed = true;
+    stopMosaic();
+    renderStreams();
+  };
+  img.src = url;
+  document.body.appendChild(img);
+  mosaic = {
+    url,
+    img,
+    cols,
+    cellWidth: Math.floor(Math.max(width, cols) / cols),
+    cellHeight: Math.floor(Math.max(height, rows) / rows),
+  };
+  mosaic.timer = setInterval(drawMosaicTiles, 1000 / MOSAIC_FPS);
+  return mosaic;
+}
+
+function stopMosaic() {
+  if (!mosaic) return;
+  clearInterval(mosaic.timer);
+  mosaic.img.onerror = null;
+  mosaic.img.removeAttribute("src");
+  mosaic.img.remove();
+  mosaic = null;
+}
+
+function createMosaicTile(index) {
+  const canvas = document.createElement("canvas");
+  canvas.className = "video-feed";
+  canvas.dataset.mosaicIndex = index;
+  canvas.width = mosaic.cellWidth;
+  canvas.height = mosaic.cellHeight;
+  return canvas;
+}
+
+function drawMosaicTiles() {
+  const { img, cols, cellWidth: w, cellHeight: h } = mosaic;
+  if (!img.naturalWidth) return;
+  dash.querySelectorAll("canvas.video-feed").forEach((canvas) => {
+    const i = Number(canvas.dataset.mosaicIndex);
+    const x = (i % cols) * w;
+    const y = Math.floor(i / cols) * h;
+    canvas.getContext("2d").drawImage(img, x, y, w, h, 0, 0, w, h);
+  });
+}
+
+function onFullscreenChange() {
+  const fs = document.fullscreenElement;
+  // a fullscreen mosaic tile gets its own main-stream feed
+  if (fs) {
+    fs.querySelectorAll("canvas.video-feed").forEach((canvas) => {
+      const camId = streams[Number(canvas.dataset.mosaicIndex)];
+      canvas.replaceWith(createMjpegFeed(camId, { profile: "main" }));
+      fs.dataset.mosaicTile = "1";
+    });
+  } else if (dash.querySelector("[data-mosaic-tile]")) {
+    renderStreams();
+    return;
+  }
+  dash.querySelectorAll("img.video-feed").forEach((img) => {
+    const want =
+      fs && fs.contains(img)
+        ? videoFeedUrl(img.dataset.camId, { profile: "main" })
+        : img.dataset.gridSrc;
+    if (want && img.getAttribute("src") !== want) img.src = want;
+  });
+}
+
+// "auto" (the default) uses passthrough wherever the browser can play HLS:
+// natively (Safari) or through hls.js on Media Source Extensions
+function wantsPassthrough() {
+  const mode = getStreamMode();
+  if (mode !== "auto") return mode === "passthrough";
+  if (document.createElement("video").canPlayType("application/vnd.apple.mpegurl")) {
+    return true;
+  }
+  return !hlsJsMissing && !!(window.MediaSource || window.ManagedMediaSource);
+}
+
+// Passthrough (HLS remux, no server-side decode) with MJPEG as the fallback
+function createFeed(camId, feedOpts) {
+  if (!wantsPassthrough()) return createMjpegFeed(camId, feedOpts);
+
+  const video = document.createElement("video");
+  video.className = "video-feed";
+  video.muted = true;
+  video.autoplay = true;
+  video.playsInline = true;
+
+  const fallback = () => {
+    if (video._hls) video._hls.destroy();
+    video._hls = null;
+    if (video.isConnected) video.replaceWith(createMjpegFeed(camId, feedOpts));
+  };
+  video.addEventListener("error", fallback);
+
+  if (video.canPlayType("application/vnd.apple.mpegurl")) {
+    video.src = hlsFeedUrl(camId, feedOpts);
+    return video;
+  }
+  loadHlsJs()
+    .then((Hls) => {
+      if (!Hls || !Hls.isSupported()) return fallback();
+      const hls = new Hls({ liveSyncDurationCount: 2 });
+      video._hls = hls;
+      hls.on(Hls.Events.ERROR, (_, data) => {
+        if (data.fatal) fallback();
+      });
+      hls.loadSource(hlsFeedUrl(camId, feedOpts));
+      hls.attachMedia(video);
+    })
+    .catch(fallback);
+  return video;
+}
+
+// close open feeds so the server can release the camera sessions
+function destroyFeeds() {
+  dash.querySelectorAll(".video-feed").forEach((el) => {
+    if (el._hls) el._hls.destroy();
+    el.removeAttribute("src");
+  });
 }
 
 function renderStreams() {
+  destroyFeeds();
   dash.innerHTML = "";
   dash.classList.remove("single-stream");
 
   if (streams.length === 0) {
+    stopMosaic();
     activeStreamId = null;
     const hint = document.createElement("p");
     hint.textContent = "Drag camera icons here";
@@ -54,6 +265,8 @@ function renderStreams() {
     updateControlPanelVisibility();
     return;
   }
+  let feedOpts = { profile: "main" };
+  let useMosaic = false;
   if (streams.length === 1) {
     dash.classList.add("single-stream");
     dash.style.gridTemplateColumns = "1fr";  // <-- reset
@@ -61,9 +274,15 @@ function renderStreams() {
     dash.classList.remove("single-stream");
     const cols = Math.ceil(Math.sqrt(streams.length));
     dash.style.gridTemplateColumns = `repeat(${cols},1fr)`;
+    const tileWidth = (dash.clientWidth / cols) * (window.devicePixelRatio || 1);
+    feedOpts = { width: tileWidth, profile: "auto" };
+    // passthrough tiles cost no server encode; MJPEG tiles share one mosaic
+    useMosaic = !mosaicFailed && !wantsPassthrough();
+    if (useMosaic) ensureMosaic(streams, cols);
   }
+  if (!useMosaic) stopMosaic();
 
-  streams.forEach((id) => {
+  streams.forEach((id, index) => {
     const cell = document.createElement("div");
     cell.className = "stream";
     if (id === activeStreamId) cell.classList.add("active");
@@ -99,11 +318,12 @@ function renderStreams() {
 
     const vc = document.createElement("div");
     vc.className = "video-container";
-    const img = document.createElement("img");
-    img.src = videoFeedUrl(id);
-    img.className = "video-feed";
-    img.draggable = false;
-    vc.appendChild(img);
+    vc.appendChild(useMosaic ? createMosaicTile(index) : createFeed(id, feedOpts));
+    vc.ondblclick = (e) => {
+      e.stopPropagation();
+      if (document.fullscreenElement) document.exitFullscreen();
+      else vc.requestFullscreen?.();
+    };
     cell.appendChild(vc);
 
     cell.onclick = () => {
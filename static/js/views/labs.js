@@ -30,7 +30,8 @@ function renderLabsTable() {
 }
 
 async function fetchLabs() {
-  const response = await fetch("/api/labs", { cache: "no-store" });
+  // revalidates with If-None-Match; unchanged lists come back as 304
+  const response = await fetch("/api/labs", { cache: "no-cache" });
   labs = await response.json();
   renderLabsTable();
 }
@@ -61,6 +62,19 @@ async function deleteLabOnServer(id) {
   window.dispatchEvent(new CustomEvent("labs:changed")); // <--- add
 }
 
+function onServerEvent({ detail: { type, data } }) {
+  if (type === "lab_status") {
+    const lab = labs.find((l) => l.id === data.id);
+    if (lab) {
+      lab.onlineCameras = data.onlineCameras;
+      renderLabsTable();
+    }
+  } else if (type !== "camera_status") {
+    // camera add/edit/delete change lab totals
+    fetchLabs();
+  }
+}
+
 export function init() {
   const addLabBtn = document.getElementById("add-lab-btn");
   const addLabModal = document.getElementById("add-lab-modal");
@@ -76,6 +90,7 @@ export function init() {
   const labsTableBody = document.getElementById("labs-table-body");
 
   fetchLabs();
+  window.addEventListener("server:event", onServerEvent);
 
   if (addLabBtn) {
     addLabBtn.addEventListener("click", () => {
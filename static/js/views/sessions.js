@@ -1,83 +1,91 @@
-// Sample data - in a real app, this would come from your backend
-let sessions = [
-  {
-    id: 1,
-    clientId: "CL-0901",
-    camera: "Cam-EL-01",
-    lab: "Electronics Lab",
-    startTime: "5/15/2023, 9:00:00 AM",
-    endTime: "5/15/2023, 10:00:00 AM",
-    duration: "1h",
-    ptzUsage: "Moderate",
-    status: "completed",
-  },
-  {
-    id: 1,
-    clientId: "CL-0901",
-    camera: "Cam-EL-01",
-    lab: "Electronics Lab",
-    startTime: "5/15/2023, 9:00:00 AM",
-    endTime: "5/15/2023, 10:00:00 AM",
-    duration: "1h",
-    ptzUsage: "Moderate",
-    status: "completed",
-  },
-  {
-    id: 2,
-    clientId: "CL-0902",
-    camera: "Cam-RL-01",
-    lab: "Robotics Lab",
-    startTime: "5/15/2023, 9:30:00 AM",
-    endTime: "5/15/2023, 11:00:00 AM",
-    duration: "1h 30m",
-    ptzUsage: "High",
-    status: "completed",
-  },
-  {
-    id: 3,
-    clientId: "CL-0903",
-    camera: "Cam-PL-01",
-    lab: "Physics Lab",
-    startTime: "5/15/2023, 10:15:00 AM",
-    endTime: null,
-    duration: "Active",
-    ptzUsage: "Low",
-    status: "active",
-  },
-  {
-    id: 4,
-    clientId: "CL-0904",
-    camera: "Cam-CS-01",
-    lab: "Computer Science Lab",
-    startTime: "5/15/2023, 1:00:00 PM",
-    endTime: "5/15/2023, 3:45:00 PM",
-    duration: "2h 45m",
-    ptzUsage: "High",
-    status: "completed",
-  },
-  {
-    id: 5,
-    clientId: "CL-0905",
-    camera: "Cam-BL-01",
-    lab: "Biology Lab",
-    startTime: "5/16/2023, 8:00:00 AM",
-    endTime: null,
-    duration: "Active",
-    ptzUsage: "Moderate",
-    status: "active",
-  },
-];
+// Sessions come from /api/sessions: finished ones page by page (keyset
+// cursor), plus the ones still active on the first page.
+let sessions = [];
+let nextCursor = null;
+let loading = false;
 
-export function init() {
+function formatTime(iso) {
+  return iso ? new Date(iso).toLocaleString() : null;
+}
+
+function formatDuration(startIso, endIso) {
+  const ms = (endIso ? new Date(endIso) : new Date()) - new Date(startIso);
+  const mins = Math.max(0, Math.round(ms / 60000));
+  const h = Math.floor(mins / 60);
+  const m = mins % 60;
+  if (h && m) return `${h}h ${m}m`;
+  if (h) return `${h}h`;
+  return `${m}m`;
+}
+
+function ptzUsage(count) {
+  if (count >= 50) return "High";
+  if (count >= 10) return "Moderate";
+  return "Low";
+}
+
+function toRow(s, active) {
+  return {
+    id: s.id,
+    clientId: s.user || "-",
+    camera: s.camera || (s.camId ? `Cam ${s.camId}` : "-"),
+    lab: s.lab || "-",
+    startTime: formatTime(s.start),
+    endTime: active ? null : formatTime(s.end),
+    duration: active ? "Active" : formatDuration(s.start, s.end),
+    ptzUsage: s.type === "control" ? ptzUsage(s.ptzCommands) : "Low",
+    status: active ? "active" : "completed",
+  };
+}
+
+async function fetchSessions(more = false) {
+  if (loading) return;
+  loading = true;
+  try {
+    const params = new URLSearchParams({ limit: "50" });
+    if (more && nextCursor) params.set("cursor", nextCursor);
+    const response = await fetch(`/api/sessions?${params}`);
+    if (!response.ok) throw new Error(response.statusText);
+    const data = await response.json();
+    const rows = data.items.map((s) => toRow(s, false));
+    if (more) {
+      sessions = sessions.concat(rows);
+    } else {
+      sessions = data.active.map((s) => toRow(s, true)).concat(rows);
+    }
+    nextCursor = data.next;
+  } catch (err) {
+    console.error("Failed to load sessions:", err);
+  } finally {
+    loading = false;
+  }
+}
+
+export async function init() {
   const sessionsTableBody = document.getElementById("sessions-table-body");
   const sessionsCountElement = document.getElementById("sessions-count");
+  const loadMoreButton = document.getElementById("sessions-load-more");
+
+  if (loadMoreButton) {
+    loadMoreButton.addEventListener("click", async () => {
+      await fetchSessions(true);
+      render();
+    });
+  }
+
+  await fetchSessions();
+  render();
 
-  // Initialize the table
-  renderSessionsTable();
+  function render() {
+    renderSessionsTable();
 
-  // Update sessions count
-  if (sessionsCountElement) {
-    sessionsCountElement.textContent = sessions.length;
+    // Update sessions count
+    if (sessionsCountElement) {
+      sessionsCountElement.textContent = sessions.length;
+    }
+    if (loadMoreButton) {
+      loadMoreButton.style.display = nextCursor ? "" : "none";
+    }
   }
 
   // Render the sessions table
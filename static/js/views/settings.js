@@ -1,6 +1,10 @@
 let settings = {
   ptzSpeed: 5,
   serverIP: "192.168.1.100",
+  // "auto" (passthrough where the browser plays HLS, else MJPEG), "mjpeg"
+  // or "passthrough" (HLS remux; needs static/js/vendor/hls.min.js outside
+  // Safari, see the README there)
+  streamMode: "auto",
 };
 
 export function init() {
@@ -13,6 +17,7 @@ function loadSettings() {
   const slider = document.getElementById("settings-ptz-speed");
   const badge = document.getElementById("settings-ptz-speed-value");
   const server = document.getElementById("server-ip");
+  const streamMode = document.getElementById("stream-mode");
 
   // If settings view is not loaded yet, simply return
   if (!slider || !badge || !server) {
@@ -30,6 +35,7 @@ function loadSettings() {
       const parsed = JSON.parse(savedSettings);
       settings.ptzSpeed = parsed.ptzSpeed || settings.ptzSpeed;
       settings.serverIP = parsed.serverIP || settings.serverIP;
+      settings.streamMode = parsed.streamMode || settings.streamMode;
     } catch (e) {
       console.error("Failed to parse saved settings", e);
     }
@@ -40,6 +46,7 @@ function loadSettings() {
   document.getElementById("settings-ptz-speed-value").textContent =
     settings.ptzSpeed;
   document.getElementById("server-ip").value = settings.serverIP;
+  if (streamMode) streamMode.value = settings.streamMode;
 
   // Also update the main PTZ speed control if it exists
   const mainPtzSpeed = document.getElementById("ptz-speed");
@@ -89,6 +96,8 @@ function setupSaveButton() {
       10
     );
     settings.serverIP = document.getElementById("server-ip").value.trim();
+    const streamMode = document.getElementById("stream-mode");
+    if (streamMode) settings.streamMode = streamMode.value;
 
     localStorage.setItem("cameraSettings", JSON.stringify(settings));
 
@@ -120,3 +129,16 @@ export function getPTZSpeed() {
 export function getServerIP() {
   return settings.serverIP;
 }
+
+export function getStreamMode() {
+  // the dashboard may render before the settings view was ever opened
+  const saved = localStorage.getItem("cameraSettings");
+  if (saved) {
+    try {
+      return JSON.parse(saved).streamMode || settings.streamMode;
+    } catch (e) {
+      console.error("Failed to parse saved settings", e);
+    }
+  }
+  return settings.streamMode;
+}
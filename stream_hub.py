@@ -0,0 +1,380 @@
+# stream_hub.py
+import itertools
+import threading
+import time
+
+from change_gate import ChangeGate
+
+# cv2 is imported inside the functions that use it: loading OpenCV and
+# its FFmpeg backend is the slowest part of starting the app, and most
+# workers answer API calls long before anyone opens a stream.
+
+# Keep a worker alive this long after its last viewer leaves, so a page
+# reload or a quick tab switch re-uses the open RTSP session.
+IDLE_GRACE = 10.0
+# Seconds a viewer waits for the next frame before re-checking the worker.
+FRAME_WAIT = 5.0
+RECONNECT_DELAY = 2.0
+# Never hand a viewer a frame older than this (e.g. after a stalled camera).
+MAX_FRAME_AGE = 1.0
+# A snapshot keeps the camera's session open this long, so repeated
+# snapshots are served from memory instead of a new RTSP negotiation.
+SNAPSHOT_WARM = 60.0
+SNAPSHOT_WAIT = 5.0
+
+# Requested widths are rounded up to one of these, so viewers with slightly
+# different tile sizes still share one encode.
+WIDTH_STEPS = (320, 480, 640, 960, 1280, 1920)
+
+
+def width_step(width):
+    """Round a requested output width up to the nearest shared step."""
+    if not width:
+        return None
+    for step in WIDTH_STEPS:
+        if width <= step:
+            return step
+    return None  # larger than any step: send the native size
+
+
+class Variant:
+    """One output encoding (width, quality, gated, raw) of a worker's frames.
+
+    A gated variant only encodes frames the worker's ChangeGate lets
+    through, so a static scene costs a keepalive frame per second. A raw
+    variant skips JPEG and publishes the resized decoded frame, for
+    consumers that composite pixels themselves (mosaic.py).
+    """
+
+    def __init__(self, width, quality, gated=False, raw=False):
+        self.width = width
+        self.quality = quality
+        self.gated = gated
+        self.raw = raw
+        self.viewers = 0  # guarded by hub.lock
+        self.jpeg = None  # JPEG bytes, or a BGR frame for raw variants
+        self.seq = 0
+        self.stamp = 0.0  # monotonic capture time of ``jpeg``
+
+    @property
+    def key(self):
+        return (self.width, self.quality, self.gated, self.raw)
+
+    def encode(self, frame):
+        import cv2
+
+        h, w = frame.shape[:2]
+        if self.width and w > self.width:
+            # shrink before encoding: fewer pixels to compress and send
+            frame = cv2.resize(
+                frame, (self.width, round(h * self.width / w)),
+                interpolation=cv2.INTER_AREA,
+            )
+        if self.raw:
+            return frame
+        params = []
+        if self.quality:
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        ok, buf = cv2.imencode(".jpg", frame, params)
+        return buf.tobytes() if ok else None
+
+
+class CaptureWorker:
+    """One RTSP session per stream: decode once, encode once per variant."""
+
+    def __init__(self, hub, key, cam_id, rtsp):
+        self.hub = hub
+        self.key = key
+        self.cam_id = cam_id
+        self.rtsp = rtsp
+        self.viewers = 0  # guarded by hub.lock
+        self.variants = {}  # Variant.key -> Variant, guarded by hub.lock
+        self.idle_since = time.monotonic()
+        self.warm_until = 0.0  # guarded by hub.lock
+        self.running = True
+        self.frame = None  # latest decoded frame, for snapshots
+        self.frame_stamp = 0.0
+        self.gate = ChangeGate(cam_id)  # runs on every frame: also feeds activity events
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(
+            target=self._run, name=f"capture-{cam_id}", daemon=True
+        )
+
+    def _open(self):
+        import cv2
+
+        cap = cv2.VideoCapture(self.rtsp, cv2.CAP_FFMPEG)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+
+    def _should_stop(self):
+        with self.hub.lock:
+            now = time.monotonic()
+            if (
+                self.viewers == 0
+                and now - self.idle_since > IDLE_GRACE
+                and now > self.warm_until
+            ):
+                # unregister while holding the hub lock so no new viewer
+                # can attach to a worker that is about to exit
+                self.hub.workers.pop(self.key, None)
+                self.running = False
+                return True
+        return False
+
+    def _run(self):
+        cap = self._open()
+        if cap is None:
+            print(f"Error: cannot open stream for cam {self.cam_id}")
+        try:
+            while cap is not None and not self._should_stop():
+                # grab/retrieve to skip buffered frames
+                cap.grab()
+                ok, frame = cap.retrieve()
+                if not ok or frame is None:
+                    print(f"Stream for cam {self.cam_id} dropped, reconnecting")
+                    cap.release()
+                    time.sleep(RECONNECT_DELAY)
+                    cap = self._open()
+                    continue
+                with self.hub.lock:
+                    variants = [v for v in self.variants.values() if v.viewers]
+                # a few microseconds on a 64 px sample; skipped encodes are the win
+                changed = self.gate.check(frame)
+                encoded = [(v, v.encode(frame)) for v in variants if changed or not v.gated]
+                self.publish(frame, encoded)
+        finally:
+            if cap is not None:
+                cap.release()
+            with self.hub.lock:
+                if self.hub.workers.get(self.key) is self:
+                    del self.hub.workers[self.key]
+                self.running = False
+            with self.cond:
+                self.cond.notify_all()
+
+    def publish(self, frame, encoded):
+        # Only the newest frame is kept per variant: viewers that fell behind
+        # pick up the latest one and the capture loop never waits on them.
+        now = time.monotonic()
+        with self.cond:
+            self.frame = frame
+            self.frame_stamp = now
+            for variant, jpeg in encoded:
+                if jpeg is not None:
+                    variant.jpeg = jpeg
+                    variant.seq += 1
+                    variant.stamp = now
+            self.cond.notify_all()
+
+    def wait_frame(self, variant, last_seq, timeout=FRAME_WAIT):
+        """Block until ``variant`` has a fresh frame newer than ``last_seq``; returns (jpeg, seq)."""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: (
+                    variant.seq != last_seq
+                    and time.monotonic() - variant.stamp <= MAX_FRAME_AGE
+                )
+                or not self.running,
+                timeout,
+            )
+            if variant.seq == last_seq or time.monotonic() - variant.stamp > MAX_FRAME_AGE:
+                return None, last_seq
+            return variant.jpeg, variant.seq
+
+
+    def latest_frame(self, timeout=SNAPSHOT_WAIT):
+        """(frame, monotonic capture time) no older than MAX_FRAME_AGE, or (None, None)."""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: (
+                    self.frame is not None
+                    and time.monotonic() - self.frame_stamp <= MAX_FRAME_AGE
+                )
+                or not self.running,
+                timeout,
+            )
+            if self.frame is None or time.monotonic() - self.frame_stamp > MAX_FRAME_AGE:
+                return None, None
+            return self.frame, self.frame_stamp
+
+
+class Viewer:
+    """Per-client delivery counters, exposed through StreamHub.stats()."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, cam_id, client, fps, width, quality, gated=False):
+        self.id = next(self._ids)
+        self.cam_id = cam_id
+        self.client = client
+        self.fps = fps
+        self.width = width
+        self.quality = quality
+        self.gated = gated
+        self.started = time.time()
+        self.sent = 0
+        self.dropped = 0  # newer frame arrived before the client took the last one
+        self.skipped = 0  # held back by the fps cap
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "camId": self.cam_id,
+            "client": self.client,
+            "fps": self.fps,
+            "width": self.width,
+            "quality": self.quality,
+            "gated": self.gated,
+            "started": self.started,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+        }
+
+
+class StreamHub:
+    """Registry of shared capture workers, started on first viewer."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.viewers = {}  # Viewer.id -> Viewer
+
+    def _worker(self, cam_id, rtsp):
+        """Live worker for ``rtsp``, started if needed. Caller holds self.lock."""
+        worker = self.workers.get(rtsp)
+        if worker is None:
+            worker = CaptureWorker(self, rtsp, cam_id, rtsp)
+            self.workers[rtsp] = worker
+            worker.thread.start()
+        return worker
+
+    def acquire(self, cam_id, rtsp, width=None, quality=None, gated=False, raw=False):
+        key = (width, quality, gated, raw)
+        with self.lock:
+            worker = self._worker(cam_id, rtsp)
+            variant = worker.variants.get(key)
+            if variant is None:
+                variant = worker.variants[key] = Variant(width, quality, gated, raw)
+            variant.viewers += 1
+            worker.viewers += 1
+        return worker, variant
+
+    def snapshot(self, cam_id, rtsp):
+        """Latest frame from the camera's live session, opening one if needed.
+
+        The session stays warm for SNAPSHOT_WARM seconds afterwards.
+        """
+        return self.snapshot_at(cam_id, rtsp)[0]
+
+    def snapshot_at(self, cam_id, rtsp):
+        """Like snapshot(), but returns (frame, wall-clock capture time)."""
+        with self.lock:
+            # only the main stream's own session: a substream or a mosaic
+            # tile's worker would give a smaller (or gated, older) frame
+            worker = self._worker(cam_id, rtsp)
+            worker.warm_until = time.monotonic() + SNAPSHOT_WARM
+        frame, stamp = worker.latest_frame()
+        if frame is None:
+            return None, None
+        return frame, time.time() - (time.monotonic() - stamp)
+
+    def snapshot_jpeg(self, cam_id, rtsp):
+        """Like snapshot_at(), encoded: (jpeg bytes, width, height, wall time) or Nones."""
+        import cv2
+
+        frame, captured_at = self.snapshot_at(cam_id, rtsp)
+        if frame is None:
+            return None, None, None, None
+        ok, buf = cv2.imencode(".jpg", frame)
+        if not ok:
+            return None, None, None, None
+        h, w = frame.shape[:2]
+        return buf.tobytes(), w, h, captured_at
+
+    def release(self, worker, variant):
+        with self.lock:
+            variant.viewers -= 1
+            worker.viewers -= 1
+            if variant.viewers == 0:
+                worker.variants.pop(variant.key, None)
+            if worker.viewers == 0:
+                worker.idle_since = time.monotonic()
+
+    def frames(self, cam_id, rtsp, width=None, quality=None, fps=None, client=None,
+               gated=False):
+        """Yield JPEG bytes for one viewer until the worker stops.
+
+        ``fps`` caps this viewer's rate; frames that arrive while the client
+        is still writing the previous one are dropped, not queued.
+        ``gated`` sends only changed frames plus a keepalive (ChangeGate).
+        """
+        width = width_step(width)
+        worker, variant = self.acquire(cam_id, rtsp, width, quality, gated)
+        viewer = Viewer(cam_id, client, fps, width, quality, gated)
+        with self.lock:
+            self.viewers[viewer.id] = viewer
+        interval = 1.0 / fps if fps else 0.0
+        try:
+            seq = 0
+            behind = 0
+            while True:
+                # always the newest frame; anything in between is never sent
+                jpeg, new_seq = worker.wait_frame(variant, seq)
+                if jpeg is None:
+                    if not worker.running:
+                        return
+                    continue
+                if seq:
+                    missed = new_seq - seq - 1
+                    viewer.dropped += min(missed, behind)
+                    viewer.skipped += missed - min(missed, behind)
+                seq = new_seq
+                sent_at = time.monotonic()
+                yield jpeg
+                viewer.sent += 1
+                # frames published while the client was still writing
+                behind = variant.seq - seq
+                if interval:
+                    delay = interval - (time.monotonic() - sent_at)
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            with self.lock:
+                self.viewers.pop(viewer.id, None)
+            self.release(worker, variant)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": [
+                    {
+                        "camId": w.cam_id,
+                        "viewers": w.viewers,
+                        "variants": [
+                            {
+                                "width": v.width,
+                                "quality": v.quality,
+                                "gated": v.gated,
+                                "raw": v.raw,
+                                "frames": v.seq,
+                            }
+                            for v in w.variants.values()
+                        ],
+                    }
+                    for w in self.workers.values()
+                ],
+                "viewers": [v.as_dict() for v in self.viewers.values()],
+            }
+
+    def activity(self):
+        """Change-detection state of every running capture worker."""
+        with self.lock:
+            return [w.gate.as_dict() for w in self.workers.values()]
+
+
+hub = StreamHub()
@@ -0,0 +1,95 @@
+# test_change_gate.py
+import numpy as np
+import pytest
+
+import change_gate
+from change_gate import ChangeGate
+from events import EventBus
+
+# 64 columns at stride 1: one sample point per pixel
+W, H = change_gate.SAMPLE_WIDTH, 48
+T0 = 100.0  # check() times are monotonic seconds; start well past 0
+
+
+def frame(level=100):
+    return np.full((H, W, 3), level, np.uint8)
+
+
+def with_patch(share, delta, level=100):
+    """A frame whose first ``share`` of sample points moved by ``delta`` grey levels."""
+    f = frame(level)
+    f.reshape(-1, 3)[: int(round(share * W * H))] += np.uint8(delta)
+    return f
+
+
+@pytest.fixture
+def activity(monkeypatch):
+    seen = []
+    bus = EventBus()
+    bus.listen(lambda kind, data: seen.append((kind, data)))
+    monkeypatch.setattr(change_gate, "bus", bus)
+    return seen
+
+
+def test_first_frame_passes_then_static_scene_is_gated():
+    gate = ChangeGate(1)
+    assert gate.check(frame(), T0)
+    assert not gate.check(frame(), T0 + 0.1)
+    assert not gate.check(frame(), T0 + 0.5)
+
+
+def test_keepalive_lets_a_static_frame_through():
+    gate = ChangeGate(1)
+    gate.check(frame(), T0)
+    assert not gate.check(frame(), T0 + change_gate.KEEPALIVE - 0.1)
+    assert gate.check(frame(), T0 + change_gate.KEEPALIVE)
+    assert not gate.check(frame(), T0 + change_gate.KEEPALIVE + 0.1)
+    assert gate.check(frame(), T0 + 2 * change_gate.KEEPALIVE)
+
+
+def test_noise_below_pixel_delta_is_not_a_change():
+    gate = ChangeGate(1)
+    gate.check(frame(), T0)
+    assert not gate.check(with_patch(1.0, change_gate.PIXEL_DELTA), T0 + 0.1)
+    assert gate.score == 0.0
+
+
+def test_change_fraction_threshold():
+    share = change_gate.CHANGE_FRACTION
+    step = 1.0 / (W * H)
+    gate = ChangeGate(1)
+    gate.check(frame(), T0)
+    assert not gate.check(with_patch(share - step, 50), T0 + 0.1)
+    assert gate.check(with_patch(share + step, 50), T0 + 0.2)
+    assert gate.active
+
+
+def test_hold_keeps_frames_flowing_after_a_change():
+    gate = ChangeGate(1)
+    gate.check(frame(), T0)
+    assert gate.check(frame(160), T0 + 0.1)
+    # static again, but still within HOLD of the change
+    assert gate.check(frame(160), T0 + 0.1 + change_gate.HOLD / 2)
+    assert not gate.check(frame(160), T0 + 0.2 + change_gate.HOLD)
+
+
+def test_slow_drift_adds_up_against_the_reference():
+    step = change_gate.PIXEL_DELTA // 2 + 1
+    gate = ChangeGate(1)
+    gate.check(frame(100), T0)
+    assert not gate.check(frame(100 + step), T0 + 0.1)
+    # each frame alone moved less than PIXEL_DELTA, together they did not
+    assert gate.check(frame(100 + 2 * step), T0 + 0.2)
+
+
+def test_activity_events_on_active_and_idle(activity):
+    gate = ChangeGate(7)
+    gate.check(frame(), T0)
+    gate.check(frame(200), T0 + 0.1)
+    gate.check(frame(200), T0 + 0.1 + change_gate.IDLE_AFTER / 2)
+    assert [data["active"] for _, data in activity] == [True]
+    gate.check(frame(200), T0 + 0.2 + change_gate.IDLE_AFTER)
+    assert [(kind, data["id"], data["active"]) for kind, data in activity] == [
+        ("camera_activity", 7, True), ("camera_activity", 7, False),
+    ]
+    assert gate.changes == 1 and not gate.active
@@ -0,0 +1,72 @@
+# test_frame_ring.py
+import pytest
+
+import capture_pool
+from capture_pool import FrameRing
+
+
+@pytest.fixture
+def ring():
+    r = FrameRing(slots=2, slot_bytes=64)
+    yield r
+    r.close()
+
+
+def test_roundtrip_keeps_bytes_and_size(ring):
+    assert ring.write(1, b"jpeg-1", 10.0)
+    assert ring.read(1) == (b"jpeg-1", (0, 0))
+    assert ring.write(2, bytes(12), 11.0, size=(2, 2))
+    assert ring.read(2) == (bytes(12), (2, 2))
+
+
+def test_wraparound_reuses_slots(ring):
+    for seq in range(1, 6):
+        assert ring.write(seq, f"frame-{seq}".encode(), float(seq))
+    # 2 slots: only the last two frames survive, older ones read as lapped
+    assert ring.read(5) == (b"frame-5", (0, 0))
+    assert ring.read(4) == (b"frame-4", (0, 0))
+    assert ring.read(3) == (None, None)
+    assert ring.read(1) == (None, None)
+
+
+def test_oversize_frame_is_refused_and_slot_untouched(ring):
+    assert ring.write(1, b"small", 1.0)
+    assert not ring.write(3, bytes(65), 3.0)  # same slot as seq 1
+    assert ring.read(1) == (b"small", (0, 0))
+
+
+def test_slot_being_written_reads_as_missing(ring):
+    ring.write(1, b"old", 1.0)
+    # what write() does first: clear the slot's seq before copying
+    capture_pool.HEADER.pack_into(ring.buf, ring._offset(1), 0, 0, 0.0, 0, 0)
+    assert ring.read(1) == (None, None)
+
+
+class LapDuringCopy:
+    """HEADER stand-in: the writer laps the reader right after its first header check."""
+
+    def __init__(self, real, lap):
+        self.real = real
+        self.size = real.size
+        self.lap = lap
+        self.checks = 0
+
+    def pack_into(self, *args):
+        return self.real.pack_into(*args)
+
+    def unpack_from(self, buf, offset=0):
+        result = self.real.unpack_from(buf, offset)
+        self.checks += 1
+        if self.checks == 1:
+            self.lap()
+        return result
+
+
+def test_torn_read_is_detected(ring, monkeypatch):
+    ring.write(1, b"A" * 32, 1.0)
+    # seq 3 lands in seq 1's slot between the reader's seq check and its copy
+    lapping = LapDuringCopy(capture_pool.HEADER, lambda: ring.write(3, b"B" * 8, 3.0))
+    monkeypatch.setattr(capture_pool, "HEADER", lapping)
+    assert ring.read(1) == (None, None)
+    monkeypatch.undo()
+    assert ring.read(3) == (b"B" * 8, (0, 0))
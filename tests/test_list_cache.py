@@ -0,0 +1,81 @@
+# test_list_cache.py
+import json
+
+import list_cache
+from list_cache import VersionedList
+
+
+def test_since_reports_changed_and_deleted_ids():
+    cache = VersionedList("cameras")
+    start = cache.version
+    cache.touch(1)
+    cache.touch(2)
+    mid = cache.version
+    cache.remove(2)
+    cache.touch(3)
+    assert cache.changes_since(start) == ({1, 3}, {2})
+    assert cache.changes_since(mid) == ({3}, {2})
+    assert cache.changes_since(cache.version) == (set(), set())
+
+
+def test_readded_id_is_changed_not_deleted():
+    cache = VersionedList("cameras")
+    start = cache.version
+    cache.remove(5)
+    cache.touch(5)
+    assert cache.changes_since(start) == ({5}, set())
+
+
+def test_since_outside_the_log_means_full_list(monkeypatch):
+    monkeypatch.setattr(list_cache, "CHANGE_LOG", 3)
+    cache = VersionedList("cameras")
+    start = cache.version
+    assert cache.changes_since(cache.version + 1) is None  # from the future
+    for item_id in range(5):
+        cache.touch(item_id)
+    assert cache.changes_since(start) is None  # trimmed away
+    assert cache.changes_since(cache.version - 2) == ({3, 4}, set())
+    before = cache.version
+    cache.touch_all()
+    assert cache.changes_since(before) is None
+    assert cache.changes_since(cache.version) == (set(), set())
+
+
+def test_body_is_cached_until_a_write():
+    rows = [{"id": 1, "name": "gate"}]
+    builds = []
+
+    def build():
+        builds.append(1)
+        return list(rows)
+
+    cache = VersionedList("cameras")
+    version, body, _ = cache.get(build)
+    assert json.loads(body) == rows
+    assert cache.get(build)[:2] == (version, body)
+    assert len(builds) == 1
+    cache.touch(1)
+    assert cache.get(build)[0] == cache.version > version
+    assert len(builds) == 2
+
+
+def test_ttl_rebuild_logs_rows_changed_elsewhere(monkeypatch):
+    rows = [{"id": 1, "name": "gate"}, {"id": 2, "name": "yard"}]
+    cache = VersionedList("cameras")
+    first, _, _ = cache.get(lambda: rows)
+    rows = [{"id": 1, "name": "front gate"}, {"id": 3, "name": "dock"}]
+    # still fresh: the stale body is served
+    assert cache.get(lambda: rows)[0] == first
+    cache.built_at -= list_cache.TTL
+    version, body, _ = cache.get(lambda: rows)
+    assert version > first
+    assert json.loads(body) == rows
+    assert cache.changes_since(first) == ({1, 3}, {2})
+
+
+def test_ttl_rebuild_with_same_rows_keeps_the_version():
+    rows = [{"id": 1, "name": "gate"}]
+    cache = VersionedList("cameras")
+    first, body, _ = cache.get(lambda: rows)
+    cache.built_at -= list_cache.TTL
+    assert cache.get(lambda: list(rows))[:2] == (first, body)
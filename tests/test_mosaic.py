@@ -0,0 +1,44 @@
+# test_mosaic.py
+import numpy as np
+import pytest
+
+import mosaic
+from mosaic import Mosaic, parse_layout
+
+
+@pytest.mark.parametrize("text, layout", [
+    ("1x1", (1, 1)), ("2x2", (2, 2)), ("4x3", (4, 3)), ("16x1", (16, 1)),
+])
+def test_parse_layout_accepts(text, layout):
+    assert parse_layout(text) == layout
+
+
+@pytest.mark.parametrize("text", [
+    None, "", "3", "0x1", "2x0", "02x2", "2X2", "2x2x2", " 2x2", "-1x2", "5x5", "17x1",
+])
+def test_parse_layout_rejects(text):
+    with pytest.raises(ValueError):
+        parse_layout(text)
+
+
+def test_tiles_follow_reading_order_and_skip_empty_cells():
+    cams = [(1, "a", "rtsp://a"), None, (3, "c", "rtsp://c"), (4, "d", "rtsp://d"),
+            (5, "extra", "rtsp://e")]
+    m = Mosaic(None, cams, (2, 2), width=640, height=360)
+    assert [(t.cam_id, t.x, t.y, t.width, t.height) for t in m.tiles] == [
+        (1, 0, 0, 320, 180), (3, 0, 180, 320, 180), (4, 320, 180, 320, 180),
+    ]
+    assert m.canvas.shape == (360, 640, 3)
+
+
+def test_draw_letterboxes_into_the_cell():
+    m = Mosaic(None, [(1, "a", "rtsp://a"), (2, "b", "rtsp://b")], (2, 1),
+               width=400, height=100)
+    left, right = m.tiles
+    m._draw(right, np.full((50, 200, 3), 255, np.uint8))  # 4:1 into a 2:1 cell
+    assert right.fit == (0, 25, 200, 50)
+    cell = m._cell(right)
+    assert (cell[25:75] == 255).all()
+    assert (cell[:25] == mosaic.BACKGROUND).all() and (cell[75:] == mosaic.BACKGROUND).all()
+    assert (m._cell(left) == mosaic.BACKGROUND).all()
+    assert m.version == 1
@@ -0,0 +1,140 @@
+# test_ptz_queue.py
+import threading
+import time
+
+import pytest
+
+import ptz_queue
+from ptz_queue import CameraPTZ, PTZQueues
+
+
+class Camera:
+    """send() stand-in: records commands and holds the first one until released."""
+
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = set(fail)
+        self.busy = threading.Event()
+        self.release = threading.Event()
+
+    def send(self, ip, action, code, speed):
+        self.calls.append((action, code, speed))
+        self.busy.set()
+        assert self.release.wait(5)
+        return (action, code) not in self.fail, "refused"
+
+
+def settle(cam, count=None):
+    """Wait until the worker is idle with nothing pending (and ``count`` sends made)."""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        stats = cam.as_dict()
+        done = stats["sent"] + stats["failed"]
+        if not stats["pending"] and stats["busyFor"] is None and (count is None or done >= count):
+            return stats
+        time.sleep(0.01)
+    pytest.fail(f"PTZ worker did not settle: {cam.as_dict()}")
+
+
+def busy_camera(fake, cam_id=1):
+    """A worker stuck sending a zoom, so move intents queue up behind it."""
+    cam = CameraPTZ(cam_id, fake.send)
+    cam.submit("10.0.0.1", "start", "ZoomTele", 3)
+    assert fake.busy.wait(5)
+    return cam
+
+
+def test_start_stop_pair_while_busy_collapses():
+    fake = Camera()
+    cam = busy_camera(fake)
+    cam.submit("10.0.0.1", "start", "Left", 5)
+    cam.submit("10.0.0.1", "stop", "Left", 5)
+    fake.release.set()
+    stats = settle(cam, 1)
+    assert fake.calls == [("start", "ZoomTele", 3)]
+    # nothing was merged: the pair was dropped
+    assert stats["coalesced"] == 0
+
+
+def test_queued_starts_keep_only_the_latest():
+    fake = Camera()
+    cam = busy_camera(fake)
+    for code in ("Left", "Right", "Up"):
+        cam.submit("10.0.0.1", "start", code, 4)
+    fake.release.set()
+    stats = settle(cam, 2)
+    assert fake.calls == [("start", "ZoomTele", 3), ("start", "Up", 4)]
+    assert stats["coalesced"] == 2
+    assert stats["moving"] == {"zoom": "ZoomTele", "move": "Up"}
+
+
+def test_repeated_stops_while_busy_send_one_stop():
+    fake = Camera()
+    fake.release.set()
+    cam = CameraPTZ(1, fake.send)
+    cam.submit("10.0.0.1", "start", "Left", 5)
+    settle(cam, 1)
+    fake.release.clear()
+    fake.busy.clear()
+    cam.submit("10.0.0.1", "start", "ZoomTele", 3)
+    assert fake.busy.wait(5)
+    cam.submit("10.0.0.1", "stop", "Left", 5)
+    cam.submit("10.0.0.1", "stop", "Left", 5)
+    fake.release.set()
+    stats = settle(cam, 3)
+    assert fake.calls[1:] == [("start", "ZoomTele", 3), ("stop", "Left", 5)]
+    assert stats["coalesced"] == 1
+
+
+def test_direction_change_stops_the_old_move_first():
+    fake = Camera()
+    cam = CameraPTZ(1, fake.send)
+    cam.submit("10.0.0.1", "start", "Left", 5)
+    assert fake.busy.wait(5)
+    # while "start Left" is in flight: stop, then a new direction
+    cam.submit("10.0.0.1", "stop", "Left", 5)
+    cam.submit("10.0.0.1", "start", "Right", 6)
+    fake.release.set()
+    stats = settle(cam, 3)
+    assert fake.calls == [("start", "Left", 5), ("stop", "Left", 5), ("start", "Right", 6)]
+    assert stats["coalesced"] == 0
+
+
+def test_groups_move_independently():
+    fake = Camera()
+    fake.release.set()
+    queues = PTZQueues(fake.send)
+    queues.submit(1, "10.0.0.1", "start", "Left", 5)
+    settle(queues.cameras[1], 1)
+    # a zoom start doesn't replace the running move
+    queues.submit(1, "10.0.0.1", "start", "ZoomTele", 2)
+    stats = settle(queues.cameras[1], 2)
+    assert stats["moving"] == {"move": "Left", "zoom": "ZoomTele"}
+    queues.submit(1, "10.0.0.1", "stop")  # no code: stop every group
+    stats = settle(queues.cameras[1], 4)
+    assert fake.calls[2:] == [("stop", "Left", 5), ("stop", "ZoomTele", 5)]
+    assert stats["moving"] == {} and stats["coalesced"] == 0
+
+
+def test_stop_without_start_is_still_sent():
+    fake = Camera()
+    fake.release.set()
+    cam = CameraPTZ(1, fake.send)
+    cam.submit("10.0.0.1", "stop", "Down", 5)
+    settle(cam, 1)
+    assert fake.calls == [("stop", "Down", 5)]
+
+
+def test_failed_stop_is_retried_failed_start_is_not(monkeypatch):
+    monkeypatch.setattr(ptz_queue, "RETRY_DELAY", 0)
+    fake = Camera(fail={("start", "Left"), ("stop", "Down")})
+    fake.release.set()
+    cam = CameraPTZ(1, fake.send)
+    cam.submit("10.0.0.1", "start", "Left", 5)
+    stats = settle(cam, 1)
+    assert fake.calls == [("start", "Left", 5)]
+    assert stats["failed"] == 1 and stats["moving"] == {}
+    cam.submit("10.0.0.1", "stop", "Down", 5)
+    stats = settle(cam, 2)
+    assert fake.calls[1:] == [("stop", "Down", 5)] * (1 + ptz_queue.STOP_RETRIES)
+    assert stats["failed"] == 2